@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from typing import Optional, Tuple
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+# noinspection PyUnresolvedReferences
+from classic_tracker.models import get_version, bump_version
+
+
+def auth_version_key(user_id: int) -> str:
+    """Cache key of the authentication version of a user, see get_auth_version. """
+
+    return f'auth_version:{user_id}'
+
+
+def get_auth_version(user_id: int) -> int:
+    """
+    Returns the version of the credentials of a user, under which their tokens are cached by
+    CachedTokenAuthentication. Unlike the data version, it does not change when the user's data is written.
+    """
+
+    return get_version(auth_version_key(user_id))
+
+
+def bump_auth_version(user_id: int) -> None:
+    """Invalidates the cached tokens of a user, once the current transaction is committed (see api.signals). """
+
+    bump_version(auth_version_key(user_id))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement of TokenAuthentication which caches the token's user, instead of fetching the token and its
+    user with a SELECT joining the token and user tables on each request.
+
+    Only the id and the few fields of the user needed to authenticate (user_fields) are cached, in Redis (L2) and
+    in a small in-process LRU cache (L1), along with the authentication version of the user (see get_auth_version).
+    Neither the token key nor the password hash is stored: Redis keys are hashes of the token keys.
+    The user is rebuilt from the cached fields, with the other fields deferred, i.e. read when they are accessed.
+
+    A cached token is only used while the authentication version is unchanged, which costs a single cache lookup
+    per request. As the version is bumped whenever the user is saved (e.g. deactivated) or deleted, or their token
+    is deleted or rotated (see api.signals), stale users are never authenticated, in any process.
+    """
+    # In seconds
+    timeout = 3600
+    # Maximum number of tokens cached by each process
+    local_cache_size = 1024
+    # Fields of the user which are cached, along with its id
+    user_fields = ('username', 'is_active', 'is_staff', 'is_superuser')
+
+    # {token key: (user fields, authentication version of the user)}, shared by the threads of the process
+    local_cache = OrderedDict()
+    local_cache_lock = Lock()
+
+    @staticmethod
+    def get_cache_key(key: str) -> str:
+        # Tokens are credentials, only their hash is stored in Redis
+        return f'auth_token:{sha256(key.encode()).hexdigest()}'
+
+    def get_local(self, key: str) -> Optional[tuple]:
+        with self.local_cache_lock:
+            entry = self.local_cache.get(key)
+            if entry is not None:
+                self.local_cache.move_to_end(key)
+            return entry
+
+    def set_local(self, key: str, entry: tuple) -> None:
+        with self.local_cache_lock:
+            self.local_cache[key] = entry
+            self.local_cache.move_to_end(key)
+            while len(self.local_cache) > self.local_cache_size:
+                self.local_cache.popitem(last=False)
+
+    def make_user(self, fields: dict):
+        """Returns a user with the cached fields loaded, and the other ones deferred. """
+
+        return get_user_model().from_db(None, list(fields), list(fields.values()))
+
+    def authenticate_credentials(self, key) -> Tuple[object, object]:
+        cache = caches['default']
+        version = None
+
+        entry = self.get_local(key)
+        if entry is not None:
+            version = get_auth_version(entry[0]['id'])
+            if entry[1] != version:
+                entry = None
+
+        if entry is None:
+            entry = cache.get(self.get_cache_key(key))
+            if entry is not None:
+                if version is None:
+                    version = get_auth_version(entry[0]['id'])
+                if entry[1] == version:
+                    self.set_local(key, entry)
+                else:
+                    entry = None
+
+        if entry is not None:
+            # Each request is given its own user, as they are not shared
+            user = self.make_user(entry[0])
+            return user, self.get_model()(key=key, user=user)
+
+        # The version is read before the token and user, so that a change committed in between invalidates them
+        if version is None:
+            user_id = self.get_model().objects.filter(key=key).values_list('user_id', flat=True).first()
+            if user_id is None:
+                raise AuthenticationFailed(_('Invalid token.'))
+            version = get_auth_version(user_id)
+
+        user, token = super().authenticate_credentials(key)
+        entry = ({'id': user.id, **{field: getattr(user, field) for field in self.user_fields}}, version)
+        cache.set(self.get_cache_key(key), entry, self.timeout)
+        self.set_local(key, entry)
+        return user, token
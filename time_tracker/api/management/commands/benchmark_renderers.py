@@ -0,0 +1,98 @@
+from datetime import date, time, timedelta
+from decimal import Decimal
+from timeit import timeit
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+# noinspection PyUnresolvedReferences
+from api.renderers import MessagePackRenderer, ORJSONRenderer
+# noinspection PyUnresolvedReferences
+from api.serializers import DaySerializer, SessionSerializer
+# noinspection PyUnresolvedReferences
+from classic_tracker.models import Day, Session
+
+
+def random_sessions(size: int, rng: np.random.Generator) -> list:
+    """Unsaved random sessions, with one day per 5 sessions. """
+
+    days = [
+        Day(
+            id=i + 1,
+            stage_id=1,
+            day=date(2020, 1, 1) + timedelta(days=i),
+            day_of_week=(i + 2) % 7 + 1,
+            session_count=5,
+            worktime=int(rng.integers(0, 4 * 3600)),
+            start=time(8, 0),
+            end=time(22, 0),
+            end_next_day=False,
+            usable_time=14 * 3600,
+            study_time=5 * 3600,
+            time_usage_ratio=Decimal(int(rng.integers(0, 10_000))) / 10_000,
+            comment='',
+        )
+        for i in range(size // 5 + 1)
+    ]
+
+    sessions = []
+    for i in range(size):
+        start = int(rng.integers(8 * 60, 21 * 60))
+        end = start + int(rng.integers(1, 60))
+        sessions.append(Session(
+            id=i + 1,
+            day=days[i // 5],
+            subject_id=int(rng.integers(1, 10)),
+            start=time(*divmod(start, 60)),
+            end=time(*divmod(end, 60)),
+            end_next_day=False,
+            duration=(end - start) * 60,
+        ))
+
+    return sessions
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the orjson and MessagePack renderers of the API against DRF\'s JSONRenderer'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            nargs='+',
+            type=int,
+            default=[1_000, 10_000, 100_000],
+            help='Numbers of (random) sessions in the rendered list.',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Number of runs per size and renderer, the mean time is reported.',
+        )
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        rng = np.random.default_rng(0)
+        renderers = [JSONRenderer(), ORJSONRenderer(), MessagePackRenderer()]
+
+        self.stdout.write(f'{"Sessions":>10} {"Renderer":>20} {"Encode (s)":>12} {"Size (kB)":>12} {"Speed-up":>10}')
+        for size in options['sizes']:
+            # The sessions are serialized with their day expanded, s.t. the list has times, dates and decimals.
+            # Serialization is left out, as it is the same for all renderers: only the encoding is timed.
+            results = SessionSerializer(random_sessions(size, rng), many=True, expand={'day': DaySerializer}).data
+            data = {'count': size, 'next': None, 'previous': None, 'results': results}
+
+            content = [renderer.render(data) for renderer in renderers]
+            assert content[0] == content[1], 'JSON renderers disagree'
+
+            reference_time = None
+            for renderer, rendered in zip(renderers, content):
+                encode_time = timeit(lambda: renderer.render(data), number=repeat) / repeat
+                reference_time = reference_time or encode_time
+                self.stdout.write(
+                    f'{size:>10} {type(renderer).__name__:>20} {encode_time:>12.4f} {len(rendered) / 1000:>12.1f} '
+                    f'{reference_time / encode_time:>9.1f}x'
+                )
+
+        self.stdout.write(self.style.SUCCESS('Done!'))
@@ -0,0 +1,145 @@
+import asyncio
+from time import perf_counter
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Connection:
+    """Minimal HTTP/1.1 client connection, reopened when the server closes it (e.g. gunicorn's sync workers). """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def get(self, path: str, headers: str) -> int:
+        """Sends a GET request, reads the whole response, and returns its status code. """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        self.writer.write(f'GET {path} HTTP/1.1\r\nHost: {self.host}\r\n{headers}\r\n'.encode('latin1'))
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length, chunked, close = 0, False, False
+        while True:
+            line = (await self.reader.readline()).decode('latin1')
+            if line in ('\r\n', ''):
+                break
+            name, _, value = line.partition(':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'transfer-encoding':
+                chunked = 'chunked' in value
+            elif name == 'connection':
+                close = value == 'close'
+
+        if chunked:
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await self.reader.readexactly(length)
+
+        if close:
+            await self.close()
+        return status
+
+
+async def run_client(url: str, paths: List[str], headers: str, deadline: float, latencies: list, errors: list) -> None:
+    """Sends requests on one connection until the deadline, cycling through paths. """
+    parts = urlsplit(url)
+    connection = Connection(parts.hostname, parts.port or 80)
+    i = 0
+    try:
+        while perf_counter() < deadline:
+            start = perf_counter()
+            try:
+                status = await connection.get(parts.path.rstrip('/') + paths[i % len(paths)], headers)
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                status = None
+                await connection.close()
+            if status == 200:
+                latencies.append(perf_counter() - start)
+            else:
+                errors.append(status)
+            i += 1
+    finally:
+        await connection.close()
+
+
+async def load_test(url: str, paths: List[str], headers: str, concurrency: int, duration: float) -> Tuple[list, list]:
+    latencies, errors = [], []
+    deadline = perf_counter() + duration
+    await asyncio.gather(*(
+        # Clients start at different paths, s.t. all endpoints are requested at the same time
+        run_client(url, paths[i % len(paths):] + paths[:i % len(paths)], headers, deadline, latencies, errors)
+        for i in range(concurrency)
+    ))
+    return latencies, errors
+
+
+class Command(BaseCommand):
+    help = 'Load test the read endpoints of running servers, e.g. gunicorn with sync workers (time_tracker.wsgi) ' \
+           'against gunicorn with uvicorn workers (time_tracker.asgi, see gunicorn_conf.py), and compare their ' \
+           'requests per second and latencies at a given concurrency'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'urls',
+            nargs='+',
+            help='Base URLs of the servers, e.g. http://localhost:8000 http://localhost:8001.',
+        )
+        parser.add_argument(
+            '--paths',
+            nargs='+',
+            default=['/api/days/', '/api/sessions/?expand=day,subject', '/api/days/?cursor=', '/api/me/'],
+            help='Paths requested in turn by each connection.',
+        )
+        parser.add_argument('--token', help='API token of the user whose data is read (see /api/token/).')
+        parser.add_argument('--cookie', help='Cookie header, e.g. sessionid=..., for the dashboard data.')
+        parser.add_argument(
+            '--concurrency',
+            nargs='+',
+            type=int,
+            default=[10, 100, 500],
+            help='Numbers of concurrent connections.',
+        )
+        parser.add_argument('--duration', type=float, default=20, help='Duration of each run, in seconds.')
+
+    def handle(self, *args, **options):
+        headers = ''
+        if options['token']:
+            headers += f'Authorization: Token {options["token"]}\r\n'
+        if options['cookie']:
+            headers += f'Cookie: {options["cookie"]}\r\n'
+        if not headers:
+            raise CommandError('A token or a cookie is required, the endpoints are only served to logged in users.')
+
+        self.stdout.write(
+            f'{"Server":>30} {"Concurrency":>12} {"Requests/s":>12} {"p50 (ms)":>10} {"p99 (ms)":>10} {"Errors":>8}'
+        )
+        for concurrency in options['concurrency']:
+            for url in options['urls']:
+                latencies, errors = asyncio.run(
+                    load_test(url, options['paths'], headers, concurrency, options['duration'])
+                )
+                p50, p99 = np.percentile(latencies, [50, 99]) * 1000 if latencies else (float('nan'),) * 2
+                self.stdout.write(
+                    f'{url:>30} {concurrency:>12} {len(latencies) / options["duration"]:>12.1f} '
+                    f'{p50:>10.1f} {p99:>10.1f} {len(errors):>8}'
+                )
+
+        self.stdout.write(self.style.SUCCESS('Done!'))
@@ -0,0 +1,119 @@
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+# noinspection PyUnresolvedReferences
+from classic_tracker.pagination import CounterPaginator, KeysetPaginator, InvalidCursor
+
+
+class PageNumberOrCursorPagination(PageNumberPagination):
+    """
+    Page number pagination, unless the cursor query parameter is given (empty for the first page):
+    the list is then paginated with a KeysetPaginator, s.t. deep pages are as fast as the first one.
+    Cursor pages have no count, only next and previous links.
+
+    With page numbers, the count is taken from the get_counter_count() method of the view when it returns one,
+    i.e. when the list matches a denormalized counter, otherwise it is counted.
+    """
+    cursor_query_param = 'cursor'
+    cursor_query_description = 'Opt-in keyset pagination: empty for the first page, ' \
+                               'then the cursor of the next/previous link. Takes precedence over page.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Unordered lists are given from the last created object, as in the HTML lists, s.t. pages are stable
+        if not queryset.ordered:
+            queryset = queryset.order_by('-id')
+
+        if self.cursor_query_param not in request.query_params:
+            self.keyset_page = None
+            get_counter_count = getattr(view, 'get_counter_count', None)
+            self.counter_count = get_counter_count() if get_counter_count is not None else None
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        paginator = KeysetPaginator(queryset, self.get_page_size(request))
+        try:
+            self.keyset_page = paginator.page(request.query_params[self.cursor_query_param])
+        except InvalidCursor:
+            raise NotFound('Invalid cursor.')
+
+        return self.keyset_page.object_list
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Async version of paginate_queryset (see api.views.AsyncReadMixin): the page, and the count when there is
+        no counter, are read with the async ORM.
+        """
+        if not queryset.ordered:
+            queryset = queryset.order_by('-id')
+
+        self.request = request
+        if self.cursor_query_param in request.query_params:
+            paginator = KeysetPaginator(queryset, self.get_page_size(request))
+            try:
+                self.keyset_page = await paginator.apage(request.query_params[self.cursor_query_param])
+            except InvalidCursor:
+                raise NotFound('Invalid cursor.')
+            return self.keyset_page.object_list
+
+        self.keyset_page = None
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        # Counters may be read from the database, e.g. the session count of a day
+        get_counter_count = getattr(view, 'get_counter_count', None)
+        self.counter_count = await sync_to_async(get_counter_count)() if get_counter_count is not None else None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        await paginator.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = await paginator.apage(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return list(self.page)
+
+    def django_paginator_class(self, queryset, page_size):
+        """Paginator used by PageNumberPagination, given the count of the view. """
+        return CounterPaginator(queryset, page_size, count=self.counter_count)
+
+    def get_cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        if self.keyset_page is None:
+            return super().get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ('next', self.get_cursor_link(self.keyset_page.next_cursor)),
+            ('previous', self.get_cursor_link(self.keyset_page.previous_cursor)),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count']['description'] = 'Absent when paginating with a cursor.'
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append({
+            'name': self.cursor_query_param,
+            'required': False,
+            'in': 'query',
+            'description': self.cursor_query_description,
+            'schema': {'type': 'string'},
+        })
+        return parameters
@@ -0,0 +1,122 @@
+import csv
+import json
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List
+
+import msgpack
+import orjson
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Types which orjson and msgpack cannot encode natively (Decimal, lazy strings, QuerySet, ...), and datetimes,
+# which orjson would encode differently (e.g. +00:00 instead of Z), are encoded as by DRF's JSONRenderer
+encode_default = JSONEncoder().default
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    Drop-in replacement of DRF's JSONRenderer based on orjson, with the same output: compact, UTF-8,
+    and with the representation of DRF's JSON encoder for the types which are not JSON native.
+    """
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        # As JSONRenderer, the indent parameter of the media type (or of the context, for the browsable API)
+        # is honored. orjson only supports an indent of 2 spaces.
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        params = dict(
+            param.strip().split('=', 1) for param in (accepted_media_type or '').split(';')[1:] if '=' in param
+        )
+        if params.get('indent') or (renderer_context or {}).get('indent'):
+            option |= orjson.OPT_INDENT_2
+
+        # As JSONRenderer, the line and paragraph separators are escaped, since they are invalid in JavaScript strings
+        return orjson.dumps(data, default=encode_default, option=option) \
+            .replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack renderer: a binary and more compact encoding of the same values as the JSON renderers,
+    i.e. decimals, dates and times are strings as in JSON.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    Renderer of the export endpoints, whose rows are streamed by stream() rather than rendered at once.
+    render() is only used for the other responses, e.g. errors.
+    """
+    charset = 'utf-8'
+
+    def stream(self, rows: Iterable[dict], fields: List[str]) -> Iterator[bytes]:
+        """Yields the encoded rows one by one, fields being the keys of each row. """
+        raise NotImplementedError
+
+    async def astream(self, rows: AsyncIterable[dict], fields: List[str]) -> AsyncIterator[bytes]:
+        """Async version of stream, for the rows read by the async ORM. """
+        raise NotImplementedError
+        yield
+
+
+class NDJSONRenderer(StreamingRenderer):
+    """Newline delimited JSON: one JSON object per line. Dates, times and decimals are encoded as in the API. """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps(data, cls=DjangoJSONEncoder) + '\n').encode(self.charset)
+
+    def stream(self, rows, fields):
+        encoder = DjangoJSONEncoder()
+        for row in rows:
+            yield (encoder.encode(row) + '\n').encode(self.charset)
+
+    async def astream(self, rows, fields):
+        encoder = DjangoJSONEncoder()
+        async for row in rows:
+            yield (encoder.encode(row) + '\n').encode(self.charset)
+
+
+class Echo:
+    """File-like object which returns what is written to it, s.t. csv.writer outputs its lines one by one. """
+
+    def write(self, value):
+        return value
+
+
+class CSVRenderer(StreamingRenderer):
+    """CSV with a header line. Missing values (e.g. an end time to complete later) are empty. """
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, dict):
+            data = {'detail': data}
+        return b''.join(self.stream([data], list(data)))
+
+    def stream(self, rows, fields):
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields).encode(self.charset)
+        for row in rows:
+            yield writer.writerow([row[field] for field in fields]).encode(self.charset)
+
+    async def astream(self, rows, fields):
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields).encode(self.charset)
+        async for row in rows:
+            yield writer.writerow([row[field] for field in fields]).encode(self.charset)
@@ -0,0 +1,14 @@
+from rest_framework.routers import DefaultRouter
+
+
+class BulkRouter(DefaultRouter):
+    """
+    Default router whose list route also maps PATCH and DELETE requests, to the bulk_update and bulk_destroy actions
+    of the viewsets which have them (see api.views.BulkUpdateDestroyMixin).
+    """
+    routes = [
+        DefaultRouter.routes[0]._replace(
+            mapping={**DefaultRouter.routes[0].mapping, 'patch': 'bulk_update', 'delete': 'bulk_destroy'}
+        ),
+        *DefaultRouter.routes[1:],
+    ]
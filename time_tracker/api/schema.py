@@ -0,0 +1,63 @@
+from drf_spectacular.openapi import AutoSchema as BaseAutoSchema
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter
+
+
+class AutoSchema(BaseAutoSchema):
+    """Schema of the API, which also documents the parameters and actions added by the mixins of the views. """
+    # Actions of the list route added by BulkUpdateDestroyMixin, see api.routers.BulkRouter
+    bulk_actions = ('bulk_update', 'bulk_destroy')
+
+    def get_operation_id(self):
+        # Otherwise, the bulk actions would have the ids of the partial_update and destroy actions of the detail route
+        action = getattr(self.view, 'action', None)
+        if action in self.bulk_actions:
+            return '_'.join([token.replace('-', '_') for token in self._tokenize_path()] + [action])
+        return super().get_operation_id()
+
+    def get_request_serializer(self):
+        if getattr(self.view, 'action', None) == 'bulk_update':
+            return self.view.get_serializer_class()(many=True, partial=True)
+        return super().get_request_serializer()
+
+    def get_response_serializers(self):
+        if getattr(self.view, 'action', None) == 'bulk_update':
+            return self.view.get_serializer_class()(many=True)
+        return super().get_response_serializers()
+
+    def _get_paginator(self):
+        # Bulk updates return all updated objects, unpaginated
+        if getattr(self.view, 'action', None) in self.bulk_actions:
+            return None
+        return super()._get_paginator()
+
+    def get_override_parameters(self):
+        parameters = super().get_override_parameters()
+
+        # The views cannot be imported here, as they import this schema class through the settings
+        if hasattr(self.view, 'get_sparse_fieldset') and self.method == 'GET':
+            fields = ', '.join(
+                name for name, field in self.view.get_serializer_class()().fields.items() if not field.write_only
+            )
+            parameters += [
+                OpenApiParameter(
+                    'fields',
+                    OpenApiTypes.STR,
+                    description=f'Comma separated list of the fields to return, among: {fields}. No space after comma.',
+                ),
+                OpenApiParameter(
+                    'omit',
+                    OpenApiTypes.STR,
+                    description='Comma separated list of the fields not to return. No space after comma.',
+                ),
+            ]
+
+        if getattr(self.view, 'expandable_fields', None) and self.method == 'GET':
+            parameters.append(OpenApiParameter(
+                'expand',
+                OpenApiTypes.STR,
+                description=f'Comma separated list of the related objects to inline instead of their ids, among: '
+                            f'{", ".join(self.view.expandable_fields)}. No space after comma.',
+            ))
+
+        return parameters
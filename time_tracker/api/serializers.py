@@ -1,12 +1,45 @@
 # noinspection PyUnresolvedReferences
 from classic_tracker.models import User, Stage, Day, Session, Subject
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
+from rest_framework.fields import empty
 
 
-class UserSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+    """
+    Serializer taking the names of the fields to keep in an optional fields argument, the others being removed.
+    See api.views.SparseFieldsetMixin, which passes the fields requested by clients.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class ExpandMixin:
+    """
+    Serializer taking an optional expand argument {field name: serializer class}, which replaces the primary keys of
+    these related fields by the related objects, serialized by the given classes.
+    See api.views.ExpandMixin, which passes the fields requested by clients.
+    """
+
+    def __init__(self, *args, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        for name, serializer_class in (expand or {}).items():
+            if name in self.fields:
+                self.fields[name] = serializer_class(read_only=True)
+
+
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for the user model. """
 
     class Meta:
@@ -80,11 +113,77 @@ class UserSerializer(serializers.ModelSerializer):
         return data
 
 
-class StageSerializer(serializers.ModelSerializer):
+class OwnedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key related field which first looks up the related object among the ones prefetched for a whole array
+    of objects by BulkCreateListSerializer. Other objects (e.g. of another user) are fetched one by one as usual,
+    so that validation errors stay the same.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # {primary key: object of the current user}
+        self.prefetched_objects = {}
+
+    def to_internal_value(self, data):
+        try:
+            return self.prefetched_objects[int(data)]
+        except (KeyError, TypeError, ValueError):
+            return super().to_internal_value(data)
+
+
+class BulkCreateListSerializer(serializers.ListSerializer):
+    """
+    List serializer (used for the arrays of objects posted to the API) which creates all objects at once with the
+    create_in_bulk method of the model, instead of saving them one by one (and likewise updates them with the
+    update_in_bulk method, for the models which have one). The number of queries made does not depend on the number
+    of objects, which is limited to settings.API_MAX_BATCH_SIZE.
+    The whole array is validated before anything is saved, so that either all objects or none of them are saved.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', settings.API_MAX_BATCH_SIZE)
+        super().__init__(*args, **kwargs)
+
+    def to_internal_value(self, data):
+        # Arrays too large are rejected by ListSerializer before their items are validated
+        if isinstance(data, list) and (self.max_length is None or len(data) <= self.max_length):
+            self.prefetch_related_objects(data)
+        return super().to_internal_value(data)
+
+    def prefetch_related_objects(self, data: list) -> None:
+        """
+        Fetches the objects referenced by all items with one query per related field, instead of one query per item.
+        Only the objects of the current user are fetched, so that they can be related to the new objects.
+        """
+        user = self.context['request'].user
+        for field in self.child.fields.values():
+            if isinstance(field, OwnedPrimaryKeyRelatedField) and not field.read_only:
+                pks = {str(item.get(field.field_name)) for item in data if isinstance(item, dict)}
+                field.prefetched_objects = field.get_queryset().filter(user=user) \
+                    .in_bulk([int(pk) for pk in pks if pk.isdigit()])
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        return model.create_in_bulk([model(**attrs) for attrs in validated_data])
+
+    def update(self, instance, validated_data):
+        """
+        Updates the objects of instance (a list), the i-th of which is given by the i-th item, with the update_in_bulk
+        method of the model. See api.views.BulkUpdateDestroyMixin, which fetches the objects in the order of the items.
+        """
+        for obj, attrs in zip(instance, validated_data):
+            for attr, value in attrs.items():
+                setattr(obj, attr, value)
+        return self.child.Meta.model.update_in_bulk(instance)
+
+
+class StageSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for the stage model. """
 
     class Meta:
         model = Stage
+        list_serializer_class = BulkCreateListSerializer
         fields = (
             'id',
             'name',
@@ -107,11 +206,13 @@ class StageSerializer(serializers.ModelSerializer):
         )
 
 
-class DaySerializer(serializers.ModelSerializer):
+class DaySerializer(SparseFieldsetMixin, ExpandMixin, serializers.ModelSerializer):
     """Serializer for the day model. """
+    serializer_related_field = OwnedPrimaryKeyRelatedField
 
     class Meta:
         model = Day
+        list_serializer_class = BulkCreateListSerializer
         fields = (
             'id',
             'stage',
@@ -138,18 +239,20 @@ class DaySerializer(serializers.ModelSerializer):
 
     def validate_stage(self, value):
         """Field-level validation which makes sure that the related stage belongs to the current user. """
-        # value is an object of the related field class
-        if value.user != self.context['request'].user:
+        # value is an object of the related field class. Comparing ids spares the query loading its user.
+        if value.user_id != self.context['request'].user.id:
             raise serializers.ValidationError("The related field does not belong to the current user.")
 
         return value
 
 
-class SessionSerializer(serializers.ModelSerializer):
+class SessionSerializer(SparseFieldsetMixin, ExpandMixin, serializers.ModelSerializer):
     """Serializer for the session model. """
+    serializer_related_field = OwnedPrimaryKeyRelatedField
 
     class Meta:
         model = Session
+        list_serializer_class = BulkCreateListSerializer
         fields = (
             'id',
             'day',
@@ -167,7 +270,7 @@ class SessionSerializer(serializers.ModelSerializer):
     def validate_day(self, value):
         """Field-level validation which makes sure that the related day belongs to the current user. """
         # value is an object of the Day class
-        if value.user != self.context['request'].user:
+        if value.user_id != self.context['request'].user.id:
             raise serializers.ValidationError("The related field does not belong to the current user.")
 
         return value
@@ -175,17 +278,18 @@ class SessionSerializer(serializers.ModelSerializer):
     def validate_subject(self, value):
         """Field-level validation which makes sure that the related subject belongs to the current user. """
         # value is an object of the Subject class
-        if value.user != self.context['request'].user:
+        if value.user_id != self.context['request'].user.id:
             raise serializers.ValidationError("The related field does not belong to the current user.")
 
         return value
 
 
-class SubjectSerializer(serializers.ModelSerializer):
+class SubjectSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for the subject model. """
 
     class Meta:
         model = Subject
+        list_serializer_class = BulkCreateListSerializer
         fields = (
             'id',
             'name',
@@ -198,3 +302,144 @@ class SubjectSerializer(serializers.ModelSerializer):
             'total_study_time',
             'session_count',
         )
+
+
+class StatsQuerySerializer(serializers.Serializer):
+    """Serializer for the query parameters of the stats endpoint. """
+
+    bucket = serializers.ChoiceField(
+        choices=('day', 'week', 'month', 'weekday'),
+        default='day',
+        help_text='Time bucket: day, ISO week (starting on Monday), month, or weekday (1 = Monday to 7 = Sunday).',
+    )
+    group_by = serializers.ChoiceField(
+        choices=('stage', 'subject'),
+        required=False,
+        help_text='Splits each bucket by stage or by subject. Only study time and session count are given by subject.',
+    )
+    date_from = serializers.DateField(required=False, help_text='Earliest date, inclusive.')
+    date_to = serializers.DateField(required=False, help_text='Latest date, inclusive.')
+
+
+class ChangesQuerySerializer(serializers.Serializer):
+    """Serializer for the query parameters of the changes endpoint. """
+
+    since = serializers.IntegerField(
+        min_value=0,
+        required=False,
+        help_text='Cursor returned by the previous call. Without it, all objects are returned (initial sync).',
+    )
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=settings.API_MAX_BATCH_SIZE,
+        default=settings.API_MAX_BATCH_SIZE,
+        help_text='Maximum number of changes returned (exceeded by changes made at the same time as the last one).',
+    )
+
+
+@extend_schema_field(OpenApiTypes.STR)
+class CommaSeparatedListField(serializers.ListField):
+    """
+    List given as a comma separated string, e.g. ?stages=1,2 (without space after the commas),
+    of at most settings.API_MAX_BATCH_SIZE items.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('allow_empty', False)
+        super().__init__(**kwargs)
+
+    def get_value(self, dictionary):
+        value = dictionary.get(self.field_name, empty)
+        if value is empty or value == '':
+            return empty
+        return value.split(',') if isinstance(value, str) else value
+
+    def to_internal_value(self, data):
+        # Checked here rather than by the max_length argument, which the schema would give as the length of the string
+        if isinstance(data, list) and len(data) > settings.API_MAX_BATCH_SIZE:
+            self.fail('max_length', max_length=settings.API_MAX_BATCH_SIZE)
+        return super().to_internal_value(data)
+
+
+class RangeFilterSerializer(serializers.Serializer):
+    """
+    Serializer for the query parameters filtering days or sessions by ranges (all bounds are inclusive),
+    which are applied by api.views.filter_days and api.views.filter_sessions.
+    """
+
+    date_from = serializers.DateField(required=False, help_text='Earliest date, inclusive.')
+    date_to = serializers.DateField(required=False, help_text='Latest date, inclusive.')
+    start_from = serializers.TimeField(required=False, help_text='Earliest start time of day, inclusive, e.g. 08:00.')
+    start_to = serializers.TimeField(required=False, help_text='Latest start time of day, inclusive, e.g. 12:00.')
+
+    # Pairs of bounds, which must not be reversed
+    ranges = (('date_from', 'date_to'), ('start_from', 'start_to'), ('min_duration', 'max_duration'))
+
+    def validate(self, attrs):
+        for lower, upper in self.ranges:
+            if attrs.get(lower) is not None and attrs.get(upper) is not None and attrs[lower] > attrs[upper]:
+                raise serializers.ValidationError({upper: f'Must not be lower than {lower}.'})
+        return attrs
+
+
+class DayFilterSerializer(RangeFilterSerializer):
+    """Serializer for the query parameters filtering days. """
+
+    dates = CommaSeparatedListField(
+        child=serializers.DateField(),
+        required=False,
+        help_text='Comma separated list of dates, e.g. 2022-1-1,2022-1-2. No space after comma.',
+    )
+    stages = CommaSeparatedListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        help_text='Comma separated list of related stage ids. No space after comma.',
+    )
+    min_duration = serializers.IntegerField(
+        min_value=0, required=False, help_text='Minimum study time of the day, in seconds, inclusive.'
+    )
+    max_duration = serializers.IntegerField(
+        min_value=0, required=False, help_text='Maximum study time of the day, in seconds, inclusive.'
+    )
+
+
+class SessionFilterSerializer(RangeFilterSerializer):
+    """Serializer for the query parameters filtering sessions. """
+
+    days = CommaSeparatedListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        help_text='Comma separated list of day ids. No space after comma.',
+    )
+    subjects = CommaSeparatedListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        help_text='Comma separated list of subject ids. No space after comma.',
+    )
+    min_duration = serializers.IntegerField(
+        min_value=0, required=False, help_text='Minimum duration, in seconds, inclusive.'
+    )
+    max_duration = serializers.IntegerField(
+        min_value=0, required=False, help_text='Maximum duration, in seconds, inclusive.'
+    )
+
+
+def ordering_field(fields) -> serializers.ChoiceField:
+    """Ordering parameter of a list, whitelisted to fields (ascending, or descending with a - prefix). """
+    return serializers.ChoiceField(
+        choices=[prefix + field for field in fields for prefix in ('', '-')],
+        required=False,
+        help_text='Sort field, prefixed with - for descending order. Ties are sorted by id, in the same order.',
+    )
+
+
+class DayListQuerySerializer(DayFilterSerializer):
+    """Serializer for the query parameters of the day list. """
+
+    ordering = ordering_field(('id', 'day', 'start', 'study_time'))
+
+
+class SessionListQuerySerializer(SessionFilterSerializer):
+    """Serializer for the query parameters of the session list. """
+
+    ordering = ordering_field(('id', 'start', 'duration'))
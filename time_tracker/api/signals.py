@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import bump_auth_version
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    """
+    Tokens cached by CachedTokenAuthentication are valid for an authentication version of their user,
+    s.t. deleting (e.g. to rotate it) or saving a token invalidates it immediately.
+    """
+    bump_auth_version(instance.user_id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    """Saving (e.g. deactivating) or deleting a user invalidates the cached tokens of the user immediately. """
+    bump_auth_version(instance.id)
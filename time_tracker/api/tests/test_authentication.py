@@ -0,0 +1,111 @@
+from datetime import date, time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from ..authentication import CachedTokenAuthentication
+
+# noinspection PyUnresolvedReferences
+from classic_tracker.models import Day, Stage
+
+
+class TestCachedTokenAuthentication(TestCase):
+    """Test the authentication with cached tokens. """
+
+    def setUp(self):
+        caches['default'].clear()
+        CachedTokenAuthentication.local_cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('api:me')
+
+    def count_token_queries(self) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(self.url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return sum('authtoken_token' in query['sql'] for query in queries.captured_queries)
+
+    def test_cached(self):
+        """Test that the token is only fetched once, both with and without the in-process cache. """
+        self.assertGreater(self.count_token_queries(), 0)
+        self.assertEqual(self.count_token_queries(), 0)
+
+        CachedTokenAuthentication.local_cache.clear()
+        self.assertEqual(self.count_token_queries(), 0)
+
+    def test_invalid_token(self):
+        """Test that unknown tokens are rejected. """
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_deleted(self):
+        """Test that deleted (or rotated) tokens are rejected at once. """
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+            new_token = Token.objects.create(user=self.user)
+
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {new_token.key}')
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_user_deactivated(self):
+        """Test that the tokens of deactivated users are rejected at once. """
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_updated(self):
+        """Test that the user is refreshed when it is updated, e.g. when its counters change. """
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            stage = Stage.objects.create(user=self.user, name='Stage')
+            Day.objects.create(user=self.user, stage=stage, day=date(2022, 1, 3), start=time(8, 0))
+
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual((res.data['stage_count'], res.data['day_count']), (1, 1))
+
+    def test_data_written(self):
+        """Test that writing the data of the user keeps the token cached, and that counters are still current. """
+        self.count_token_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            stage = Stage.objects.create(user=self.user, name='Stage')
+
+        self.assertEqual(self.count_token_queries(), 0)
+        res = self.client.get(reverse('api:stage-list'))
+        self.assertEqual(res.data['count'], 1)
+        self.assertEqual(res.data['results'][0]['id'], stage.id)
+
+    def test_no_credentials_cached(self):
+        """Test that neither the token key nor the password hash is cached. """
+        self.client.get(self.url)
+        entry = caches['default'].get(CachedTokenAuthentication.get_cache_key(self.token.key))
+
+        self.assertEqual(entry[0], {
+            'id': self.user.id, 'username': 'fx', 'is_active': True, 'is_staff': False, 'is_superuser': False
+        })
+        self.assertNotIn(self.token.key, repr(entry))
+        self.assertNotIn(self.user.password, repr(entry))
@@ -0,0 +1,110 @@
+import io
+from collections import OrderedDict
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+
+import msgpack
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.translation import gettext_lazy
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from ..parsers import MessagePackParser, ORJSONParser
+from ..renderers import MessagePackRenderer, ORJSONRenderer
+
+# noinspection PyUnresolvedReferences
+from classic_tracker.models import Day, Session, Stage, Subject
+
+
+class TestRenderers(TestCase):
+    """Test the orjson and MessagePack renderers and parsers. """
+
+    data = OrderedDict([
+        ('ratio', Decimal('0.4567')),
+        ('day', date(2022, 1, 3)),
+        ('start', time(8, 30)),
+        ('created', datetime(2022, 1, 3, 8, 30, tzinfo=timezone.utc)),
+        ('name', gettext_lazy('Name')),
+        ('comment', 'Étude « à »\u2028\u2029'),
+        ('items', [1, 2.5, None, True]),
+    ])
+
+    def test_orjson_output(self):
+        """Test that the output of the orjson renderer is the one of DRF's JSON renderer. """
+        self.assertEqual(ORJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+        self.assertIn(b'\n  ', ORJSONRenderer().render(self.data, 'application/json; indent=4'))
+
+    def test_msgpack_round_trip(self):
+        """Test that values are given as in JSON by MessagePack. """
+        content = MessagePackRenderer().render(self.data)
+        self.assertEqual(
+            MessagePackParser().parse(io.BytesIO(content)),
+            ORJSONParser().parse(io.BytesIO(ORJSONRenderer().render(self.data))),
+        )
+
+    def test_parse_errors(self):
+        """Test that invalid contents are rejected with a parse error. """
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(io.BytesIO(b'{"name":'))
+        with self.assertRaises(ParseError):
+            MessagePackParser().parse(io.BytesIO(b'\xc1'))
+
+
+class TestContentNegotiation(TestCase):
+    """Test that JSON or MessagePack are used depending on the Accept and Content-Type headers. """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.stage = Stage.objects.create(user=self.user, name='Stage')
+        self.subject = Subject.objects.create(user=self.user, name='Subject')
+        self.day = Day.objects.create(
+            user=self.user, stage=self.stage, day=date(2022, 1, 3), start=time(8, 0), end=time(20, 0)
+        )
+        Session.objects.create(user=self.user, day=self.day, subject=self.subject, start=time(9, 0), end=time(10, 30))
+
+    def test_json(self):
+        """Test that decimals and times are given as before, i.e. as strings. """
+        res = self.client.get(reverse('api:day-list'))
+
+        self.assertEqual(res['Content-Type'], 'application/json')
+        day = res.json()['results'][0]
+        self.assertEqual(day['time_usage_ratio'], '0.1250')
+        self.assertEqual((day['day'], day['start'], day['end']), ('2022-01-03', '08:00:00', '20:00:00'))
+
+    def test_msgpack(self):
+        """Test that the same values are given in MessagePack, and that MessagePack can be posted. """
+        res = self.client.get(reverse('api:session-list'), HTTP_ACCEPT='application/msgpack')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/msgpack')
+        self.assertEqual(
+            msgpack.unpackb(res.content)['results'],
+            self.client.get(reverse('api:session-list')).json()['results'],
+        )
+
+        payload = {'day': self.day.id, 'subject': self.subject.id, 'start': '11:00:00', 'end': '11:45:00'}
+        res = self.client.post(
+            reverse('api:session-list'),
+            msgpack.packb(payload),
+            content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(msgpack.unpackb(res.content)['duration'], 45 * 60)
+
+    def test_invalid_content(self):
+        """Test that contents which cannot be parsed are rejected. """
+        res = self.client.post(reverse('api:stage-list'), b'\xc1', content_type='application/msgpack')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,74 @@
+from datetime import date, time
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+# noinspection PyUnresolvedReferences
+from classic_tracker.models import Day, Stage, Subject
+
+
+@override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {'read': '3/min', 'write': '2/min', 'bulk_write': '5/min'},
+})
+class TestThrottling(TestCase):
+    """Test the token bucket throttle of the API. """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.stage = Stage.objects.create(user=self.user, name='Stage')
+        self.subject = Subject.objects.create(user=self.user, name='Subject')
+        self.day = Day.objects.create(user=self.user, stage=self.stage, day=date(2022, 1, 3), start=time(8, 0))
+        self.url = reverse('api:session-list')
+
+    def post_sessions(self, n: int):
+        payload = [{'day': self.day.id, 'subject': self.subject.id, 'start': '09:00:00'}] * n
+        return self.client.post(self.url, payload if n > 1 else payload[0], format='json')
+
+    def test_separate_budgets(self):
+        """Test that reads, writes and bulk writes are throttled independently. """
+        for _ in range(2):
+            self.assertEqual(self.post_sessions(1).status_code, status.HTTP_201_CREATED)
+        res = self.post_sessions(1)
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(res['Retry-After'], '30')
+
+        for _ in range(3):
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        self.assertEqual(self.post_sessions(3).status_code, status.HTTP_201_CREATED)
+
+    def test_bulk_writes_weighted(self):
+        """Test that bulk writes cost one token per object, and that the bucket is refilled over time. """
+        with patch('api.throttling.time', return_value=1000.):
+            self.assertEqual(self.post_sessions(3).status_code, status.HTTP_201_CREATED)
+            res = self.post_sessions(3)
+            self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            # One token is missing, which takes 12 seconds
+            self.assertEqual(res['Retry-After'], '12')
+
+        with patch('api.throttling.time', return_value=1012.):
+            self.assertEqual(self.post_sessions(3).status_code, status.HTTP_201_CREATED)
+
+    def test_users_throttled_separately(self):
+        """Test that each user has their own buckets. """
+        for _ in range(3):
+            self.post_sessions(1)
+
+        other_user = get_user_model().objects.create_user(username='other', email='o@gmail.com', password='opass123')
+        self.client.force_authenticate(user=other_user)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
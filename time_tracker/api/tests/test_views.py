@@ -1,10 +1,28 @@
-from django.test import TestCase
+import csv
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, time, timedelta
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.utils import timezone
 
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from ..authentication import CachedTokenAuthentication
+from ..views import DayExportView, SessionExportView
+
+# noinspection PyUnresolvedReferences
+from classic_tracker.models import Day, Session, Stage, Subject
+
 
 class TestCreateUserView(TestCase):
     """Test the create user view. """
@@ -139,3 +157,991 @@ class TestStageViewSet(TestCase):
     #     # Delete
     #     res = self.client.delete(self.manage_user_url)
     #     self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TestCursorPagination(TestCase):
+    """Test the opt-in keyset pagination of the lists. Days are listed from the last created one. """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        stage = Stage.objects.create(user=self.user, name='Stage')
+        self.days = [
+            Day.objects.create(
+                user=self.user, stage=stage, day=date(2022, 1, 1 + i), start=time(8, 0), end=time(20, 0)
+            )
+            for i in range(15)
+        ][::-1]
+        self.url = reverse('api:day-list')
+
+    def test_page_number_by_default(self):
+        """Test that lists keep their page number pagination when no cursor is given. """
+        res = self.client.get(self.url, {'page': 2})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 15)
+        self.assertEqual([day['id'] for day in res.data['results']], [day.id for day in self.days[10:]])
+
+    def test_cursor(self):
+        """Test browsing the pages with cursors. """
+        res = self.client.get(self.url, {'cursor': ''})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', res.data)
+        self.assertIsNone(res.data['previous'])
+        self.assertEqual([day['id'] for day in res.data['results']], [day.id for day in self.days[:10]])
+
+        res = self.client.get(res.data['next'])
+        self.assertIsNone(res.data['next'])
+        self.assertEqual([day['id'] for day in res.data['results']], [day.id for day in self.days[10:]])
+
+        res = self.client.get(res.data['previous'])
+        self.assertIsNone(res.data['previous'])
+        self.assertEqual([day['id'] for day in res.data['results']], [day.id for day in self.days[:10]])
+
+    def test_invalid_cursor(self):
+        """Test that an invalid cursor is not found. """
+        res = self.client.get(self.url, {'cursor': 'invalid'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_forged_cursor(self):
+        """Test that a cursor whose position does not fit the sort column is not found. """
+        res = self.client.get(self.url, {'cursor': ''})
+        cursor = parse_qs(urlsplit(res.data['next']).query)['cursor'][0]
+        position = json.loads(urlsafe_b64decode(cursor.encode()))
+
+        for forged in ({**position, 'v': 'notadate'}, {**position, 'v': [1]}, {**position, 'id': 'notanid'}):
+            cursor = urlsafe_b64encode(json.dumps(forged).encode()).decode()
+            res = self.client.get(self.url, {'cursor': cursor})
+
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestCounterPagination(TestCase):
+    """Test that page number pagination takes the count from the denormalized counters when possible. """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.stage1 = Stage.objects.create(user=self.user, name='Stage1')
+        self.stage2 = Stage.objects.create(user=self.user, name='Stage2')
+        for i in range(12):
+            Day.objects.create(
+                user=self.user,
+                stage=(self.stage1, self.stage1, self.stage2)[i % 3],
+                day=date(2022, 1, 1 + i),
+                start=time(8, 0),
+                end=time(20, 0),
+            )
+        self.user.refresh_from_db()
+        self.url = reverse('api:day-list')
+
+    def get_count(self, params: dict, counted: bool) -> int:
+        """Lists days with params, checking whether a COUNT(*) was made, and returns the count. """
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(self.url, params)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(any('COUNT(' in query['sql'] for query in queries.captured_queries), counted)
+        return res.data['count']
+
+    def test_counters(self):
+        """Test the counts of the lists matching a counter. """
+        self.assertEqual(self.get_count({}, counted=False), 12)
+        self.assertEqual(self.get_count({'stages': self.stage1.id}, counted=False), 8)
+        self.assertEqual(self.get_count({'stages': self.stage2.id}, counted=False), 4)
+        self.assertEqual(self.get_count({'page': 2}, counted=False), 12)
+
+        # Stage of another user
+        other_user = get_user_model().objects.create_user(username='other', email='o@gmail.com', password='pass')
+        other_stage = Stage.objects.create(user=other_user, name='Stage')
+        self.assertEqual(self.get_count({'stages': other_stage.id}, counted=False), 0)
+
+    def test_arbitrary_filters(self):
+        """Test that the lists not matching a counter are counted. """
+        self.assertEqual(self.get_count({'stages': f'{self.stage1.id},{self.stage2.id}'}, counted=True), 12)
+        self.assertEqual(self.get_count({'dates': '2022-01-01,2022-01-02'}, counted=True), 2)
+        self.assertEqual(self.get_count({'stages': self.stage1.id, 'date_to': '2022-01-06'}, counted=True), 4)
+
+
+class TestBulkCreate(TestCase):
+    """Test the creation of arrays of objects. """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.stage = Stage.objects.create(user=self.user, name='Stage')
+        self.subject = Subject.objects.create(user=self.user, name='Subject')
+        self.day = Day.objects.create(user=self.user, stage=self.stage, day=date(2022, 1, 1), start=time(8, 0))
+        self.url = reverse('api:session-list')
+
+    def get_payload(self, n):
+        return [
+            {'day': self.day.id, 'subject': self.subject.id, 'start': f'{8 + i}:00', 'end': f'{8 + i}:30'}
+            for i in range(n)
+        ]
+
+    def test_bulk_create_success(self):
+        """Test that all objects are created, and the aggregates updated. """
+        res = self.client.post(self.url, self.get_payload(3), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [session['id'] for session in res.data],
+            list(Session.objects.order_by('id').values_list('id', flat=True))
+        )
+        self.assertEqual([session['duration'] for session in res.data], [1800] * 3)
+
+        self.day.refresh_from_db()
+        self.subject.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual((self.day.session_count, self.day.study_time), (3, 3 * 1800))
+        self.assertEqual((self.subject.session_count, self.subject.total_study_time), (3, 3 * 1800))
+        self.assertEqual((self.user.session_count, self.user.total_study_time), (3, 3 * 1800))
+
+    def test_all_or_nothing(self):
+        """Test that no object is created if any of them is invalid. """
+        payload = self.get_payload(3)
+        payload[1]['start'] = 'invalid'
+        res = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Session.objects.exists())
+
+    @override_settings(API_MAX_BATCH_SIZE=2)
+    def test_max_batch_size(self):
+        """Test that arrays larger than the maximum batch size are rejected. """
+        res = self.client.post(self.url, self.get_payload(3), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Session.objects.exists())
+
+        res = self.client.post(self.url, self.get_payload(2), format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_query_count(self):
+        """Test that the number of queries does not depend on the number of objects. """
+        query_counts = []
+        for n in (1, 10):
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(self.url, self.get_payload(n), format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            query_counts.append(len(queries.captured_queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_ownership_errors(self):
+        """Test that related objects of another user are reported per object, as when posted one by one. """
+        other_user = get_user_model().objects.create_user(username='other', email='o@gmail.com', password='pass')
+        other_stage = Stage.objects.create(user=other_user, name='Stage')
+        other_day = Day.objects.create(user=other_user, stage=other_stage, day=date(2022, 1, 1), start=time(8, 0))
+        payload = self.get_payload(3)
+        payload[1]['day'] = other_day.id
+        payload[2]['subject'] = 0
+        res = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertEqual(res.data[1], {'day': ['The related field does not belong to the current user.']})
+        self.assertEqual(res.data[2], {'subject': ['Invalid pk "0" - object does not exist.']})
+        self.assertFalse(Session.objects.exists())
+
+
+class TestExport(TestCase):
+    """Test the export endpoints. """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.stage = Stage.objects.create(user=self.user, name='Stage')
+        self.subject = Subject.objects.create(user=self.user, name='Subject')
+        self.days = [
+            Day.objects.create(
+                user=self.user, stage=self.stage, day=date(2022, 1, 1 + i), start=time(8, 0), end=time(20, 0)
+            )
+            for i in range(3)
+        ]
+        self.sessions = [
+            Session.objects.create(user=self.user, day=day, subject=self.subject, start=time(9, 0), end=time(10, 30))
+            for day in self.days
+        ]
+        # Session whose end is to be completed later
+        self.sessions.append(
+            Session.objects.create(user=self.user, day=self.days[0], subject=self.subject, start=time(11, 0))
+        )
+        self.sessions_url = reverse('api:export_sessions')
+        self.days_url = reverse('api:export_days')
+
+    def get_ndjson(self, url, params=None) -> list:
+        res = self.client.get(url, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        return [json.loads(line) for line in b''.join(res.streaming_content).decode().splitlines()]
+
+    def test_authentication_required(self):
+        """Test that authentication is required for accessing these endpoints. """
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(self.sessions_url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.get(self.days_url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_export_sessions_ndjson(self):
+        """Test that all sessions are exported as in the API, with the joined names. """
+        rows = self.get_ndjson(self.sessions_url)
+
+        self.assertEqual([row['id'] for row in rows], [session.id for session in self.sessions])
+        self.assertEqual(rows[0], {
+            'id': self.sessions[0].id,
+            'day': self.days[0].id,
+            'date': '2022-01-01',
+            'stage_name': 'Stage',
+            'subject': self.subject.id,
+            'subject_name': 'Subject',
+            'start': '09:00:00',
+            'end': '10:30:00',
+            'end_next_day': False,
+            'duration': 5400,
+        })
+        self.assertIsNone(rows[-1]['end'])
+
+    def test_export_days_csv(self):
+        """Test that all days are exported as CSV, chosen by the Accept header or by the format parameter. """
+        for kwargs in ({'HTTP_ACCEPT': 'text/csv'}, {'data': {'format': 'csv'}}):
+            res = self.client.get(self.days_url, **kwargs)
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res['Content-Type'], 'text/csv; charset=utf-8')
+            self.assertEqual(res['Content-Disposition'], 'attachment; filename="days.csv"')
+            rows = list(csv.DictReader(b''.join(res.streaming_content).decode().splitlines()))
+            self.assertEqual([row['day'] for row in rows], ['2022-01-01', '2022-01-02', '2022-01-03'])
+            self.assertEqual(rows[0]['stage_name'], 'Stage')
+            self.assertEqual(rows[0]['study_time'], '5400')
+            self.assertEqual(rows[0]['comment'], '')
+
+    def test_filters(self):
+        """Test the filters of the viewsets and the date range. """
+        rows = self.get_ndjson(self.sessions_url, {'days': f'{self.days[0].id},{self.days[1].id}'})
+        self.assertEqual(len(rows), 3)
+
+        rows = self.get_ndjson(self.sessions_url, {'date_from': '2022-01-02', 'date_to': '2022-01-03'})
+        self.assertEqual([row['id'] for row in rows], [session.id for session in self.sessions[1:3]])
+
+        rows = self.get_ndjson(self.days_url, {'date_to': '2022-01-01'})
+        self.assertEqual([row['id'] for row in rows], [self.days[0].id])
+
+        res = self.client.get(self.days_url, {'date_from': 'invalid'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_chunks(self):
+        """Test that rows are read in chunks, with no row missing nor repeated. """
+        with patch.object(SessionExportView, 'chunk_size', 2), CaptureQueriesContext(connection) as queries:
+            rows = self.get_ndjson(self.sessions_url)
+
+        self.assertEqual([row['id'] for row in rows], [session.id for session in self.sessions])
+        self.assertEqual(sum('classic_tracker_session' in query['sql'] for query in queries.captured_queries), 3)
+
+
+class TestConditionalGet(TestCase):
+    """Test the ETags of the list and detail endpoints. """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.stage = Stage.objects.create(user=self.user, name='Stage')
+        self.urls = [
+            reverse('api:me'),
+            reverse('api:stage-list'),
+            reverse('api:stage-detail', args=[self.stage.id]),
+            reverse('api:day-list'),
+            reverse('api:session-list'),
+            reverse('api:subject-list'),
+        ]
+
+    def test_not_modified(self):
+        """Test that a request with the current ETag gets a 304 without reading any row. """
+        for url in self.urls:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res['Cache-Control'], 'private, no-cache')
+
+            with CaptureQueriesContext(connection) as queries:
+                res_304 = self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+            # Only the savepoints of the atomic requests are left
+            self.assertFalse([query for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']])
+            self.assertEqual(res_304.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(res_304['ETag'], res['ETag'])
+            self.assertEqual(res_304.content, b'')
+
+    def test_etag_changes(self):
+        """Test that ETags change with the query string, and when the data of the user changes. """
+        url = reverse('api:stage-list')
+        etag = self.client.get(url)['ETag']
+        self.assertNotEqual(self.client.get(url, {'page': 1})['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Subject.objects.create(user=self.user, name='Subject')
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+        # Updating the profile
+        etag = self.client.get(reverse('api:me'))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('api:me'), {'first_name': 'F'})
+        res = self.client.get(reverse('api:me'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['first_name'], 'F')
+
+    def test_no_etag_on_errors(self):
+        """Test that responses other than 200 have no ETag. """
+        res = self.client.get(reverse('api:stage-detail', args=[self.stage.id + 1]))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(res.has_header('ETag'))
+
+
+class TestSparseFieldsets(TestCase):
+    """Test the fields and omit parameters. """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        stage = Stage.objects.create(user=self.user, name='Stage')
+        self.day = Day.objects.create(user=self.user, stage=stage, day=date(2022, 1, 1), start=time(8, 0))
+        self.url = reverse('api:day-list')
+
+    def test_fields(self):
+        """Test that only the requested fields are returned and read. """
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(self.url, {'fields': 'id,day,study_time'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], [{'id': self.day.id, 'day': '2022-01-01', 'study_time': 0}])
+        sql = next(query['sql'] for query in queries.captured_queries if 'FROM "classic_tracker_day"' in query['sql'])
+        self.assertNotIn('"comment"', sql)
+
+        res = self.client.get(reverse('api:day-detail', args=[self.day.id]), {'fields': 'stage'})
+        self.assertEqual(res.data, {'stage': self.day.stage_id})
+
+        res = self.client.get(reverse('api:me'), {'fields': 'username,day_count'})
+        self.assertEqual(res.data, {'username': 'fx', 'day_count': 1})
+
+    def test_omit(self):
+        """Test that omitted fields are not returned. """
+        res = self.client.get(self.url, {'omit': 'comment,time_usage_ratio'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('comment', res.data['results'][0])
+        self.assertNotIn('time_usage_ratio', res.data['results'][0])
+        self.assertIn('usable_time', res.data['results'][0])
+
+    def test_unknown_fields(self):
+        """Test that unknown and write-only fields are rejected. """
+        res = self.client.get(self.url, {'fields': 'id,unknown'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.get(reverse('api:me'), {'fields': 'password'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_writes_use_all_fields(self):
+        """Test that the fields parameter does not restrict writes. """
+        res = self.client.patch(
+            reverse('api:day-detail', args=[self.day.id]) + '?fields=id', {'comment': 'Comment'}, format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['comment'], 'Comment')
+
+
+class TestExpand(TestCase):
+    """Test the expand parameter. """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.stage = Stage.objects.create(user=self.user, name='Stage')
+        self.subject = Subject.objects.create(user=self.user, name='Subject')
+        self.url = reverse('api:session-list')
+
+    def create_sessions(self, n):
+        for _ in range(n):
+            day = Day.objects.create(
+                user=self.user, stage=self.stage, day=date(2022, 1, 1 + Day.objects.count()), start=time(8, 0)
+            )
+            Session.objects.create(user=self.user, day=day, subject=self.subject, start=time(9, 0), end=time(10, 0))
+
+    def count_queries(self, params) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(self.url, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return len(queries.captured_queries)
+
+    def test_expand_sessions(self):
+        """Test that the day and subject of sessions are inlined, with a number of queries independent of the list. """
+        self.create_sessions(1)
+        query_count = self.count_queries({'expand': 'day,subject'})
+        self.create_sessions(4)
+        self.assertEqual(self.count_queries({'expand': 'day,subject'}), query_count)
+
+        res = self.client.get(self.url, {'expand': 'day,subject'})
+        session = res.data['results'][0]
+        self.assertEqual(session['day']['day'], '2022-01-05')
+        self.assertEqual(session['day']['stage'], self.stage.id)
+        self.assertEqual(session['subject']['name'], 'Subject')
+
+        res = self.client.get(self.url, {'expand': 'day,subject', 'fields': 'id,subject'})
+        self.assertEqual(set(res.data['results'][0]), {'id', 'subject'})
+        self.assertEqual(res.data['results'][0]['subject']['id'], self.subject.id)
+
+    def test_expand_days(self):
+        """Test that the stage of days is inlined. """
+        self.create_sessions(1)
+        res = self.client.get(reverse('api:day-list'), {'expand': 'stage'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'][0]['stage']['name'], 'Stage')
+
+    def test_unknown_fields(self):
+        """Test that fields which cannot be expanded are rejected. """
+        res = self.client.get(reverse('api:day-list'), {'expand': 'subject'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestStats(TestCase):
+    """Test the stats endpoint. """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.stages = [Stage.objects.create(user=self.user, name=f'Stage {i}') for i in range(2)]
+        self.subjects = [Subject.objects.create(user=self.user, name=f'Subject {i}') for i in range(2)]
+
+        # Monday 2022-01-03 to Sunday 2022-01-16, i.e. two weeks, 12 hours per day with 1 hour of work
+        for i in range(14):
+            day = Day.objects.create(
+                user=self.user,
+                stage=self.stages[i // 7],
+                day=date(2022, 1, 3 + i),
+                worktime=3600,
+                start=time(8, 0),
+                end=time(20, 0),
+            )
+            # One hour of the first subject, and half an hour of the second one
+            for j, subject in enumerate(self.subjects):
+                Session.objects.create(user=self.user, day=day, subject=subject, start=time(9, 0), end=time(10 - j, 30 * j))
+        self.url = reverse('api:stats')
+
+    def test_buckets(self):
+        """Test the aggregates per week, month and weekday. """
+        res = self.client.get(self.url, {'bucket': 'week'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], [
+            {
+                'bucket': date(2022, 1, week),
+                'study_time': 7 * 5400,
+                'usable_time': 7 * 11 * 3600,
+                'work_time': 7 * 3600,
+                'session_count': 14,
+                'day_count': 7,
+            }
+            for week in (3, 10)
+        ])
+
+        res = self.client.get(self.url, {'bucket': 'month'})
+        self.assertEqual([(row['bucket'], row['day_count']) for row in res.data['results']], [(date(2022, 1, 1), 14)])
+
+        res = self.client.get(self.url, {'bucket': 'weekday', 'date_from': '2022-01-05', 'date_to': '2022-01-11'})
+        self.assertEqual([row['bucket'] for row in res.data['results']], [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual({row['day_count'] for row in res.data['results']}, {1})
+
+    def test_group_by(self):
+        """Test the aggregates per stage and per subject. """
+        res = self.client.get(self.url, {'bucket': 'month', 'group_by': 'stage'})
+        self.assertEqual(
+            [(row['stage'], row['stage_name'], row['day_count']) for row in res.data['results']],
+            [(self.stages[0].id, 'Stage 0', 7), (self.stages[1].id, 'Stage 1', 7)]
+        )
+
+        res = self.client.get(self.url, {'bucket': 'month', 'group_by': 'subject', 'date_to': '2022-01-03'})
+        self.assertEqual(res.data['results'], [
+            {
+                'bucket': date(2022, 1, 1),
+                'subject': self.subjects[0].id,
+                'subject_name': 'Subject 0',
+                'study_time': 3600,
+                'session_count': 1,
+            },
+            {
+                'bucket': date(2022, 1, 1),
+                'subject': self.subjects[1].id,
+                'subject_name': 'Subject 1',
+                'study_time': 1800,
+                'session_count': 1,
+            },
+        ])
+
+    def test_cache(self):
+        """Test that results are cached until the data of the user changes. """
+        self.client.get(self.url, {'bucket': 'week'})
+        with self.assertNumQueries(0):
+            res = self.client.get(self.url, {'bucket': 'week'})
+        self.assertEqual(res.data['results'][0]['session_count'], 14)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Session.objects.create(
+                user=self.user, day=Day.objects.get(day=date(2022, 1, 3)), subject=self.subjects[0], start=time(11, 0)
+            )
+        res = self.client.get(self.url, {'bucket': 'week'})
+        self.assertEqual(res.data['results'][0]['session_count'], 15)
+
+    def test_invalid_parameters(self):
+        """Test that invalid parameters are rejected. """
+        for params in ({'bucket': 'year'}, {'group_by': 'day'}, {'date_from': 'invalid'}):
+            res = self.client.get(self.url, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestBulkUpdateDestroy(TestCase):
+    """Test the bulk update and bulk delete of days and sessions. """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.stages = [Stage.objects.create(user=self.user, name=f'Stage {i}') for i in range(2)]
+        self.subjects = [Subject.objects.create(user=self.user, name=f'Subject {i}') for i in range(2)]
+        self.days = [
+            Day.objects.create(user=self.user, stage=self.stages[0], day=date(2022, 1, 3 + i), start=time(8, 0))
+            for i in range(3)
+        ]
+        self.sessions = [
+            Session.objects.create(user=self.user, day=day, subject=self.subjects[0], start=time(9, 0), end=time(10, 0))
+            for day in self.days
+        ]
+        self.url = reverse('api:session-list')
+
+    def test_bulk_update_sessions(self):
+        """Test that sessions are updated, in the order of the items, and that the aggregates follow. """
+        payload = [{'id': session.id, 'subject': self.subjects[1].id} for session in self.sessions[:2]]
+        payload[1]['end'] = '10:30'
+        res = self.client.patch(self.url, payload[::-1], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([session['id'] for session in res.data], [self.sessions[1].id, self.sessions[0].id])
+        self.assertEqual([session['duration'] for session in res.data], [5400, 3600])
+
+        for subject in self.subjects:
+            subject.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual((self.subjects[0].session_count, self.subjects[0].total_study_time), (1, 3600))
+        self.assertEqual((self.subjects[1].session_count, self.subjects[1].total_study_time), (2, 9000))
+        self.assertEqual((self.user.session_count, self.user.total_study_time), (3, 12600))
+
+    def test_bulk_update_days(self):
+        """Test that days are moved to another stage at once. """
+        payload = [{'id': day.id, 'stage': self.stages[1].id} for day in self.days[:2]]
+        res = self.client.patch(reverse('api:day-list'), payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        for stage in self.stages:
+            stage.refresh_from_db()
+        self.assertEqual((self.stages[0].day_count, self.stages[0].session_count), (1, 1))
+        self.assertEqual((self.stages[1].day_count, self.stages[1].session_count), (2, 2))
+
+    def test_bulk_update_errors(self):
+        """Test that nothing is updated if any item is invalid, missing, or belongs to another user. """
+        other_user = get_user_model().objects.create_user(username='other', email='o@gmail.com', password='opass123')
+        other_subject = Subject.objects.create(user=other_user, name='Subject')
+
+        for payload, status_code in (
+            ({'id': self.sessions[0].id, 'subject': self.subjects[1].id}, status.HTTP_400_BAD_REQUEST),
+            ([{'subject': self.subjects[1].id}], status.HTTP_400_BAD_REQUEST),
+            ([{'id': self.sessions[0].id}, {'id': self.sessions[0].id}], status.HTTP_400_BAD_REQUEST),
+            ([{'id': self.sessions[0].id, 'subject': other_subject.id}], status.HTTP_400_BAD_REQUEST),
+            ([{'id': self.sessions[0].id, 'subject': self.subjects[1].id}, {'id': 0}], status.HTTP_404_NOT_FOUND),
+        ):
+            res = self.client.patch(self.url, payload, format='json')
+            self.assertEqual(res.status_code, status_code)
+
+        self.assertFalse(Session.objects.filter(subject=self.subjects[1]).exists())
+
+    def test_bulk_destroy(self):
+        """Test that sessions and days are deleted at once, and that the aggregates follow. """
+        res = self.client.delete(f'{self.url}?ids={self.sessions[0].id},{self.sessions[1].id}')
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(Session.objects.values_list('id', flat=True)), [self.sessions[2].id])
+        self.subjects[0].refresh_from_db()
+        self.assertEqual((self.subjects[0].session_count, self.subjects[0].total_study_time), (1, 3600))
+
+        res = self.client.delete(f"{reverse('api:day-list')}?ids={self.days[1].id},{self.days[2].id}")
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(Day.objects.values_list('id', flat=True)), [self.days[0].id])
+        self.assertFalse(Session.objects.exists())
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.day_count, self.user.session_count, self.user.total_study_time), (1, 0, 0))
+
+    def test_bulk_destroy_errors(self):
+        """Test that nothing is deleted if any id is invalid or missing. """
+        for ids, status_code in (
+            ('', status.HTTP_400_BAD_REQUEST),
+            (f'{self.sessions[0].id},a', status.HTTP_400_BAD_REQUEST),
+            (f'{self.sessions[0].id},0', status.HTTP_404_NOT_FOUND),
+        ):
+            res = self.client.delete(f'{self.url}?ids={ids}')
+            self.assertEqual(res.status_code, status_code)
+
+        self.assertEqual(Session.objects.count(), 3)
+
+
+@override_settings(API_CHANGES_SETTLE_TIME=0)
+class TestChanges(TestCase):
+    """Test the changes feed. """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.stage = Stage.objects.create(user=self.user, name='Stage')
+        self.subject = Subject.objects.create(user=self.user, name='Subject')
+        self.days = [
+            Day.objects.create(user=self.user, stage=self.stage, day=date(2022, 1, 3 + i), start=time(8, 0))
+            for i in range(2)
+        ]
+        self.sessions = [
+            Session.objects.create(user=self.user, day=day, subject=self.subject, start=time(9, 0), end=time(10, 0))
+            for day in self.days
+        ]
+        other_user = get_user_model().objects.create_user(username='other', email='o@gmail.com', password='opass123')
+        Stage.objects.create(user=other_user, name='Stage').delete()
+        self.url = reverse('api:changes')
+
+    @staticmethod
+    def get_ids(data: dict) -> dict:
+        return {key: [obj['id'] for obj in data[key]] for key in ('stages', 'days', 'sessions', 'subjects')}
+
+    def test_initial_sync(self):
+        """Test that all objects of the user are given without cursor, in the order of their last change. """
+        res = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(res.data['has_more'])
+        self.assertEqual(self.get_ids(res.data), {
+            'stages': [self.stage.id],
+            'days': [day.id for day in self.days],
+            'sessions': [session.id for session in self.sessions],
+            'subjects': [self.subject.id],
+        })
+        self.assertEqual(res.data['deleted'], {'stages': [], 'days': [], 'sessions': [], 'subjects': []})
+
+        res = self.client.get(self.url, {'since': res.data['cursor']})
+
+        self.assertEqual(self.get_ids(res.data), {'stages': [], 'days': [], 'sessions': [], 'subjects': []})
+
+    def test_changes_and_deletions(self):
+        """Test that only the objects changed since the cursor are given, including the updated aggregates. """
+        cursor = self.client.get(self.url).data['cursor']
+        self.sessions[0].end = time(11, 0)
+        self.sessions[0].save()
+        deleted_id = self.sessions[1].id
+        self.sessions[1].delete()
+
+        res = self.client.get(self.url, {'since': cursor})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_ids(res.data), {
+            'stages': [self.stage.id],
+            'days': [day.id for day in self.days],
+            'sessions': [self.sessions[0].id],
+            'subjects': [self.subject.id],
+        })
+        self.assertEqual(res.data['sessions'][0]['duration'], 7200)
+        self.assertEqual(res.data['deleted']['sessions'], [deleted_id])
+
+    def test_cascading_deletions(self):
+        """Test that the objects deleted along with a stage or a subject are given, but not deleted objects. """
+        cursor = self.client.get(self.url).data['cursor']
+        stage_id = self.stage.id
+        self.stage.delete()
+
+        res = self.client.get(self.url, {'since': cursor})
+
+        self.assertEqual(self.get_ids(res.data), {'stages': [], 'days': [], 'sessions': [], 'subjects': [self.subject.id]})
+        self.assertEqual({key: sorted(ids) for key, ids in res.data['deleted'].items()}, {
+            'stages': [stage_id],
+            'days': sorted(day.id for day in self.days),
+            'sessions': sorted(session.id for session in self.sessions),
+            'subjects': [],
+        })
+
+    def test_limit(self):
+        """Test that the changes are paginated, and that changes made at the same time are given together. """
+        cursor = self.client.get(self.url).data['cursor']
+        session_ids = sorted(session.id for session in self.sessions)
+        Session.delete_in_bulk(Session.objects.filter(user=self.user))
+
+        changes = {'stages': [], 'days': [], 'sessions': [], 'subjects': []}
+        has_more, calls = True, 0
+        while has_more:
+            res = self.client.get(self.url, {'since': cursor, 'limit': 1})
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            for key, ids in self.get_ids(res.data).items():
+                changes[key] += ids
+            # The sessions are deleted at the same time, their tombstones can't be split
+            self.assertIn(len(res.data['deleted']['sessions']), (0, 2))
+            changes['sessions'] += res.data['deleted']['sessions']
+            cursor, has_more, calls = res.data['cursor'], res.data['has_more'], calls + 1
+
+        self.assertGreater(calls, 2)
+        self.assertEqual(sorted(changes['sessions']), session_ids)
+        self.assertEqual(sorted(changes['days']), sorted(day.id for day in self.days))
+        self.assertEqual(changes['stages'], [self.stage.id])
+
+    def test_invalid_parameters(self):
+        """Test that invalid cursors and limits are rejected. """
+        for params in ({'since': 'a'}, {'since': -1}, {'limit': 0}):
+            res = self.client.get(self.url, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(API_CHANGES_RETENTION_DAYS=30)
+    def test_expired_cursor(self):
+        """Test that cursors older than the retention of the deletions are gone, so that clients resynchronize. """
+        res = self.client.get(self.url, {'since': int((timezone.now() - timedelta(days=31)).timestamp() * 10 ** 6)})
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+
+        res = self.client.get(self.url, {'since': int((timezone.now() - timedelta(days=29)).timestamp() * 10 ** 6)})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+class TestRangeFilters(TestCase):
+    """Test the range filters and the sorting of the day and session lists. """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.stage = Stage.objects.create(user=self.user, name='Stage')
+        self.subject = Subject.objects.create(user=self.user, name='Subject')
+        # Days from 2022-01-01 to 2022-01-05, starting at 7:00 to 11:00, with 1 to 5 sessions of half an hour
+        self.days = []
+        self.sessions = []
+        for i in range(5):
+            day = Day.objects.create(user=self.user, stage=self.stage, day=date(2022, 1, 1 + i), start=time(7 + i, 0))
+            self.days.append(day)
+            for j in range(i + 1):
+                self.sessions.append(Session.objects.create(
+                    user=self.user, day=day, subject=self.subject, start=time(12 + j, 0), end=time(12 + j, 30)
+                ))
+        self.days_url = reverse('api:day-list')
+        self.sessions_url = reverse('api:session-list')
+
+    def get_ids(self, url: str, params: dict) -> list:
+        res = self.client.get(url, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [obj['id'] for obj in res.data['results']]
+
+    def test_day_ranges(self):
+        """Test the date, start time and study time ranges of the day list. """
+        ids = [day.id for day in self.days]
+        self.assertEqual(self.get_ids(self.days_url, {'date_from': '2022-01-02', 'date_to': '2022-01-03'}), ids[2:0:-1])
+        self.assertEqual(self.get_ids(self.days_url, {'start_from': '08:00', 'start_to': '09:30'}), ids[2:0:-1])
+        self.assertEqual(self.get_ids(self.days_url, {'min_duration': 3600, 'max_duration': 5400}), ids[2:0:-1])
+        self.assertEqual(self.get_ids(self.days_url, {'date_from': '2022-01-02', 'max_duration': 3600}), [ids[1]])
+
+    def test_session_ranges(self):
+        """Test the date (of the day), start time and duration ranges of the session list. """
+        self.sessions[0].end = time(13, 0)
+        self.sessions[0].save()
+
+        self.assertEqual(
+            set(self.get_ids(self.sessions_url, {'date_from': '2022-01-02', 'date_to': '2022-01-02'})),
+            {session.id for session in self.sessions if session.day_id == self.days[1].id},
+        )
+        self.assertEqual(self.get_ids(self.sessions_url, {'start_from': '16:00'}), [self.sessions[-1].id])
+        self.assertEqual(self.get_ids(self.sessions_url, {'min_duration': 3600}), [self.sessions[0].id])
+
+    def test_ordering(self):
+        """Test the sorting by a whitelisted field, with ties sorted by id, including with cursor pagination. """
+        ids = [day.id for day in self.days]
+        self.assertEqual(self.get_ids(self.days_url, {'ordering': 'day'}), ids)
+        self.assertEqual(self.get_ids(self.days_url, {'ordering': '-study_time'}), ids[::-1])
+
+        expected = sorted(self.sessions, key=lambda session: (session.start, session.id), reverse=True)
+        self.assertEqual(self.get_ids(self.sessions_url, {'ordering': '-start'}), [s.id for s in expected][:10])
+
+        res = self.client.get(self.sessions_url, {'ordering': 'start', 'cursor': ''})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [session['start'] for session in res.data['results']], sorted(s.start.isoformat() for s in self.sessions)[:10]
+        )
+
+    def test_invalid_parameters(self):
+        """Test that invalid filters and orderings are rejected instead of reaching the database. """
+        for url, params in (
+            (self.days_url, {'dates': '2022-01-01,invalid'}),
+            (self.days_url, {'stages': '1,a'}),
+            (self.days_url, {'date_from': '2022-01-03', 'date_to': '2022-01-02'}),
+            (self.days_url, {'ordering': 'comment'}),
+            (self.sessions_url, {'min_duration': -1}),
+            (self.sessions_url, {'start_from': '25:00'}),
+            (self.sessions_url, {'ordering': 'subject__name'}),
+        ):
+            res = self.client.get(url, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+        with override_settings(API_MAX_BATCH_SIZE=2):
+            res = self.client.get(self.sessions_url, {'days': '1,2,3'})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestAsyncReadPath(TestCase):
+    """
+    Test the endpoints through the ASGI handler: the reads are served by the async handlers (a query made by the sync
+    ORM in the event loop would raise SynchronousOnlyOperation, i.e. a 500), and the writes by the sync ones.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        CachedTokenAuthentication.local_cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username='fx',
+            email='fx@gmail.com',
+            password='fxpass123',
+        )
+        self.headers = {'AUTHORIZATION': f'Token {Token.objects.create(user=self.user).key}'}
+        self.stage = Stage.objects.create(user=self.user, name='Stage')
+        self.subject = Subject.objects.create(user=self.user, name='Subject')
+        self.days = [
+            Day.objects.create(user=self.user, stage=self.stage, day=date(2022, 1, 1 + i), start=time(8, 0))
+            for i in range(12)
+        ]
+        Session.objects.create(user=self.user, day=self.days[0], subject=self.subject, start=time(9, 0), end=time(10, 0))
+
+    async def test_list(self):
+        """Test the page number and cursor pagination, with and without counter, and the expansion. """
+        res = await self.async_client.get(reverse('api:day-list'), **self.headers)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()['count'], 12)
+        self.assertEqual([day['id'] for day in res.json()['results']], [day.id for day in self.days[:1:-1]])
+
+        res = await self.async_client.get(reverse('api:day-list'), {'date_to': '2022-01-03', 'page': 1}, **self.headers)
+        self.assertEqual(res.json()['count'], 3)
+
+        res = await self.async_client.get(reverse('api:day-list'), {'cursor': ''}, **self.headers)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = await self.async_client.get(res.json()['next'], **self.headers)
+        self.assertEqual([day['id'] for day in res.json()['results']], [self.days[1].id, self.days[0].id])
+
+        res = await self.async_client.get(reverse('api:session-list'), {'expand': 'day,subject'}, **self.headers)
+        self.assertEqual(res.json()['results'][0]['subject']['name'], 'Subject')
+
+    async def test_retrieve(self):
+        """Test the detail of an object, of the current user, and the conditional GET. """
+        url = reverse('api:day-detail', args=[self.days[0].id])
+        res = await self.async_client.get(url, **self.headers)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()['session_count'], 1)
+
+        res = await self.async_client.get(url, IF_NONE_MATCH=res['ETag'], **self.headers)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        for url in (reverse('api:day-detail', args=[0]), reverse('api:day-detail', args=['a'])):
+            res = await self.async_client.get(url, **self.headers)
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        res = await self.async_client.get(reverse('api:me'), {'fields': 'username'}, **self.headers)
+        self.assertEqual(res.json(), {'username': 'fx'})
+
+    async def test_errors(self):
+        """Test that authentication and validation errors are answered as by the sync handlers. """
+        res = await self.async_client.get(reverse('api:day-list'))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        res = await self.async_client.get(reverse('api:day-list'), {'ordering': 'comment'}, **self.headers)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ordering', res.json())
+
+    async def test_writes(self):
+        """Test that the writes are still served, by the sync handlers. """
+        res = await self.async_client.post(
+            reverse('api:stage-list'), {'name': 'Stage 2'}, content_type='application/json', **self.headers
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        res = await self.async_client.delete(reverse('api:stage-detail', args=[res.json()['id']]), **self.headers)
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(await Stage.objects.filter(user=self.user).acount(), 1)
+
+    async def test_export(self):
+        """
+        Test that the export is streamed by an async iterator, which reads the next chunk of rows only once the previous
+        rows are sent, instead of being read entirely before the first byte is sent.
+        """
+        with patch.object(DayExportView, 'chunk_size', 5):
+            res = await self.async_client.get(reverse('api:export_days'), **self.headers)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertTrue(res.is_async)
+
+            content = res.streaming_content
+            lines = [await content.__anext__() for _ in range(5)]
+            # Only the rows of the next chunks are read after this update
+            await Day.objects.filter(user=self.user).aupdate(comment='Updated')
+            lines += [line async for line in content]
+
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['id'] for row in rows], [day.id for day in self.days])
+        self.assertEqual([row['comment'] for row in rows], [None] * 5 + ['Updated'] * 7)
@@ -0,0 +1,115 @@
+from math import ceil
+from time import time
+from typing import Optional, Tuple
+
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+# Atomic token bucket: refills the bucket (KEYS[1]) by the time elapsed since its last update, then takes cost tokens
+# from it if it holds enough of them. Returns the time to wait (in seconds) before cost tokens are available,
+# 0 if they were taken. The clock of the Redis server is used, s.t. all workers share the same one.
+# ARGV: capacity, refill rate (in tokens per second), cost.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = capacity
+if bucket[1] then
+    tokens = math.min(capacity, tonumber(bucket[1]) + math.max(0, now - tonumber(bucket[2])) * rate)
+end
+
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate: Optional[str]) -> Optional[Tuple[int, float]]:
+    """Returns the capacity and refill rate (in tokens per second) of a rate given as '<tokens>/<period>'. """
+    if rate is None:
+        return None
+    tokens, period = rate.split('/')
+    return int(tokens), int(tokens) / PERIODS[period[0]]
+
+
+def consume_tokens(key: str, capacity: int, rate: float, cost: int) -> float:
+    """
+    Takes cost tokens from the bucket of key (of the default cache), and returns 0,
+    or the time to wait (in seconds) before they are available.
+    With Redis, it is atomic and costs a single round trip.
+    """
+    cache = caches['default']
+    if isinstance(cache, RedisCache):
+        key = cache.make_and_validate_key(key)
+        client = cache._cache.get_client(key, write=True)
+        return float(client.register_script(TOKEN_BUCKET_SCRIPT)(keys=[key], args=[capacity, rate, cost]))
+
+    # Other backends (e.g. the local memory cache of the tests) are not atomic
+    now = time()
+    tokens, updated = cache.get(key, (capacity, now))
+    tokens = min(capacity, tokens + max(0., now - updated) * rate)
+    wait = 0.
+    if tokens >= cost:
+        tokens -= cost
+    else:
+        wait = (cost - tokens) / rate
+    cache.set(key, (tokens, now), ceil(capacity / rate) + 1)
+    return wait
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle with a token bucket per user (or IP address for anonymous users) and per scope,
+    whose rates ('<tokens>/<period>', i.e. the capacity of the bucket, which is refilled in one period) are given by
+    the DEFAULT_THROTTLE_RATES setting of REST_FRAMEWORK:
+        read: GET, HEAD and OPTIONS requests, which cost 1 token.
+        write: other requests, which cost 1 token, e.g. saving a session and the aggregates of its day, stage and user.
+        bulk_write: requests posting (or patching) an array of objects, and bulk deletes (see
+            api.views.BulkUpdateDestroyMixin), which cost 1 token per object.
+    Throttled requests are answered with a 429 Too Many Requests, whose Retry-After header gives the time to wait.
+    """
+    read_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self):
+        self.wait_time = None
+
+    def get_scope(self, request, view) -> Tuple[str, int]:
+        """Returns the scope of the request and its cost in tokens. """
+        if request.method in self.read_methods:
+            return 'read', 1
+        if isinstance(request.data, list):
+            return 'bulk_write', max(len(request.data), 1)
+        if request.method == 'DELETE' and request.query_params.get('ids'):
+            return 'bulk_write', len(request.query_params['ids'].split(','))
+        return 'write', 1
+
+    def allow_request(self, request, view) -> bool:
+        scope, cost = self.get_scope(request, view)
+        rate = parse_rate(api_settings.DEFAULT_THROTTLE_RATES.get(scope))
+        if rate is None:
+            return True
+
+        ident = request.user.pk if request.user and request.user.is_authenticated else self.get_ident(request)
+        capacity, refill_rate = rate
+        # Arrays larger than the bucket (which should hold settings.API_MAX_BATCH_SIZE tokens) take all of it
+        cost = min(cost, capacity)
+        self.wait_time = consume_tokens(f'throttle:{scope}:{ident}', capacity, refill_rate, cost)
+        return self.wait_time == 0
+
+    def wait(self) -> Optional[int]:
+        return ceil(self.wait_time) if self.wait_time else None
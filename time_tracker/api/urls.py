@@ -1,14 +1,15 @@
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 from rest_framework.authtoken.views import obtain_auth_token
-from rest_framework.routers import DefaultRouter
 
-from .views import CreateUserView, ManageUserView, StageViewSet, DayViewSet, SessionViewSet, SubjectViewSet
+from .routers import BulkRouter
+from .views import CreateUserView, ManageUserView, StageViewSet, DayViewSet, SessionViewSet, SubjectViewSet, \
+    DayExportView, SessionExportView, StatsView, ChangesView
 
 app_name = 'api'
 
 # Routing: correspondence between urls and viewset
-router = DefaultRouter()
+router = BulkRouter()
 router.register('stages', StageViewSet)
 router.register('days', DayViewSet)
 router.register('sessions', SessionViewSet)
@@ -28,6 +29,16 @@ urlpatterns = [
     # Endpoints for getting, updating and deleting the authenticated user
     path('me/', ManageUserView.as_view(), name='me'),
 
+    # Endpoints streaming all days or sessions of the authenticated user as NDJSON or CSV
+    path('export/days/', DayExportView.as_view(), name='export_days'),
+    path('export/sessions/', SessionExportView.as_view(), name='export_sessions'),
+
+    # Endpoint aggregating the time usage of the authenticated user per time bucket
+    path('stats/', StatsView.as_view(), name='stats'),
+
+    # Endpoint giving the changes of the authenticated user's data since a cursor, for the sync of offline clients
+    path('changes/', ChangesView.as_view(), name='changes'),
+
     # Endpoints for CRUD operations on the stages, days, sessions and subjects of the authenticated user
     path('', include(router.urls))
 ]
@@ -1,13 +1,426 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import wraps
+from hashlib import md5
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
+from django.db.models import F, QuerySet, Sum, Count
+from django.db.models.functions import TruncWeek, TruncMonth
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import parse_etags
 from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
 from drf_spectacular.types import OpenApiTypes
-from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiParameter
+from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiParameter, OpenApiResponse
 
-from rest_framework import generics, authentication, permissions, viewsets
+from rest_framework import generics, permissions, serializers, status, viewsets
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from .serializers import UserSerializer, StageSerializer, DaySerializer, SessionSerializer, SubjectSerializer
+from .authentication import CachedTokenAuthentication
+from .renderers import NDJSONRenderer, CSVRenderer
+from .serializers import UserSerializer, StageSerializer, DaySerializer, SessionSerializer, SubjectSerializer, \
+    StatsQuerySerializer, ChangesQuerySerializer, DayFilterSerializer, SessionFilterSerializer, DayListQuerySerializer, \
+    SessionListQuerySerializer
 # noinspection PyUnresolvedReferences
-from classic_tracker.models import Stage, Day, Session, Subject
+from classic_tracker.models import Stage, Day, Session, Subject, Tombstone, get_data_version, lock_users
+
+
+def get_counter(model, ids: List[int], user, counter: str) -> Optional[int]:
+    """
+    Returns the counter of the current user's object whose id is the only one of ids, e.g. the day count of a stage.
+    None if ids has several ids, which have no counter.
+    """
+    if len(ids) != 1:
+        return None
+    return model.objects.filter(pk=ids[0], user=user).values_list(counter, flat=True).first() or 0
+
+
+def parse_query(serializer_class, query_params) -> dict:
+    """Returns the query parameters validated by serializer_class, or raises a ValidationError (400). """
+    query = serializer_class(data=query_params)
+    query.is_valid(raise_exception=True)
+    return query.validated_data
+
+
+def filter_ranges(queryset: QuerySet, filters: dict, date_lookup: str, duration_lookup: str) -> QuerySet:
+    """
+    Keeps the rows within the ranges of filters (see api.serializers.RangeFilterSerializer), all bounds included.
+    Each bound is a simple comparison of a column, which can use an index on (user, column).
+    """
+    for param, lookup in (
+        ('date_from', f'{date_lookup}__gte'),
+        ('date_to', f'{date_lookup}__lte'),
+        ('start_from', 'start__gte'),
+        ('start_to', 'start__lte'),
+        ('min_duration', f'{duration_lookup}__gte'),
+        ('max_duration', f'{duration_lookup}__lte'),
+    ):
+        if filters.get(param) is not None:
+            queryset = queryset.filter(**{lookup: filters[param]})
+    return queryset
+
+
+def filter_days(queryset: QuerySet, filters: dict) -> QuerySet:
+    """Filters days by date and/or stage id, and by ranges, given by api.serializers.DayFilterSerializer. """
+    if filters.get('dates'):
+        queryset = queryset.filter(day__in=filters['dates'])
+    if filters.get('stages'):
+        queryset = queryset.filter(stage__in=filters['stages'])
+    return filter_ranges(queryset, filters, 'day', 'study_time')
+
+
+def filter_sessions(queryset: QuerySet, filters: dict) -> QuerySet:
+    """Filters sessions by day and/or subject id, and by ranges, given by api.serializers.SessionFilterSerializer. """
+    if filters.get('days'):
+        queryset = queryset.filter(day__in=filters['days'])
+    if filters.get('subjects'):
+        queryset = queryset.filter(subject__in=filters['subjects'])
+    return filter_ranges(queryset, filters, 'day__day', 'duration')
+
+
+def order_by_param(queryset: QuerySet, ordering: Optional[str]) -> QuerySet:
+    """Sorts queryset by the ordering parameter (e.g. '-start'), then by id in the same direction, s.t. pages are stable. """
+    if not ordering or ordering.lstrip('-') == 'id':
+        return queryset.order_by(ordering) if ordering else queryset
+    return queryset.order_by(ordering, '-id' if ordering.startswith('-') else 'id')
+
+
+def iterate_in_chunks(queryset: QuerySet, fields: List[str], chunk_size: int) -> Iterator[dict]:
+    """
+    Yields the values of fields of all rows of queryset, in the order of their ids.
+    Rows are fetched chunk_size at a time by keyset pagination on id, s.t. only one chunk is held in memory:
+    unlike PostgreSQL, MySQL drivers load the whole result of a query in memory, even with QuerySet.iterator().
+    """
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id).order_by('id').values(*fields)[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]['id']
+
+
+async def aiterate_in_chunks(queryset: QuerySet, fields: List[str], chunk_size: int) -> AsyncIterator[dict]:
+    """Async version of iterate_in_chunks, whose queries are run by the async ORM. """
+    last_id = 0
+    while True:
+        chunk = [row async for row in queryset.filter(id__gt=last_id).order_by('id').values(*fields)[:chunk_size]]
+        for row in chunk:
+            yield row
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]['id']
+
+
+class SparseFieldsetMixin:
+    """
+    Lets clients of list and retrieve endpoints choose the fields returned, with the fields or omit parameter
+    (comma separated field names). Both the output of the serializer (see serializers.SparseFieldsetMixin)
+    and the columns read from the database (with QuerySet.only()) are narrowed.
+    Writes always use all fields.
+    """
+
+    def get_sparse_fieldset(self) -> Optional[List[str]]:
+        """Returns the names of the fields requested, or None if all fields are. """
+        if not hasattr(self, '_sparse_fieldset'):
+            self._sparse_fieldset = None
+            fields = self.request.query_params.get('fields')
+            omit = self.request.query_params.get('omit')
+            if self.request.method in ('GET', 'HEAD') and (fields or omit):
+                self._sparse_fieldset = self.parse_sparse_fieldset(fields, omit)
+
+        return self._sparse_fieldset
+
+    def parse_sparse_fieldset(self, fields: Optional[str], omit: Optional[str]) -> List[str]:
+        readable_fields = [name for name, field in self.get_serializer_class()().fields.items() if not field.write_only]
+
+        for param, value in (('fields', fields), ('omit', omit)):
+            unknown_fields = set((value or '').split(',')) - set(readable_fields) - {''}
+            if unknown_fields:
+                raise serializers.ValidationError({param: [f'Unknown fields: {", ".join(sorted(unknown_fields))}.']})
+
+        return [
+            name for name in readable_fields
+            if (not fields or name in fields.split(',')) and (not omit or name not in omit.split(','))
+        ]
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_sparse_fieldset()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+
+        fields = self.get_sparse_fieldset()
+        if fields is not None:
+            serializer_fields = self.get_serializer_class()().fields
+            model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+            queryset = queryset.only(
+                'pk', *(serializer_fields[name].source for name in fields if serializer_fields[name].source in model_fields)
+            )
+        return queryset
+
+
+class ExpandMixin:
+    """
+    Lets clients of list and retrieve endpoints inline related objects instead of their ids, with the expand parameter
+    (comma separated names among expandable_fields). The related objects are read by the same query, with
+    select_related, so that an expanded list costs no more query than a plain one.
+    """
+    # {field name: serializer class of the related objects}
+    expandable_fields = {}
+
+    def get_expanded_fields(self) -> dict:
+        """Returns {field name: serializer class} of the fields to expand. """
+        expand = self.request.query_params.get('expand')
+        if self.request.method not in ('GET', 'HEAD') or not expand:
+            return {}
+
+        unknown_fields = set(expand.split(',')) - set(self.expandable_fields)
+        if unknown_fields:
+            raise serializers.ValidationError({'expand': [f'Unknown fields: {", ".join(sorted(unknown_fields))}.']})
+
+        # Fields left out by a sparse fieldset are not expanded, see SparseFieldsetMixin
+        get_sparse_fieldset = getattr(self, 'get_sparse_fieldset', None)
+        fields = get_sparse_fieldset() if get_sparse_fieldset is not None else None
+        return {
+            name: serializer_class for name, serializer_class in self.expandable_fields.items()
+            if name in expand.split(',') and (fields is None or name in fields)
+        }
+
+    def get_serializer(self, *args, **kwargs):
+        expand = self.get_expanded_fields()
+        if expand:
+            kwargs['expand'] = expand
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+
+        expand = self.get_expanded_fields()
+        if expand:
+            queryset = queryset.select_related(*expand)
+        return queryset
+
+
+def parse_ids(ids: List, param: str) -> List[int]:
+    """Returns the ids of a bulk update or delete as integers, raising a validation error for param if invalid. """
+    try:
+        ids = [int(pk) for pk in ids]
+    except (TypeError, ValueError):
+        raise serializers.ValidationError({param: ['Ids must be integers.']})
+
+    if not ids:
+        raise serializers.ValidationError({param: ['At least one id is required.']})
+    if len(ids) > settings.API_MAX_BATCH_SIZE:
+        raise serializers.ValidationError({param: [f'At most {settings.API_MAX_BATCH_SIZE} ids are allowed.']})
+    if len(set(ids)) < len(ids):
+        raise serializers.ValidationError({param: ['Ids must be unique.']})
+    return ids
+
+
+class BulkUpdateDestroyMixin:
+    """
+    Bulk endpoints of the list route (see api.routers.BulkRouter), which save all objects at once with the
+    update_in_bulk and delete_in_bulk methods of the model, in a single transaction (see the viewsets):
+        PATCH with an array of objects, each with its id and the fields to update.
+        DELETE with the comma separated ids of the objects in the ids parameter.
+    The objects must all belong to the current user, otherwise nothing is saved and a 404 is returned.
+    """
+
+    def get_bulk_queryset(self, ids: List[int]) -> QuerySet:
+        return self.queryset.filter(user=self.request.user, pk__in=ids)
+
+    @staticmethod
+    def check_missing_ids(ids: List[int], found_ids) -> None:
+        missing_ids = [pk for pk in ids if pk not in found_ids]
+        if missing_ids:
+            raise NotFound(f'Not found: {", ".join(map(str, missing_ids))}.')
+
+    @extend_schema(description='Endpoint for partially updating multiple objects of the current user at once, '
+                               'given an array of objects with their ids.')
+    def bulk_update(self, request, *args, **kwargs):
+        if not isinstance(request.data, list) or not all(isinstance(item, dict) for item in request.data):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of objects.']})
+        ids = parse_ids([item.get('id') for item in request.data], 'id')
+
+        # The rows are locked once, before they are validated and saved, after the user (see apply_user_deltas).
+        # They are given in the order of the items.
+        lock_users(self.get_bulk_queryset(ids))
+        objects = self.get_bulk_queryset(ids).select_for_update().in_bulk()
+        self.check_missing_ids(ids, objects)
+        serializer = self.get_serializer([objects[pk] for pk in ids], data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'ids',
+                OpenApiTypes.STR,
+                required=True,
+                description='Comma separated list of the ids of the objects to delete. No space after comma.',
+            ),
+        ],
+        description='Endpoint for deleting multiple objects of the current user at once.',
+    )
+    def bulk_destroy(self, request, *args, **kwargs):
+        ids = parse_ids([pk for pk in request.query_params.get('ids', '').split(',') if pk], 'ids')
+
+        # Missing ids are checked first, so that a 404 is returned before any delete runs
+        found_ids = set(self.get_bulk_queryset(ids).values_list('pk', flat=True))
+        self.check_missing_ids(ids, found_ids)
+        self.queryset.model.delete_in_bulk(self.queryset.model.objects.filter(pk__in=found_ids))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class AsyncReadMixin:
+    """
+    Serves the list and retrieve actions with async handlers (alist and aretrieve, or aget for views which are not
+    viewsets), which read the database with the async ORM: under ASGI (see gunicorn_conf.py), the worker keeps
+    serving other requests while the queries run, instead of being pinned by a slow list.
+
+    Authentication, permissions and throttling, which may read the database and the cache, run in a thread.
+    The other requests (writes, OPTIONS, ...) are dispatched as usual by sync_dispatch, in a thread, so views whose
+    writes must be atomic decorate sync_dispatch, instead of dispatch, with transaction.atomic.
+    Under WSGI (e.g. runserver and the tests), Django runs the async view in an event loop of the request's thread.
+    """
+    view_is_async = True
+
+    @classmethod
+    def as_view(cls, *args, **initkwargs):
+        view = super().as_view(*args, **initkwargs)
+
+        # The view of viewsets is a plain function (unlike Django's views, DRF's are not marked as coroutines)
+        async def async_view(request, *view_args, **view_kwargs):
+            return await view(request, *view_args, **view_kwargs)
+
+        return wraps(view)(async_view)
+
+    def get_async_handler(self, method: str):
+        """Returns the async handler of the HTTP method, None if the request is served by sync_dispatch. """
+        action_map = getattr(self, 'action_map', None)
+        if action_map is not None:
+            name = action_map.get(method)
+        else:
+            name = 'get' if method == 'head' else method
+        return getattr(self, f'a{name}', None) if name else None
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = self.get_async_handler(request.method.lower())
+        if handler is None:
+            return await sync_to_async(self.sync_dispatch)(request, *args, **kwargs)
+
+        # As APIView.dispatch, with the handler awaited
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    def sync_dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+    async def aget_object(self):
+        """Async version of GenericAPIView.get_object. """
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, DjangoValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def alist(self, request, *args, **kwargs):
+        """Async version of ListModelMixin.list. """
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.paginator is not None:
+            page = await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+            if page is not None:
+                return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+        objects = [obj async for obj in queryset.aiterator()]
+        return Response(self.get_serializer(objects, many=True).data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        """Async version of RetrieveModelMixin.retrieve. """
+        return Response(self.get_serializer(await self.aget_object()).data)
+
+
+class ConditionalGetMixin:
+    """
+    Answers list and retrieve requests whose If-None-Match header holds the current ETag with a 304 Not Modified,
+    without running the queryset nor the serializer.
+    ETags are derived from the data version of the user (see classic_tracker.models.get_data_version), which changes
+    whenever the user or any of their objects is saved or deleted, so no query is needed to compute them.
+    The async handlers of AsyncReadMixin are wrapped likewise.
+    """
+
+    def get_etag(self, request) -> str:
+        key = f'{request.user.id}:{get_data_version(request.user.id)}:{request.get_full_path()}:' \
+              f'{request.accepted_media_type}'
+        return f'"{md5(key.encode()).hexdigest()}"'
+
+    @staticmethod
+    def is_not_modified(request, etag: str) -> bool:
+        return etag in parse_etags(request.headers.get('If-None-Match', ''))
+
+    @staticmethod
+    def set_etag(response, etag: str):
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            # Clients must revalidate, and shared caches must not store the data of a user
+            response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def conditional_get(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if self.is_not_modified(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+        return self.set_etag(response, etag)
+
+    async def aconditional_get(self, handler, request, *args, **kwargs):
+        etag = await sync_to_async(self.get_etag)(request)
+        if self.is_not_modified(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = await handler(request, *args, **kwargs)
+        return self.set_etag(response, etag)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_get(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_get(super().retrieve, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.aconditional_get(super().alist, request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.aconditional_get(super().aretrieve, request, *args, **kwargs)
 
 
 class CreateUserView(generics.CreateAPIView):
@@ -21,15 +434,22 @@ class CreateUserView(generics.CreateAPIView):
     patch=extend_schema(description="Endpoint for partially updating the current user's profile."),
     delete=extend_schema(description="Endpoint for deleting the current user's account.")
 )
-class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
+class ManageUserView(SparseFieldsetMixin, ConditionalGetMixin, AsyncReadMixin, generics.RetrieveUpdateDestroyAPIView):
     """Endpoints for getting/updating/deleting the authenticated user. """
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
         """Returns an object instance used for detail views. """
-        return self.request.user
+        # The user given by the authentication may only have the fields it caches (see CachedTokenAuthentication)
+        return get_user_model().objects.get(pk=self.request.user.pk)
+
+    async def aget_object(self):
+        return await get_user_model().objects.aget(pk=self.request.user.pk)
+
+    async def aget(self, request, *args, **kwargs):
+        return await self.aretrieve(request, *args, **kwargs)
 
 
 @extend_schema_view(
@@ -49,12 +469,12 @@ class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     partial_update=extend_schema(description='Endpoint for partially updating a stage of the current user.'),
     destroy=extend_schema(description='Endpoint for deleting a stage of the current user.')
 )
-@method_decorator(transaction.atomic, name='dispatch')
-class StageViewSet(viewsets.ModelViewSet):
+@method_decorator(transaction.atomic, name='sync_dispatch')
+class StageViewSet(SparseFieldsetMixin, ConditionalGetMixin, AsyncReadMixin, viewsets.ModelViewSet):
     """Endpoints operating on the current user's stages. """
     serializer_class = StageSerializer
     queryset = Stage.objects.all()
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_serializer(self, *args, **kwargs):
@@ -71,6 +491,12 @@ class StageViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(name__in=names.split(','))
         return queryset.filter(user=self.request.user)
 
+    def get_counter_count(self):
+        """Count of the listed stages, given by the counter of the current user if they are not filtered. """
+        if self.request.query_params.get('names'):
+            return None
+        return self.request.user.stage_count
+
     def perform_create(self, serializer):
         """Overwrite the serializer's saving behavior by passing an additional argument to .save(). """
         serializer.save(user=self.request.user)
@@ -79,18 +505,7 @@ class StageViewSet(viewsets.ModelViewSet):
 @extend_schema_view(
     # Extend schema for the list method of the viewset
     list=extend_schema(
-        parameters=[
-            OpenApiParameter(
-                'dates',
-                OpenApiTypes.STR,
-                description='Comma separated list of dates, e.g. 2022-1-1,2022-1-2. No space after comma.',
-            ),
-            OpenApiParameter(
-                'stages',
-                OpenApiTypes.STR,
-                description='Comma separated list of related stage ids. No space after comma.',
-            ),
-        ],
+        parameters=[DayListQuerySerializer],
         description='Endpoint that lists all days of the current user.'
     ),
     create=extend_schema(description='Endpoint for creating one or multiple days for the current user.'),
@@ -99,12 +514,14 @@ class StageViewSet(viewsets.ModelViewSet):
     partial_update=extend_schema(description='Endpoint for partially updating a day of the current user.'),
     destroy=extend_schema(description='Endpoint for deleting a day of the current user.')
 )
-@method_decorator(transaction.atomic, name='dispatch')
-class DayViewSet(viewsets.ModelViewSet):
+@method_decorator(transaction.atomic, name='sync_dispatch')
+class DayViewSet(SparseFieldsetMixin, ExpandMixin, ConditionalGetMixin, BulkUpdateDestroyMixin, AsyncReadMixin,
+                 viewsets.ModelViewSet):
     """Endpoints operating on the current user's days. """
     serializer_class = DaySerializer
+    expandable_fields = {'stage': StageSerializer}
     queryset = Day.objects.all()
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_serializer(self, *args, **kwargs):
@@ -113,16 +530,26 @@ class DayViewSet(viewsets.ModelViewSet):
             kwargs['many'] = True
         return super().get_serializer(*args, **kwargs)
 
+    @cached_property
+    def query(self) -> dict:
+        return parse_query(DayListQuerySerializer, self.request.query_params)
+
     def get_queryset(self):
-        """Only stages of the current user are listed. Also supports filtering by date and/or stage id. """
-        queryset = self.queryset
-        dates = self.request.query_params.get('dates')
-        stages = self.request.query_params.get('stages')
-        if dates:
-            queryset = queryset.filter(day__in=dates.split(','))
-        if stages:
-            queryset = queryset.filter(stage__in=stages.split(','))
-        return queryset.filter(user=self.request.user)
+        """
+        Only days of the current user are listed.
+        Also supports filtering by date, stage id and ranges, and sorting, see DayListQuerySerializer.
+        """
+        queryset = filter_days(self.queryset.filter(user=self.request.user), self.query)
+        return order_by_param(queryset, self.query.get('ordering'))
+
+    def get_counter_count(self):
+        """Count of the listed days, given by the counter of the current user or of the stage if possible. """
+        filters = {param for param, value in self.query.items() if param != 'ordering' and value is not None}
+        if filters - {'stages'}:
+            return None
+        if filters:
+            return get_counter(Stage, self.query['stages'], self.request.user, 'day_count')
+        return self.request.user.day_count
 
     def perform_create(self, serializer):
         """Overwrite the serializer's saving behavior by passing an additional argument to .save(). """
@@ -132,18 +559,7 @@ class DayViewSet(viewsets.ModelViewSet):
 @extend_schema_view(
     # Extend schema for the list method of the viewset
     list=extend_schema(
-        parameters=[
-            OpenApiParameter(
-                'days',
-                OpenApiTypes.STR,
-                description='Comma separated list of day ids. No space after comma.',
-            ),
-            OpenApiParameter(
-                'subjects',
-                OpenApiTypes.STR,
-                description='Comma separated list of subject ids. No space after comma.',
-            ),
-        ],
+        parameters=[SessionListQuerySerializer],
         description='Endpoint that lists all sessions of the current user.'
     ),
     create=extend_schema(description='Endpoint for creating one or multiple sessions for the current user.'),
@@ -152,12 +568,14 @@ class DayViewSet(viewsets.ModelViewSet):
     partial_update=extend_schema(description='Endpoint for partially updating a session of the current user.'),
     destroy=extend_schema(description='Endpoint for deleting a session of the current user.')
 )
-@method_decorator(transaction.atomic, name='dispatch')
-class SessionViewSet(viewsets.ModelViewSet):
+@method_decorator(transaction.atomic, name='sync_dispatch')
+class SessionViewSet(SparseFieldsetMixin, ExpandMixin, ConditionalGetMixin, BulkUpdateDestroyMixin, AsyncReadMixin,
+                     viewsets.ModelViewSet):
     """Endpoints operating on the current user's sessions. """
     serializer_class = SessionSerializer
+    expandable_fields = {'day': DaySerializer, 'subject': SubjectSerializer}
     queryset = Session.objects.all()
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_serializer(self, *args, **kwargs):
@@ -166,16 +584,28 @@ class SessionViewSet(viewsets.ModelViewSet):
             kwargs['many'] = True
         return super().get_serializer(*args, **kwargs)
 
+    @cached_property
+    def query(self) -> dict:
+        return parse_query(SessionListQuerySerializer, self.request.query_params)
+
     def get_queryset(self):
-        """Only stages of the current user are listed. Also supports filtering by day and/or subject id. """
-        queryset = self.queryset
-        days = self.request.query_params.get('days')
-        subjects = self.request.query_params.get('subjects')
-        if days:
-            queryset = queryset.filter(day__in=days.split(','))
-        if subjects:
-            queryset = queryset.filter(subject__in=subjects.split(','))
-        return queryset.filter(user=self.request.user)
+        """
+        Only sessions of the current user are listed.
+        Also supports filtering by day id, subject id and ranges, and sorting, see SessionListQuerySerializer.
+        """
+        queryset = filter_sessions(self.queryset.filter(user=self.request.user), self.query)
+        return order_by_param(queryset, self.query.get('ordering'))
+
+    def get_counter_count(self):
+        """Count of the listed sessions, given by the counter of the current user, day or subject if possible. """
+        filters = {param for param, value in self.query.items() if param != 'ordering' and value is not None}
+        if len(filters) > 1 or filters - {'days', 'subjects'}:
+            return None
+        if 'days' in filters:
+            return get_counter(Day, self.query['days'], self.request.user, 'session_count')
+        if 'subjects' in filters:
+            return get_counter(Subject, self.query['subjects'], self.request.user, 'session_count')
+        return self.request.user.session_count
 
     def perform_create(self, serializer):
         """Overwrite the serializer's saving behavior by passing an additional argument to .save(). """
@@ -200,12 +630,12 @@ class SessionViewSet(viewsets.ModelViewSet):
     partial_update=extend_schema(description='Endpoint for partially updating a subject of the current user.'),
     destroy=extend_schema(description='Endpoint for deleting a subject of the current user.')
 )
-@method_decorator(transaction.atomic, name='dispatch')
-class SubjectViewSet(viewsets.ModelViewSet):
+@method_decorator(transaction.atomic, name='sync_dispatch')
+class SubjectViewSet(SparseFieldsetMixin, ConditionalGetMixin, AsyncReadMixin, viewsets.ModelViewSet):
     """Endpoints operating on the current user's stages. """
     serializer_class = SubjectSerializer
     queryset = Subject.objects.all()
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_serializer(self, *args, **kwargs):
@@ -222,6 +652,341 @@ class SubjectViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(name__in=names.split(','))
         return queryset.filter(user=self.request.user)
 
+    def get_counter_count(self):
+        """Count of the listed subjects, given by the counter of the current user if they are not filtered. """
+        if self.request.query_params.get('names'):
+            return None
+        return self.request.user.subject_count
+
     def perform_create(self, serializer):
         """Overwrite the serializer's saving behavior by passing an additional argument to .save(). """
         serializer.save(user=self.request.user)
+
+
+class ExportView(APIView):
+    """
+    Base view streaming all objects of the current user (matching the filters) as NDJSON or CSV,
+    chosen by the Accept header or the format parameter. The first rows are sent before the others are read.
+
+    Under ASGI, the response is given an async iterator, whose chunks are read by the async ORM: Django would read
+    a sync iterator entirely (in a thread) before sending the first byte. Under WSGI, it is given a sync iterator,
+    which Django would otherwise consume the same way.
+    """
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    renderer_classes = (NDJSONRenderer, CSVRenderer)
+    # Number of rows read by each query
+    chunk_size = 1000
+    # Name of the exported file, without extension
+    filename = None
+    # {column name: expression}, where the expression is a field name or an F() of a related field
+    columns = {}
+
+    def get_queryset(self) -> QuerySet:
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        fields = list(self.columns)
+        queryset = self.get_queryset().annotate(**{
+            name: expression for name, expression in self.columns.items() if not isinstance(expression, str)
+        })
+        renderer = request.accepted_renderer
+
+        if isinstance(request._request, ASGIRequest):
+            content = renderer.astream(aiterate_in_chunks(queryset, fields, self.chunk_size), fields)
+        else:
+            content = renderer.stream(iterate_in_chunks(queryset, fields, self.chunk_size), fields)
+
+        response = StreamingHttpResponse(
+            content,
+            content_type=f'{renderer.media_type}; charset={renderer.charset}',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{self.filename}.{renderer.format}"'
+        return response
+
+
+def export_schema(description: str, filters):
+    return extend_schema(
+        parameters=[filters],
+        responses={
+            (200, NDJSONRenderer.media_type): OpenApiResponse(OpenApiTypes.STR, description='One JSON object per line.'),
+            (200, CSVRenderer.media_type): OpenApiResponse(OpenApiTypes.STR, description='CSV with a header line.'),
+        },
+        description=description,
+    )
+
+
+@extend_schema_view(get=export_schema(
+    'Endpoint streaming all days of the current user, with the names of their stages.',
+    DayFilterSerializer,
+))
+class DayExportView(ExportView):
+    """Endpoint exporting the current user's days. """
+    filename = 'days'
+    columns = {
+        'id': 'id',
+        'day': 'day',
+        'day_of_week': 'day_of_week',
+        'stage': 'stage',
+        'stage_name': F('stage__name'),
+        'session_count': 'session_count',
+        'worktime': 'worktime',
+        'start': 'start',
+        'end': 'end',
+        'end_next_day': 'end_next_day',
+        'usable_time': 'usable_time',
+        'study_time': 'study_time',
+        'time_usage_ratio': 'time_usage_ratio',
+        'comment': 'comment',
+    }
+
+    def get_queryset(self):
+        return filter_days(
+            Day.objects.filter(user=self.request.user), parse_query(DayFilterSerializer, self.request.query_params)
+        )
+
+
+@extend_schema_view(get=export_schema(
+    'Endpoint streaming all sessions of the current user, with their dates and the names of their subjects and stages.',
+    SessionFilterSerializer,
+))
+class SessionExportView(ExportView):
+    """Endpoint exporting the current user's sessions. """
+    filename = 'sessions'
+    columns = {
+        'id': 'id',
+        'day': 'day',
+        'date': F('day__day'),
+        'stage_name': F('day__stage__name'),
+        'subject': 'subject',
+        'subject_name': F('subject__name'),
+        'start': 'start',
+        'end': 'end',
+        'end_next_day': 'end_next_day',
+        'duration': 'duration',
+    }
+
+    def get_queryset(self):
+        return filter_sessions(
+            Session.objects.filter(user=self.request.user),
+            parse_query(SessionFilterSerializer, self.request.query_params),
+        )
+
+
+def bucket_expression(bucket: str, prefix: str = ''):
+    """
+    Expression of the time bucket of a day, see StatsQuerySerializer.
+
+    :param bucket: day, week, month or weekday
+    :param prefix: path from the queried model to the day model, e.g. 'day__' for sessions
+    """
+    if bucket == 'week':
+        return TruncWeek(f'{prefix}day')
+    if bucket == 'month':
+        return TruncMonth(f'{prefix}day')
+    if bucket == 'weekday':
+        return F(f'{prefix}day_of_week')
+    return F(f'{prefix}day')
+
+
+def get_stats(user, bucket: str, group_by: Optional[str] = None, date_from=None, date_to=None) -> list:
+    """
+    Returns the study, usable and work time, the session count and the day count of the user per time bucket
+    (and per stage), or the study time and the session count per time bucket and subject.
+    Everything is aggregated by the database, with one GROUP BY query.
+    """
+    if group_by == 'subject':
+        sessions = Session.objects.filter(user=user)
+        if date_from is not None:
+            sessions = sessions.filter(day__day__gte=date_from)
+        if date_to is not None:
+            sessions = sessions.filter(day__day__lte=date_to)
+
+        return list(
+            sessions
+            .values('subject', bucket=bucket_expression(bucket, 'day__'), subject_name=F('subject__name'))
+            .annotate(study_time=Sum('duration'), session_count=Count('id'))
+            .values('bucket', 'subject', 'subject_name', 'study_time', 'session_count')
+            .order_by('bucket', 'subject')
+        )
+
+    days = Day.objects.filter(user=user)
+    if date_from is not None:
+        days = days.filter(day__gte=date_from)
+    if date_to is not None:
+        days = days.filter(day__lte=date_to)
+
+    if group_by == 'stage':
+        days = days.values('stage', bucket=bucket_expression(bucket), stage_name=F('stage__name'))
+        fields = ['bucket', 'stage', 'stage_name']
+    else:
+        days = days.values(bucket=bucket_expression(bucket))
+        fields = ['bucket']
+
+    return list(
+        days
+        .annotate(
+            study_time=Sum('study_time'),
+            usable_time=Sum('usable_time'),
+            work_time=Sum('worktime'),
+            session_count=Sum('session_count'),
+            day_count=Count('id'),
+        )
+        .values(*fields, 'study_time', 'usable_time', 'work_time', 'session_count', 'day_count')
+        .order_by(*fields)
+    )
+
+
+@extend_schema_view(get=extend_schema(
+    parameters=[StatsQuerySerializer],
+    responses={200: OpenApiTypes.OBJECT},
+    description='Endpoint giving the time usage of the current user per time bucket, and optionally per stage or '
+                'subject.',
+))
+class StatsView(ConditionalGetMixin, APIView):
+    """
+    Endpoint aggregating the days or sessions of the current user per time bucket.
+    Results are cached until the data of the user changes (see classic_tracker.models.get_data_version).
+    """
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    # Cached results expire after a day without change
+    cache_timeout = 86400
+
+    def get(self, request, *args, **kwargs):
+        return self.conditional_get(self.get_stats, request, *args, **kwargs)
+
+    def get_stats(self, request, *args, **kwargs):
+        query = StatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        key = f'stats:{request.user.id}:{get_data_version(request.user.id)}:' \
+              f'{md5(repr(sorted(query.validated_data.items())).encode()).hexdigest()}'
+        results = caches['default'].get(key)
+        if results is None:
+            results = get_stats(request.user, **query.validated_data)
+            caches['default'].set(key, results, self.cache_timeout)
+
+        return Response({**query.validated_data, 'results': results})
+
+
+# Cursors of the changes feed are times of change, in microseconds since the epoch
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Objects of the changes feed: (model, serializer class, key of the response)
+CHANGE_FEEDS = (
+    (Stage, StageSerializer, 'stages'),
+    (Day, DaySerializer, 'days'),
+    (Session, SessionSerializer, 'sessions'),
+    (Subject, SubjectSerializer, 'subjects'),
+)
+
+
+def get_changes(user, since: Optional[datetime], until: datetime, limit: int) -> Tuple[dict, dict, Optional[datetime]]:
+    """
+    Returns the objects of the user changed after since (all of them if None) and until until, inclusive,
+    and the ids of the ones deleted, in the order of the changes: {key: objects}, {key: ids}, see CHANGE_FEEDS.
+    Also returns the time of the last change returned if there are more changes, None otherwise.
+
+    At most limit changes are returned, or more if several changes were made at the same time as the last one
+    (e.g. by a single UPDATE query), s.t. the time of the last change is a valid cursor.
+    Each model is read with one query on its (user, updated_at) index, whatever the total number of objects.
+    """
+    feeds = [(key, model.objects.filter(user=user), 'updated_at') for model, _, key in CHANGE_FEEDS]
+    feeds += [(model._meta.model_name, Tombstone.objects.filter(user=user, model=model._meta.model_name), 'deleted_at')
+              for model, _, _ in CHANGE_FEEDS]
+
+    # (time of change, feed index, object), the limit + 1 first changes of each feed
+    changes = []
+    capped_feeds = []
+    for idx, (_, queryset, time_field) in enumerate(feeds):
+        queryset = queryset.filter(**{f'{time_field}__lte': until})
+        if since is not None:
+            queryset = queryset.filter(**{f'{time_field}__gt': since})
+        rows = list(queryset.order_by(time_field, 'pk')[:limit + 1])
+        changes += [(getattr(row, time_field), idx, row) for row in rows]
+        if len(rows) > limit:
+            capped_feeds.append(idx)
+    changes.sort(key=lambda change: (change[0], change[1]))
+
+    cursor = None
+    if len(changes) > limit:
+        # Changes made at the same time as the last one are all returned, including the ones beyond the limit + 1
+        # rows read from their feed
+        cursor = changes[limit - 1][0]
+        changes = [change for change in changes if change[0] <= cursor]
+        for idx in capped_feeds:
+            key, queryset, time_field = feeds[idx]
+            read_ids = [row.pk for _, feed_idx, row in changes if feed_idx == idx]
+            changes += [
+                (cursor, idx, row)
+                for row in queryset.filter(**{time_field: cursor}).exclude(pk__in=read_ids).order_by('pk')
+            ]
+
+    objects = {key: [] for _, _, key in CHANGE_FEEDS}
+    deleted_ids = {key: [] for _, _, key in CHANGE_FEEDS}
+    keys = {model._meta.model_name: key for model, _, key in CHANGE_FEEDS}
+    for _, idx, row in changes:
+        if isinstance(row, Tombstone):
+            deleted_ids[keys[row.model]].append(row.object_id)
+        else:
+            objects[feeds[idx][0]].append(row)
+
+    return objects, deleted_ids, cursor
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'Cursor older than the retention of the deletions, resynchronize without cursor.'
+    default_code = 'cursor_expired'
+
+
+@extend_schema_view(get=extend_schema(
+    parameters=[ChangesQuerySerializer],
+    responses={
+        200: OpenApiTypes.OBJECT,
+        410: OpenApiResponse(description='The cursor is older than the retention of the deletions: '
+                                         'resynchronize from scratch, without cursor.'),
+    },
+    description='Endpoint giving the stages, days, sessions and subjects of the current user created or updated, '
+                'and the ids of the ones deleted, since the cursor of the previous call. Call it again with the '
+                'cursor returned while has_more is true.',
+))
+class ChangesView(APIView):
+    """
+    Changes feed for the synchronization of offline clients: the traffic depends on the number of changes made since
+    the last synchronization, not on the number of objects of the user.
+
+    Changes are read up to settings.API_CHANGES_SETTLE_TIME seconds ago only: as times of change are set before the
+    transactions commit, a change committed later could otherwise have a time prior to a cursor already returned,
+    and be missed. The feed is then lossless as long as transactions last less than this settle time.
+
+    Deletions are only kept for settings.API_CHANGES_RETENTION_DAYS days (see the purge_tombstones command):
+    cursors older than that are answered with a 410 Gone, upon which clients resynchronize from scratch.
+    """
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        query = ChangesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        since = query.validated_data.get('since')
+        since = EPOCH + timedelta(microseconds=since) if since is not None else None
+        if since is not None and since < Tombstone.get_cutoff():
+            raise CursorExpired()
+        until = timezone.now() - timedelta(seconds=settings.API_CHANGES_SETTLE_TIME)
+        objects, deleted_ids, cursor = get_changes(request.user, since, until, query.validated_data['limit'])
+
+        # Without more changes, the next call starts from until, which can never be earlier than a later change
+        has_more = cursor is not None
+        if cursor is None:
+            cursor = max(until, since) if since is not None else until
+
+        data = {'cursor': (cursor - EPOCH) // timedelta(microseconds=1), 'has_more': has_more}
+        for _, serializer_class, key in CHANGE_FEEDS:
+            data[key] = serializer_class(objects[key], many=True, context=self.get_serializer_context()).data
+        data['deleted'] = deleted_ids
+        return Response(data)
+
+    def get_serializer_context(self):
+        return {'request': self.request, 'view': self}
@@ -1,8 +1,8 @@
 from datetime import date
 
 from django.core.exceptions import ValidationError
-from django.db.models import Q
-from django.forms import ModelForm, NumberInput, TimeInput, \
+from django.db.models import Q, QuerySet
+from django.forms import Form, ModelForm, ModelChoiceField, DateField, NumberInput, TimeInput, \
     TextInput, Textarea, DateInput, MultiWidget, Select, NullBooleanSelect
 from django.utils import dateformat, timezone
 
@@ -285,3 +285,59 @@ class SubjectCreateUpdateForm(ModelForm):
                 'rows': 5
             })
         }
+
+
+class DashboardFilterForm(Form):
+    """Optional filters of the study time distribution plot of the dashboard, submitted as GET parameters. """
+
+    stage = ModelChoiceField(
+        queryset=Stage.objects.none(),
+        required=False,
+        empty_label='All stages',
+        widget=Select(attrs={'class': 'form-select'}),
+    )
+    subject = ModelChoiceField(
+        queryset=Subject.objects.none(),
+        required=False,
+        empty_label='All subjects',
+        widget=Select(attrs={'class': 'form-select'}),
+    )
+    start_date = DateField(required=False, label='From', widget=DateSelector(attrs={'class': 'form-control'}))
+    end_date = DateField(required=False, label='To', widget=DateSelector(attrs={'class': 'form-control'}))
+
+    def __init__(self, *args, **kwargs):
+        # Get current user from view
+        self.user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+
+        # Make sure user only sees his own stages and subjects
+        self.fields['stage'].queryset = Stage.objects.filter(user=self.user)
+        self.fields['subject'].queryset = Subject.objects.filter(user=self.user)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get('start_date')
+        end_date = cleaned_data.get('end_date')
+
+        # Validation ensuring the date range is not empty
+        if start_date is not None and end_date is not None and start_date > end_date:
+            raise ValidationError("The start date must not be after the end date !")
+
+    def has_filters(self) -> bool:
+        """Whether at least one filter is set. Must be called after is_valid. """
+
+        return any(value is not None for value in self.cleaned_data.values())
+
+    def filter_sessions(self, sessions: QuerySet) -> QuerySet:
+        """Applies the filters to a session queryset. Must be called after is_valid. """
+
+        if self.cleaned_data['stage'] is not None:
+            sessions = sessions.filter(day__stage=self.cleaned_data['stage'])
+        if self.cleaned_data['subject'] is not None:
+            sessions = sessions.filter(subject=self.cleaned_data['subject'])
+        if self.cleaned_data['start_date'] is not None:
+            sessions = sessions.filter(day__day__gte=self.cleaned_data['start_date'])
+        if self.cleaned_data['end_date'] is not None:
+            sessions = sessions.filter(day__day__lte=self.cleaned_data['end_date'])
+
+        return sessions
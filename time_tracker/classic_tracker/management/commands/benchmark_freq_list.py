@@ -0,0 +1,76 @@
+from datetime import time
+from timeit import timeit
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+# noinspection PyUnresolvedReferences
+from classic_tracker.models import histogram_diff
+# noinspection PyUnresolvedReferences
+from classic_tracker.views import cumsum_in_place, freq_list_from_arrays
+
+
+def python_freq_list(sessions: list, n_steps_per_hour: int) -> list:
+    """Row by row frequency list, i.e. how get_freq_list used to iterate over (start, end, end_next_day). """
+
+    times = [0] * (n_steps_per_hour * 24)
+    diff = histogram_diff(((start, end, end_next_day, 1) for start, end, end_next_day in sessions), n_steps_per_hour)
+    for idx, delta in diff.items():
+        times[idx] += delta
+    cumsum_in_place(times)
+
+    return times
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the vectorized frequency list of the dashboard against the row by row implementation'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            nargs='+',
+            type=int,
+            default=[10_000, 100_000, 1_000_000],
+            help='Numbers of (random) sessions to benchmark.',
+        )
+        parser.add_argument(
+            '--n-steps-per-hour',
+            type=int,
+            default=4,
+            help='Number of steps per hour of the frequency list.',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of runs per size, the mean time is reported.',
+        )
+
+    def handle(self, *args, **options):
+        n_steps_per_hour = options['n_steps_per_hour']
+        repeat = options['repeat']
+        rng = np.random.default_rng(0)
+
+        self.stdout.write(f'{"Sessions":>10} {"Python (s)":>12} {"NumPy (s)":>12} {"Speed-up":>10}')
+        for size in options['sizes']:
+            # Random sessions, a tenth of which spans across midnight.
+            # The database loading step is left out, both implementations being given in-memory data.
+            start = rng.integers(0, 24 * 60, size)
+            end = rng.integers(0, 24 * 60, size)
+            end_next_day = rng.random(size) < 0.1
+            sessions = [
+                (time(*divmod(s, 60)), time(*divmod(e, 60)), bool(n))
+                for s, e, n in zip(start.tolist(), end.tolist(), end_next_day.tolist())
+            ]
+
+            assert python_freq_list(sessions, n_steps_per_hour) == \
+                freq_list_from_arrays(start, end, end_next_day, n_steps_per_hour), 'Implementations disagree'
+
+            python_time = timeit(lambda: python_freq_list(sessions, n_steps_per_hour), number=repeat) / repeat
+            numpy_time = timeit(
+                lambda: freq_list_from_arrays(start, end, end_next_day, n_steps_per_hour), number=repeat
+            ) / repeat
+
+            self.stdout.write(f'{size:>10} {python_time:>12.4f} {numpy_time:>12.4f} {python_time / numpy_time:>9.1f}x')
+
+        self.stdout.write(self.style.SUCCESS('Done!'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+# noinspection PyUnresolvedReferences
+from classic_tracker.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = 'Purge the tombstones (records of deletions given by the changes feed of the API) older than ' \
+           'settings.API_CHANGES_RETENTION_DAYS days. Meant to be run periodically, e.g. daily.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Number of tombstones deleted (and committed) together, s.t. the table is never locked for long.',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = Tombstone.get_cutoff()
+        tombstones = Tombstone.objects.filter(deleted_at__lt=cutoff)
+        self.stdout.write(f'Purging the tombstones of deletions before {cutoff.isoformat()}')
+
+        purged = 0
+        while True:
+            pks = list(tombstones.order_by().values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            purged += Tombstone.objects.filter(pk__in=pks).delete()[0]
+
+        self.stdout.write(f'{purged} tombstone(s) purged')
+        self.stdout.write(self.style.SUCCESS('Done!'))
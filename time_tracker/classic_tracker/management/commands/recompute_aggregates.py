@@ -0,0 +1,214 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from decimal import Decimal
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import OuterRef, Subquery, Sum, Count, F, FloatField, QuerySet
+from django.db.models.functions import Coalesce, NullIf
+
+# noinspection PyUnresolvedReferences
+from classic_tracker.models import User, Stage, Day, Session, Subject, HISTOGRAM_STEPS_PER_HOUR, histogram_diff, \
+    pack_histogram, unpack_histogram, bump_data_version
+
+
+def grouped_total(queryset: QuerySet, lookup: str, aggregate):
+    """
+    Correlated subquery which computes aggregate over the rows of queryset related to the outer row through lookup.
+    Returns 0 instead of NULL if no row is related.
+    """
+
+    group = queryset.order_by().filter(**{lookup: OuterRef('pk')}).values(lookup)
+    return Coalesce(Subquery(group.annotate(total=aggregate).values('total')), 0)
+
+
+def expected_values(model) -> dict:
+    """
+    Returns {field name: expression computing the field from the ground truth} for the aggregate fields of model.
+
+    The ground truth is made of the Session and Day rows (i.e. their duration, worktime and usable time).
+    The study times and session counts are always computed from the sessions, never from the (possibly wrong)
+    aggregates of the days, so that the expectations of every model hold in check mode too.
+    """
+
+    if model is Day:
+        expected = {
+            'study_time': grouped_total(Session.objects, 'day', Sum('duration')),
+            'session_count': grouped_total(Session.objects, 'day', Count('id')),
+        }
+    elif model is Subject:
+        expected = {
+            'total_study_time': grouped_total(Session.objects, 'subject', Sum('duration')),
+            'session_count': grouped_total(Session.objects, 'subject', Count('id')),
+        }
+    elif model is Stage:
+        expected = {
+            'day_count': grouped_total(Day.objects, 'stage', Count('id')),
+            'session_count': grouped_total(Session.objects, 'day__stage', Count('id')),
+            'total_usable_time': grouped_total(Day.objects, 'stage', Sum('usable_time')),
+            'total_study_time': grouped_total(Session.objects, 'day__stage', Sum('duration')),
+            'total_work_time': grouped_total(Day.objects, 'stage', Sum('worktime')),
+        }
+    else:
+        expected = {
+            'stage_count': grouped_total(Stage.objects, 'user', Count('id')),
+            'subject_count': grouped_total(Subject.objects, 'user', Count('id')),
+            'day_count': grouped_total(Day.objects, 'user', Count('id')),
+            'session_count': grouped_total(Session.objects, 'user', Count('id')),
+            'total_usable_time': grouped_total(Day.objects, 'user', Sum('usable_time')),
+            'total_study_time': grouped_total(Session.objects, 'user', Sum('duration')),
+            'total_work_time': grouped_total(Day.objects, 'user', Sum('worktime')),
+        }
+
+    ratio_fields = getattr(model, 'ratio_fields', None)
+    if ratio_fields is not None:
+        numerator, denominator = (expected.get(field, F(field)) for field in ratio_fields)
+        expected['time_usage_ratio'] = Coalesce(numerator * 1.0 / NullIf(denominator, 0), 0, output_field=FloatField())
+
+    return expected
+
+
+def is_mismatch(field: str, value, expected) -> bool:
+    """Compares a stored aggregate with its expected value. Ratios are compared up to their last decimal place. """
+
+    if field == 'time_usage_ratio':
+        return abs(Decimal(str(expected)) - value) > Decimal('0.0001')
+    return value != expected
+
+
+def recompute_users(user_ids: list, check: bool = False, chunk_size: int = 2000) -> Counter:
+    """
+    Recomputes the aggregates of the given users and of all their stages, days and subjects.
+
+    Returns the number of mismatching rows per model name. If check is True, nothing is written.
+    """
+
+    mismatches = Counter()
+
+    with transaction.atomic():
+        for model in (Day, Subject, Stage, User):
+            expected = expected_values(model)
+            rows = model.objects.filter(**{'pk__in' if model is User else 'user__in': user_ids}).annotate(
+                **{f'expected_{field}': expression for field, expression in expected.items()}
+            )
+
+            mismatched_pks = []
+            for row in rows.values('pk', *expected, *(f'expected_{field}' for field in expected)).iterator(chunk_size):
+                if any(is_mismatch(field, row[field], row[f'expected_{field}']) for field in expected):
+                    mismatched_pks.append(row['pk'])
+
+            mismatches[model.__name__] += len(mismatched_pks)
+
+            if not check and mismatched_pks:
+                model.objects.filter(pk__in=mismatched_pks).update(**expected)
+
+        # The study time histograms are packed, hence rebuilt in Python from the sessions grouped by time
+        diffs = {user_id: Counter() for user_id in user_ids}
+        sessions = Session.objects.filter(user__in=user_ids).order_by() \
+            .values_list('user', 'start', 'end', 'end_next_day').annotate(count=Count('id'))
+        for user_id, *session in sessions.iterator(chunk_size):
+            diffs[user_id].update(histogram_diff([session]))
+
+        n_steps_per_day = HISTOGRAM_STEPS_PER_HOUR * 24
+        for user_id, packed in User.objects.filter(pk__in=user_ids).values_list('pk', 'study_time_histogram'):
+            histogram = [diffs[user_id][idx] for idx in range(n_steps_per_day)]
+            if unpack_histogram(packed) != histogram:
+                mismatches['Histogram'] += 1
+                if not check:
+                    User.objects.filter(pk=user_id).update(study_time_histogram=pack_histogram(histogram))
+
+        # Invalidate the cached pages of the users once the fixes are committed
+        if not check and sum(mismatches.values()):
+            for user_id in user_ids:
+                bump_data_version(user_id)
+
+    return mismatches
+
+
+def close_db_connections() -> None:
+    """Makes sure that a worker process does not reuse the database connections inherited from its parent. """
+
+    connections.close_all()
+
+
+def chunked(iterable, size: int):
+    """Yields lists of at most size elements of iterable, without consuming it all at once. """
+
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'Recompute the aggregates (totals, counts, ratios and study time histograms) of all models ' \
+           'from the sessions and days'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Dry run: only report the rows whose aggregates are wrong, without fixing them.',
+        )
+        parser.add_argument(
+            '--users',
+            nargs='+',
+            default=None,
+            metavar='USERNAME',
+            help='Only recompute the aggregates of these users.',
+        )
+        parser.add_argument(
+            '--since',
+            type=date.fromisoformat,
+            default=None,
+            metavar='YYYY-MM-DD',
+            help='Only recompute the aggregates of users who have at least one day on or after this date.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=100,
+            help='Number of users processed (and committed) together.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of worker processes. Chunks of users are distributed among them.',
+        )
+
+    def handle(self, *args, **options):
+        check = options['check']
+        workers = options['workers']
+
+        users = User.objects.all()
+        if options['users']:
+            users = users.filter(username__in=options['users'])
+        if options['since']:
+            users = users.filter(pk__in=Day.objects.filter(day__gte=options['since']).values('user'))
+
+        # User ids are streamed, so that memory usage does not grow with the number of users
+        user_ids = users.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=options['chunk_size'])
+        chunks = chunked(user_ids, options['chunk_size'])
+
+        self.stdout.write(f'{"Checking" if check else "Recomputing"} aggregates with {workers} worker(s)')
+
+        mismatches = Counter()
+        if workers > 1:
+            # The ids are fetched before forking, since connections cannot be shared among processes
+            chunks = list(chunks)
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=close_db_connections) as executor:
+                for result in executor.map(recompute_users, chunks, [check] * len(chunks)):
+                    mismatches.update(result)
+        else:
+            for chunk in chunks:
+                mismatches.update(recompute_users(chunk, check))
+
+        for name in ('Day', 'Subject', 'Stage', 'User', 'Histogram'):
+            count = mismatches[name]
+            message = f'{name}: {count} row(s) with wrong aggregates{"" if check or not count else " fixed"}'
+            self.stdout.write(self.style.WARNING(message) if count else message)
+
+        self.stdout.write(self.style.SUCCESS('Done!'))
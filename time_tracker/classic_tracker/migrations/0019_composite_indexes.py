@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classic_tracker', '0018_alter_user_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['day', 'subject'], name='session_day_subject_idx'),
+        ),
+        migrations.AlterField(
+            model_name='session',
+            name='day',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='classic_tracker.day'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.30 on 2026-10-17 09:12
+
+import struct
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+
+# The histogram format as of this migration (copied, so that later changes to the models do not alter it)
+STEPS_PER_HOUR = 4
+STEPS_PER_DAY = STEPS_PER_HOUR * 24
+
+
+def time_to_idx(t):
+    """Returns (overflow, index) of a time in the histogram, see models.time_to_idx. """
+
+    return divmod(t.hour * STEPS_PER_HOUR + round(t.minute * STEPS_PER_HOUR / 60), STEPS_PER_DAY)
+
+
+def histogram_diff(sessions):
+    """Returns the difference array {index: count} of (start, end, end_next_day, count) rows, see models.histogram_diff. """
+
+    diff = Counter()
+    for start, end, end_next_day, count in sessions:
+        if start is not None and end is not None and end_next_day is not None:
+            if end_next_day:
+                diff[0] += count
+            diff[time_to_idx(start)[1]] += count
+            idx_overflow, end_idx = time_to_idx(end)
+            if end_idx + 1 < STEPS_PER_DAY:
+                diff[end_idx + 1] -= count
+            if idx_overflow:
+                diff[0] += count
+    return diff
+
+
+def build_histograms(apps, schema_editor):
+    """Builds the study time histogram of existing users from their sessions. """
+
+    User = apps.get_model('classic_tracker', 'User')
+    Session = apps.get_model('classic_tracker', 'Session')
+
+    for user_id in User.objects.filter(session__isnull=False).distinct().values_list('pk', flat=True):
+        sessions = Session.objects.filter(user=user_id).order_by() \
+            .values_list('start', 'end', 'end_next_day').annotate(count=Count('id'))
+        diff = histogram_diff(sessions)
+        User.objects.filter(pk=user_id).update(
+            study_time_histogram=struct.pack(f'<{STEPS_PER_DAY}i', *(diff[idx] for idx in range(STEPS_PER_DAY)))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classic_tracker', '0019_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='study_time_histogram',
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.RunPython(build_histograms, migrations.RunPython.noop),
+    ]
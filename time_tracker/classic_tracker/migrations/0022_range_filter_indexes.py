@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classic_tracker', '0021_change_tracking'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='day',
+            index=models.Index(fields=['user', 'start'], name='day_user_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='day',
+            index=models.Index(fields=['user', 'study_time'], name='day_user_study_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['user', 'start'], name='session_user_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['user', 'duration'], name='session_user_duration_idx'),
+        ),
+    ]
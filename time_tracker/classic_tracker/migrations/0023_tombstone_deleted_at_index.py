@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classic_tracker', '0022_range_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['deleted_at'], name='tombstone_deleted_at_idx'),
+        ),
+    ]
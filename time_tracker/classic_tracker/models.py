@@ -1,12 +1,18 @@
-from datetime import time
+import struct
+from collections import Counter
+from datetime import datetime, time, timedelta
+from time import time_ns
+from typing import Dict, Iterable, List, Optional, Tuple, Type
 
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import caches
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
-from django.db.models import Q
-
-# TODO: add DB indices to all models
+from django.db import connection, models, transaction
+from django.db.models import Q, F, FloatField, IntegerField, QuerySet, OuterRef, Subquery, Sum, Count, Case, When, \
+    Value
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import timezone
 
 
 def time_diff_in_seconds(start: time, end: time, end_next_day: bool) -> int:
@@ -27,7 +33,501 @@ def time_diff_in_seconds(start: time, end: time, end_next_day: bool) -> int:
         return (end.hour - start.hour) * 3600 + (end.minute - start.minute) * 60
 
 
-class User(AbstractUser):
+# Number of steps per hour of the users' study time histograms (plotted in the dashboard), i.e. 15 min steps
+HISTOGRAM_STEPS_PER_HOUR = 4
+
+
+def time_to_idx(t: time, n_steps_per_hour: int) -> (bool, int):
+    """
+    The first output indicates if the input time is too close to midnight s.t. the index overflows and becomes 0.
+    The second output is the index (in the frequency list, which is used in the dashboard plot) corresponds to a time.
+
+    Example: if the frequency list is quantized s.t. it has 4 steps per hour,
+    then 2:15 AM corresponds to index 2 * 4 + 15 * 4 / 60 = 9 in the frequency list.
+    """
+
+    # Attention: Python's round function rounds to the nearest even integer
+    return divmod(t.hour * n_steps_per_hour + round(t.minute * n_steps_per_hour / 60), n_steps_per_hour * 24)
+
+
+def histogram_diff(sessions: Iterable[Tuple[time, time, bool, int]],
+                   n_steps_per_hour: int = HISTOGRAM_STEPS_PER_HOUR) -> Counter:
+    """
+    Returns the changes {index: delta} brought by sessions to the difference array of a study time histogram,
+    i.e. the array whose cumsum is the number of sessions covering each step of the day (see views.get_freq_list).
+    Sessions which are not fully defined (end may be completed later) are ignored.
+
+    :param sessions: iterable of (start, end, end_next_day, weight), where weight is the number of such sessions,
+    negative if they are removed
+    :param n_steps_per_hour: number of steps per hour of the histogram
+    """
+
+    n_steps_per_day = n_steps_per_hour * 24
+    diff = Counter()
+
+    for start, end, end_next_day, weight in sessions:
+        if start is not None and end is not None and end_next_day is not None:
+
+            if end_next_day:
+                diff[0] += weight
+
+            diff[time_to_idx(start, n_steps_per_hour)[1]] += weight
+
+            # Avoid end_idx out of range
+            idx_overflow, end_idx = time_to_idx(end, n_steps_per_hour)
+            if end_idx + 1 < n_steps_per_day:
+                diff[end_idx + 1] -= weight
+
+            if idx_overflow:
+                diff[0] += weight
+
+    return diff
+
+
+def removed_sessions_histogram_diff(sessions: QuerySet) -> Counter:
+    """
+    Returns the changes brought to the study time histogram by the removal of sessions, see histogram_diff.
+    Sessions are grouped by (start, end, end_next_day) in the database, so that few rows are transferred.
+    """
+
+    return histogram_diff(
+        (start, end, end_next_day, -count) for start, end, end_next_day, count in
+        sessions.order_by().values_list('start', 'end', 'end_next_day').annotate(count=Count('id'))
+    )
+
+
+def pack_histogram(histogram: List[int]) -> bytes:
+    """Packs a histogram (or its difference array) as little-endian 32-bit integers. """
+
+    return struct.pack(f'<{len(histogram)}i', *histogram)
+
+
+def unpack_histogram(packed: Optional[bytes], n_steps_per_hour: int = HISTOGRAM_STEPS_PER_HOUR) -> List[int]:
+    """Inverse of pack_histogram. An empty value (i.e. a user who never had any session) gives zeros. """
+
+    if not packed:
+        return [0] * (n_steps_per_hour * 24)
+
+    return list(struct.unpack(f'<{len(packed) // 4}i', bytes(packed)))
+
+
+def cached_related(obj: models.Model, field_name: str) -> Optional[models.Model]:
+    """
+    Returns the object related to obj through the foreign key field_name if it has already been fetched,
+    otherwise None. No query is made.
+    """
+
+    return getattr(obj, field_name) if getattr(type(obj), field_name).is_cached(obj) else None
+
+
+def update_with_deltas(queryset: QuerySet, deltas: dict, values: Optional[dict] = None) -> int:
+    """
+    Adds deltas to the aggregate fields of every row of queryset in one UPDATE ... SET col = col + delta query,
+    so that concurrent writes to the same rows are never lost (no read-modify-write in Python).
+    If the model defines ratio_fields, its time_usage_ratio is recomputed in SQL in the same query.
+    If the model has an updated_at field (see the changes feed of the API), it is set to the current time.
+
+    Returns the number of rows updated.
+
+    :param queryset: rows to update
+    :param deltas: {field name: delta}, where a delta is an integer or an expression (e.g. a correlated subquery)
+    :param values: {field name: value} of other fields to set in the same query (optional)
+    """
+
+    updates = {}
+    ratio_fields = getattr(queryset.model, 'ratio_fields', None)
+    if ratio_fields is not None and not deltas.keys().isdisjoint(ratio_fields):
+        numerator, denominator = ratio_fields
+
+        # Attention: this must be the first assignment, since MySQL evaluates the assignments of an UPDATE from left
+        # to right using the already updated values, whereas other backends use the values prior to the update.
+        # With the deltas added explicitly, both give the same result.
+        updates['time_usage_ratio'] = Coalesce(
+            (F(numerator) + deltas.get(numerator, 0)) * 1.0 / NullIf(F(denominator) + deltas.get(denominator, 0), 0),
+            0,
+            output_field=FloatField(),
+        )
+
+    updates.update({field: F(field) + delta for field, delta in deltas.items()})
+    if any(field.name == 'updated_at' for field in queryset.model._meta.concrete_fields):
+        updates['updated_at'] = timezone.now()
+    updates.update(values or {})
+    return queryset.update(**updates)
+
+
+def apply_deltas(model: Type[models.Model], pk: int, deltas: Dict[str, int], obj: Optional[models.Model] = None,
+                 values: Optional[dict] = None) -> None:
+    """
+    Adds deltas to the aggregate fields of a single row, see update_with_deltas.
+    Only the fields with a non-zero delta are touched, and no query is made if all deltas are zero and no value is set.
+
+    :param model: model class of the row to update
+    :param pk: primary key of the row to update
+    :param deltas: {field name: delta}
+    :param obj: in-memory instance of the same row (optional), on which the deltas are mirrored
+    :param values: {field name: value} of other fields to set in the same query (optional)
+    """
+
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas and not values:
+        return
+
+    update_with_deltas(model.objects.filter(pk=pk), deltas, values)
+
+    # Keep the in-memory instance (and its snapshot, see TrackedFieldsMixin) consistent with the database.
+    # Deferred fields are skipped, as reading them would trigger a query.
+    if obj is not None:
+        deferred_fields = obj.get_deferred_fields()
+        snapshot = getattr(obj, '_snapshot', None)
+        for field, delta in deltas.items():
+            if field not in deferred_fields:
+                setattr(obj, field, getattr(obj, field) + delta)
+            if snapshot is not None and field in snapshot:
+                snapshot[field] += delta
+
+        for field, value in (values or {}).items():
+            if field not in deferred_fields:
+                setattr(obj, field, value)
+
+        ratio_fields = getattr(model, 'ratio_fields', None)
+        if ratio_fields is not None and not deltas.keys().isdisjoint(ratio_fields) \
+                and deferred_fields.isdisjoint(ratio_fields):
+            numerator, denominator = ratio_fields
+            try:
+                obj.time_usage_ratio = getattr(obj, numerator) / getattr(obj, denominator)
+            except ZeroDivisionError:
+                obj.time_usage_ratio = 0
+
+
+def update_with_grouped_deltas(model: Type[models.Model], deltas_by_pk: Dict[int, Dict[str, int]]) -> int:
+    """
+    Adds to each row its own deltas in a single UPDATE query whatever the number of rows (see update_with_deltas),
+    the delta of each field being selected by a CASE pk WHEN ... expression. Rows whose deltas are all zero
+    (e.g. the net changes of a parent whose children were moved within it) are not updated.
+
+    Returns the number of rows updated.
+
+    :param model: model class of the rows to update
+    :param deltas_by_pk: {primary key: {field name: delta}}
+    """
+
+    deltas_by_pk = {pk: deltas for pk, deltas in deltas_by_pk.items() if any(deltas.values())}
+    fields = {field for deltas in deltas_by_pk.values() for field, delta in deltas.items() if delta}
+    if not fields:
+        return 0
+
+    return update_with_deltas(
+        model.objects.filter(pk__in=deltas_by_pk),
+        {
+            field: Case(
+                *(When(pk=pk, then=Value(deltas.get(field, 0))) for pk, deltas in deltas_by_pk.items()),
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+            for field in fields
+        }
+    )
+
+
+def get_autoinc_lock_mode() -> int:
+    """
+    Returns innodb_autoinc_lock_mode of the MySQL server, read once per connection. InnoDB allocates consecutive
+    auto-increment values to the rows of a multi-row INSERT (a "simple insert") only if it is 0 ("traditional")
+    or 1 ("consecutive"): with 2 ("interleaved"), the default of MySQL 8, the values of concurrent inserts may interleave.
+    """
+
+    mode = getattr(connection, 'innodb_autoinc_lock_mode', None)
+    if mode is None:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT @@innodb_autoinc_lock_mode')
+            mode = connection.innodb_autoinc_lock_mode = cursor.fetchone()[0]
+
+    return mode
+
+
+def bulk_insert(model: Type[models.Model], objs: List[models.Model],
+                unique_fields: Tuple[str, ...] = ()) -> List[models.Model]:
+    """
+    Inserts new objects with a single INSERT query (no save() is called) and sets their primary keys.
+
+    MySQL does not return the primary keys of the rows of a bulk insert, so they are selected by the unique fields
+    of the objects, with one more query. Without unique fields, they are deduced from LAST_INSERT_ID(), the first
+    of the consecutive ids allocated if innodb_autoinc_lock_mode is at most 1 (see get_autoinc_lock_mode). Otherwise,
+    the objects are inserted one by one.
+
+    :param model: model class of the objects
+    :param objs: new objects
+    :param unique_fields: attribute names of fields which are unique together, e.g. ('user_id', 'name') (optional)
+    """
+
+    if not objs or connection.features.can_return_rows_from_bulk_insert:
+        objs = model.objects.bulk_create(objs)
+
+    elif unique_fields:
+        objs = model.objects.bulk_create(objs)
+        # The rows are narrowed down by an IN list per field, the others are not looked up
+        pks = {
+            tuple(row[1:]): row[0] for row in model.objects.filter(**{
+                f'{field}__in': {getattr(obj, field) for obj in objs} for field in unique_fields
+            }).values_list('pk', *unique_fields)
+        }
+        for obj in objs:
+            obj.pk = pks[tuple(getattr(obj, field) for field in unique_fields)]
+
+    elif get_autoinc_lock_mode() <= 1:
+        objs = model.objects.bulk_create(objs)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT LAST_INSERT_ID()')
+            first_pk = cursor.fetchone()[0]
+        for offset, obj in enumerate(objs):
+            obj.pk = first_pk + offset
+
+    else:
+        for obj in objs:
+            # The primary key of a single row is returned
+            models.Model.save_base(obj, force_insert=True)
+
+    for obj in objs:
+        if isinstance(obj, TrackedFieldsMixin):
+            obj.take_snapshot()
+
+    return objs
+
+
+def subtract_sessions(model: Type[models.Model], sessions: QuerySet, lookup: str, study_time_field: str) -> int:
+    """
+    Subtracts the total duration and the count of sessions from every row of model they relate to,
+    in one UPDATE query whatever the number of sessions and related rows.
+    The per-row totals are computed by the database with a correlated, grouped subquery.
+
+    Returns the number of rows updated.
+
+    :param model: Day, Stage or Subject
+    :param sessions: sessions about to be removed
+    :param lookup: path from the session model to model, e.g. 'day__stage'
+    :param study_time_field: name of the field of model which holds the study time
+    """
+
+    group = sessions.order_by().filter(**{lookup: OuterRef('pk')}).values(lookup)
+    return update_with_deltas(
+        model.objects.filter(pk__in=sessions.order_by().values(lookup)),
+        {
+            study_time_field: -Subquery(group.annotate(total=Sum('duration')).values('total')),
+            'session_count': -Subquery(group.annotate(total=Count('id')).values('total')),
+        }
+    )
+
+
+def create_tombstones(queryset: QuerySet) -> None:
+    """
+    Records the deletion of the rows of queryset (which must be called before they are deleted) in one INSERT query,
+    so that the deletions made without calling delete() on each object (e.g. cascades) appear in the changes feed.
+    The rows share the same time of deletion, as the objects updated by a single query.
+    """
+    now = timezone.now()
+    Tombstone.objects.bulk_create(
+        Tombstone(user_id=user_id, model=queryset.model._meta.model_name, object_id=pk, deleted_at=now)
+        for pk, user_id in queryset.order_by().values_list('pk', 'user_id')
+    )
+
+
+def apply_user_deltas(user_id: int, deltas: Dict[str, int], histogram_changes: Optional[Dict[int, int]] = None,
+                      user: Optional[models.Model] = None) -> None:
+    """
+    Same as apply_deltas for a user, but also adds histogram_changes (see histogram_diff) to the user's study time
+    histogram. A packed histogram cannot be incremented in SQL, so the user row is locked by a SELECT ... FOR UPDATE,
+    and the new histogram is written by the same UPDATE as the deltas.
+
+    Every write of the aggregates of a user updates the user row first, before the rows of its stages, days,
+    subjects and sessions, so that the concurrent writes of a user are serialized by the lock of the user row and
+    cannot deadlock. Updating it last would not be enough: the foreign key checks of the rows inserted or deleted
+    before (e.g. a new stage, tombstones) hold shared locks on the user row, which the update would then upgrade.
+
+    :param user_id: id of the user to update
+    :param deltas: {field name: delta}
+    :param histogram_changes: {index: delta} to add to the difference array of the study time histogram (optional)
+    :param user: in-memory user object (optional), on which the changes are mirrored
+    """
+
+    histogram_changes = {idx: delta for idx, delta in (histogram_changes or {}).items() if delta}
+    if not histogram_changes:
+        apply_deltas(User, user_id, deltas, user)
+        return
+
+    with transaction.atomic(savepoint=False):
+        histogram = unpack_histogram(
+            User.objects.select_for_update().values_list('study_time_histogram', flat=True).get(pk=user_id)
+        )
+        for idx, delta in histogram_changes.items():
+            histogram[idx] += delta
+
+        apply_deltas(User, user_id, deltas, user, values={'study_time_histogram': pack_histogram(histogram)})
+
+
+def lock_users(queryset: QuerySet) -> None:
+    """
+    Locks the users of the rows of queryset by a SELECT ... FOR UPDATE, before the rows themselves are locked to
+    read the deltas of a bulk write (see apply_user_deltas for the order).
+    """
+
+    list(User.objects.filter(pk__in=queryset.order_by().values('user_id')).select_for_update().values_list('pk'))
+
+
+def propagate_day_deltas(day_deltas: Dict[models.Model, Dict[str, int]], user_id: int,
+                         user: Optional[models.Model] = None,
+                         histogram_changes: Optional[Dict[int, int]] = None,
+                         subject_deltas: Optional[Dict[int, Dict[str, int]]] = None,
+                         subject: Optional[models.Model] = None) -> None:
+    """
+    Applies session level changes to the user, then to the days concerned, to their stages and to the subjects
+    (see apply_user_deltas for the order). Deltas are merged per parent, s.t. each parent row is updated by at most
+    one query.
+
+    :param day_deltas: {day object: {'study_time': delta, 'session_count': delta}}
+    :param user_id: id of the user who owns the days
+    :param user: in-memory user object (optional), on which the deltas are mirrored
+    :param histogram_changes: changes of the user's study time histogram, see apply_user_deltas (optional)
+    :param subject_deltas: {subject id: {'total_study_time': delta, 'session_count': delta}} (optional)
+    :param subject: in-memory subject object (optional), on which its deltas are mirrored
+    """
+
+    stage_deltas = {}
+    stages = {}
+    for day, deltas in day_deltas.items():
+        stage_deltas.setdefault(day.stage_id, Counter()).update(
+            total_study_time=deltas.get('study_time', 0),
+            session_count=deltas.get('session_count', 0),
+        )
+        stages.setdefault(day.stage_id, cached_related(day, 'stage'))
+
+    user_deltas = Counter()
+    for deltas in stage_deltas.values():
+        user_deltas.update(deltas)
+    apply_user_deltas(user_id, user_deltas, histogram_changes, user)
+
+    for day, deltas in day_deltas.items():
+        apply_deltas(Day, day.pk, deltas, day)
+    for stage_id, deltas in stage_deltas.items():
+        apply_deltas(Stage, stage_id, deltas, stages[stage_id])
+    for subject_id, deltas in (subject_deltas or {}).items():
+        apply_deltas(Subject, subject_id, deltas, subject if subject is not None and subject.pk == subject_id else None)
+
+
+def data_version_key(user_id: int) -> str:
+    """Cache key of the data version of a user, see get_data_version. """
+
+    return f'data_version:{user_id}'
+
+
+def get_version(key: str) -> int:
+    """Returns the version stored in the cache under key, which is initialized if missing. """
+
+    cache = caches['default']
+    version = cache.get(key)
+    if version is None:
+        # Start from the current time instead of 0, so that if the version is lost (e.g. evicted),
+        # the entries cached under the previous versions are never served again.
+        cache.add(key, time_ns(), timeout=None)
+        version = cache.get(key)
+
+    return version
+
+
+def bump_version(key: str) -> None:
+    """Increments the version stored in the cache under key once the current transaction is committed. """
+
+    def bump():
+        try:
+            caches['default'].incr(key)
+        except ValueError:
+            # No version yet, any new one invalidates the cached entries
+            caches['default'].add(key, time_ns(), timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def get_data_version(user_id: int) -> int:
+    """
+    Returns the version of the data of a user, which is part of the keys of the fragments cached for this user,
+    s.t. all of them are invalidated at once by bump_data_version. Stale fragments then simply expire.
+    """
+
+    return get_version(data_version_key(user_id))
+
+
+def bump_data_version(user_id: int) -> None:
+    """
+    Invalidates all fragments cached for a user, by incrementing the data version of the user (in O(1)).
+    The bump happens once the current transaction is committed, so that no fragment rendered from the data prior
+    to the commit can be cached under the new version.
+    """
+
+    bump_version(data_version_key(user_id))
+
+
+class TrackedFieldsMixin:
+    """
+    Keeps a snapshot of the values of tracked_fields as they are in the database,
+    i.e. as loaded by from_db or as last written by save, so that save can compute deltas without re-fetching the row.
+
+    The snapshot is only missing for instances which were never loaded nor saved, or were loaded with deferred
+    tracked fields, in which case get_snapshot falls back to a query.
+    """
+
+    # Attribute names (e.g. stage_id for a foreign key) of the fields whose previous values are needed on save
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        obj = super().from_db(db, field_names, values)
+        obj.take_snapshot()
+        return obj
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+
+        # A partial refresh (e.g. loading a deferred field) leaves the other fields untouched,
+        # which may have been modified in memory since.
+        if fields is None:
+            self.take_snapshot()
+
+    def take_snapshot(self) -> None:
+        """Records the current values of tracked_fields, which must be equal to the ones in the database. """
+
+        if self.get_deferred_fields().isdisjoint(self.tracked_fields):
+            self._snapshot = {field: getattr(self, field) for field in self.tracked_fields}
+        else:
+            self._snapshot = None
+
+    def get_snapshot(self) -> Optional[dict]:
+        """Returns {tracked field: value in database}, or None if the row does not exist (yet). """
+
+        if self.pk is None:
+            return None
+
+        snapshot = getattr(self, '_snapshot', None)
+        if snapshot is None:
+            snapshot = type(self)._base_manager.filter(pk=self.pk).values(*self.tracked_fields).first()
+
+        return snapshot
+
+    def get_update_fields(self, update_fields: Optional[list], excluded: tuple) -> list:
+        """
+        Returns the fields written by save when updating the row: update_fields, all fields if None,
+        except the excluded ones (e.g. the aggregates, which are written as deltas with apply_deltas).
+        """
+
+        if update_fields is None:
+            # As Model.save, the deferred fields are not written
+            deferred_fields = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred_fields
+            ]
+        return [field for field in update_fields if field not in excluded]
+
+
+class User(TrackedFieldsMixin, AbstractUser):
     """
     Custom user model, which extends Django's built-in AbstractUser model.
 
@@ -58,6 +558,18 @@ class User(AbstractUser):
         validators=[MinValueValidator(0), MaxValueValidator(1)]
     )
 
+    # Difference array of the number of sessions covering each step (of 1 / HISTOGRAM_STEPS_PER_HOUR hour) of the day,
+    # packed by pack_histogram. Its cumsum is the study time distribution plotted in the dashboard.
+    study_time_histogram = models.BinaryField(default=bytes)
+
+    # (numerator, denominator) of time_usage_ratio, used when the ratio is recomputed in SQL
+    ratio_fields = ('total_study_time', 'total_usable_time')
+
+    tracked_fields = (
+        'total_usable_time', 'total_study_time', 'total_work_time',
+        'stage_count', 'day_count', 'session_count', 'subject_count',
+    )
+
     def __str__(self):
         return f"{self.username}"
 
@@ -68,10 +580,33 @@ class User(AbstractUser):
         except ZeroDivisionError:
             self.time_usage_ratio = 0
 
-        super().save(*args, **kwargs)
-
-
-class Day(models.Model):
+        if self._state.adding:
+            super().save(*args, **kwargs)
+        else:
+            # The aggregates, their ratio and the histogram are only written as deltas, so that the increments made
+            # since the user was loaded (e.g. by a new session) are not overwritten with the values in memory.
+            # Aggregates modified in memory are applied as deltas, read from the snapshot only if they are loaded.
+            update_fields = kwargs.pop('update_fields', None)
+            deferred_fields = self.get_deferred_fields()
+            fields = [
+                field for field in self.tracked_fields
+                if field not in deferred_fields and (update_fields is None or field in update_fields)
+            ]
+            user_obj = self.get_snapshot() if fields else None
+
+            super().save(*args, update_fields=self.get_update_fields(
+                update_fields, (*self.tracked_fields, 'time_usage_ratio', 'study_time_histogram')
+            ), **kwargs)
+            if user_obj is not None:
+                apply_deltas(User, self.pk, {field: getattr(self, field) - user_obj[field] for field in fields})
+
+        self.take_snapshot()
+
+        # Invalidate the cached fragments of the user
+        bump_data_version(self.id)
+
+
+class Day(TrackedFieldsMixin, models.Model):
     """
     All duration fields are in seconds.
 
@@ -121,11 +656,30 @@ class Day(models.Model):
 
     comment = models.TextField(max_length=100, null=True, blank=True, help_text="100 characters max")
 
+    # Time of the last change, including the aggregates (see the changes feed of the API)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # (numerator, denominator) of time_usage_ratio, used when the ratio is recomputed in SQL
+    ratio_fields = ('study_time', 'usable_time')
+
+    tracked_fields = ('worktime', 'study_time', 'session_count', 'usable_time', 'stage_id')
+
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['user', 'day'], name='user_day_uniqueness'),
             models.CheckConstraint(check=Q(time_usage_ratio__range=(0, 1)), name='day_time_usage_ratio_range')
         ]
+        # Note: the (user, day) unique constraint above also serves as an index,
+        # for lists sorted by date and for the API's date filter.
+        # The day list, also filtered by stage, is sorted by -id with the indexes of the user and stage foreign keys:
+        # InnoDB appends the primary key to secondary indexes, so that they are (user_id, id) and (stage_id, id)
+        indexes = [
+            # Changes feed of the API
+            models.Index(fields=['user', 'updated_at'], name='day_user_updated_at_idx'),
+            # Day API filtered or sorted by start time or study time
+            models.Index(fields=['user', 'start'], name='day_user_start_idx'),
+            models.Index(fields=['user', 'study_time'], name='day_user_study_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.day}" + f" {self.DAY_OF_WEEK_CHOICES[self.day_of_week - 1][-1]}" \
@@ -133,22 +687,84 @@ class Day(models.Model):
 
     def save(self, *args, **kwargs):
         # Get previous field values
-        day_obj = None
-        try:
-            day_obj = Day.objects.select_related('stage').get(id=self.id)
-            prev_work_time = day_obj.worktime
-            prev_study_time = day_obj.study_time
-            prev_session_count = day_obj.session_count
-            prev_usable_time = day_obj.usable_time
-            prev_stage = day_obj.stage
-        except ObjectDoesNotExist:
+        day_obj = self.get_snapshot()
+        if day_obj is not None:
+            prev_work_time = day_obj['worktime']
+            prev_study_time = day_obj['study_time']
+            prev_session_count = day_obj['session_count']
+            prev_usable_time = day_obj['usable_time']
+            prev_stage_id = day_obj['stage_id']
+        else:
             prev_work_time = 0
             prev_study_time = 0
             prev_session_count = 0
             prev_usable_time = 0
-            prev_stage = None
+            prev_stage_id = None
 
         # Update day
+        self.compute_fields()
+
+        deltas = {
+            'total_work_time': self.worktime - prev_work_time,
+            'total_usable_time': self.usable_time - prev_usable_time,
+            'total_study_time': self.study_time - prev_study_time,
+            'session_count': self.session_count - prev_session_count,
+            # Increase day count only if the day is being created
+            'day_count': 1 if day_obj is None else 0,
+        }
+
+        # Update user first, see apply_user_deltas (moving a day from one stage to another does not change the
+        # user's totals)
+        apply_deltas(User, self.user_id, deltas, cached_related(self, 'user'))
+
+        if day_obj is None:
+            super().save(*args, **kwargs)
+        else:
+            # The aggregates are only written as deltas, and the ratio is computed from the study time in the
+            # database, so that the increments made since the day was loaded (e.g. by a new session) are not
+            # overwritten with the values in memory
+            time_usage_ratio = self.time_usage_ratio
+            self.time_usage_ratio = Coalesce(
+                F('study_time') * 1.0 / NullIf(Value(self.usable_time), 0), 0, output_field=FloatField()
+            )
+            try:
+                super().save(*args, update_fields=self.get_update_fields(
+                    kwargs.pop('update_fields', None), ('study_time', 'session_count')
+                ), **kwargs)
+            finally:
+                self.time_usage_ratio = time_usage_ratio
+            apply_deltas(Day, self.pk, {
+                'study_time': self.study_time - prev_study_time,
+                'session_count': self.session_count - prev_session_count,
+            })
+
+        # Update stage
+        if self.stage_id == prev_stage_id or prev_stage_id is None:
+            apply_deltas(Stage, self.stage_id, deltas, cached_related(self, 'stage'))
+        else:
+            apply_deltas(Stage, prev_stage_id, {
+                'total_work_time': -prev_work_time,
+                'total_usable_time': -prev_usable_time,
+                'total_study_time': -prev_study_time,
+                'session_count': -prev_session_count,
+                'day_count': -1,
+            })
+            apply_deltas(Stage, self.stage_id, {
+                'total_work_time': self.worktime,
+                'total_usable_time': self.usable_time,
+                'total_study_time': self.study_time,
+                'session_count': self.session_count,
+                'day_count': 1,
+            }, cached_related(self, 'stage'))
+
+        self.take_snapshot()
+
+        # Invalidate the cached fragments of the user
+        bump_data_version(self.user_id)
+
+    def compute_fields(self) -> None:
+        """Computes day_of_week, usable_time and time_usage_ratio from the other fields. """
+
         self.day_of_week = self.day.isoweekday()
 
         if self.start is not None and self.end is not None and self.end_next_day is not None:
@@ -161,52 +777,174 @@ class Day(models.Model):
         except ZeroDivisionError:
             self.time_usage_ratio = 0
 
-        super().save(*args, **kwargs)
-
-        # Update stage
-        if self.stage == prev_stage or prev_stage is None:
-            self.stage.total_work_time += self.worktime - prev_work_time
-            self.stage.total_usable_time += self.usable_time - prev_usable_time
-            self.stage.total_study_time += self.study_time - prev_study_time
-            self.stage.session_count += self.session_count - prev_session_count
-
-            # Increase day count only if the day is being created
-            if day_obj is None:
-                self.stage.day_count += 1
-        else:
-            prev_stage.total_usable_time -= prev_usable_time
-            prev_stage.total_work_time -= prev_work_time
-            prev_stage.total_study_time -= prev_study_time
-            prev_stage.day_count -= 1
-            prev_stage.session_count -= prev_session_count
-            prev_stage.save()
-
-            self.stage.total_work_time += self.worktime
-            self.stage.total_usable_time += self.usable_time
-            self.stage.total_study_time += self.study_time
-            self.stage.session_count += self.session_count
-            self.stage.day_count += 1
-
-        self.stage.save()
+    @classmethod
+    def create_in_bulk(cls, days: List['Day']) -> List['Day']:
+        """
+        Creates new days with a constant number of queries whatever their number, instead of saving them one by one:
+        the days are inserted at once, and their users and stages are updated by one UPDATE query per model.
+        """
+
+        for day in days:
+            day.compute_fields()
+
+        stage_deltas = {}
+        user_deltas = {}
+        for day in days:
+            deltas = {
+                'total_work_time': day.worktime,
+                'total_usable_time': day.usable_time,
+                'total_study_time': day.study_time,
+                'session_count': day.session_count,
+                'day_count': 1,
+            }
+            stage_deltas.setdefault(day.stage_id, Counter()).update(deltas)
+            user_deltas.setdefault(day.user_id, Counter()).update(deltas)
+
+        # Update users first, see apply_user_deltas
+        update_with_grouped_deltas(User, user_deltas)
+        bulk_insert(cls, days, ('user_id', 'day'))
+        update_with_grouped_deltas(Stage, stage_deltas)
+
+        for user_id in user_deltas:
+            bump_data_version(user_id)
+
+        return days
+
+    @classmethod
+    def update_in_bulk(cls, days: List['Day']) -> List['Day']:
+        """
+        Saves the changes of existing days (loaded from the database, see TrackedFieldsMixin) with a constant number of
+        queries whatever their number, instead of saving them one by one: the days are written by one UPDATE query,
+        and their users and their previous and new stages are updated by one UPDATE query per model.
+        """
+
+        stage_deltas = {}
+        user_deltas = {}
+        for day in days:
+            day_obj = day.get_snapshot()
+            day.compute_fields()
+
+            # The previous contribution of the day is replaced by the new one, possibly in another stage
+            prev_deltas = {
+                'total_work_time': -day_obj['worktime'],
+                'total_usable_time': -day_obj['usable_time'],
+                'total_study_time': -day_obj['study_time'],
+                'session_count': -day_obj['session_count'],
+                'day_count': -1,
+            }
+            deltas = {
+                'total_work_time': day.worktime,
+                'total_usable_time': day.usable_time,
+                'total_study_time': day.study_time,
+                'session_count': day.session_count,
+                'day_count': 1,
+            }
+            stage_deltas.setdefault(day_obj['stage_id'], Counter()).update(prev_deltas)
+            stage_deltas.setdefault(day.stage_id, Counter()).update(deltas)
+            user_deltas.setdefault(day.user_id, Counter()).update(prev_deltas)
+            user_deltas[day.user_id].update(deltas)
+
+        # Update users first, see apply_user_deltas
+        update_with_grouped_deltas(User, user_deltas)
+
+        # bulk_update does not set auto_now fields
+        now = timezone.now()
+        for day in days:
+            day.updated_at = now
+        cls.objects.bulk_update(days, [
+            'stage', 'day', 'day_of_week', 'worktime', 'start', 'end', 'end_next_day', 'usable_time',
+            'time_usage_ratio', 'comment', 'updated_at',
+        ])
+        update_with_grouped_deltas(Stage, stage_deltas)
+
+        for day in days:
+            day.take_snapshot()
+        for user_id in user_deltas:
+            bump_data_version(user_id)
+
+        return days
+
+    @classmethod
+    def delete_in_bulk(cls, days: QuerySet) -> int:
+        """
+        Deletes days and their sessions with a constant number of queries whatever their number, instead of deleting
+        them one by one: their users, then the days are locked by one SELECT ... FOR UPDATE each (see
+        apply_user_deltas), then their sessions are subtracted from their subjects and deleted, and their users and
+        stages are updated by one UPDATE query per model.
+
+        Returns the number of days deleted.
+        """
+
+        lock_users(days)
+        rows = list(days.order_by().select_for_update().values_list(
+            'pk', 'user_id', 'stage_id', 'worktime', 'usable_time', 'study_time', 'session_count'
+        ))
+        if not rows:
+            return 0
+
+        stage_deltas = {}
+        user_deltas = {}
+        for pk, user_id, stage_id, worktime, usable_time, study_time, session_count in rows:
+            deltas = {
+                'total_work_time': -worktime,
+                'total_usable_time': -usable_time,
+                'total_study_time': -study_time,
+                'session_count': -session_count,
+                'day_count': -1,
+            }
+            stage_deltas.setdefault(stage_id, Counter()).update(deltas)
+            user_deltas.setdefault(user_id, Counter()).update(deltas)
+
+        # Delete all sessions associated, with a constant number of queries
+        day_ids = [row[0] for row in rows]
+        sessions = Session.objects.filter(day__in=day_ids)
+        histogram_changes = {
+            user_id: removed_sessions_histogram_diff(sessions.filter(user=user_id)) for user_id in user_deltas
+        }
+        for user_id, deltas in user_deltas.items():
+            apply_user_deltas(user_id, deltas, histogram_changes[user_id])
+            bump_data_version(user_id)
+
+        subtract_sessions(Subject, sessions, 'subject', 'total_study_time')
+        create_tombstones(sessions)
+        sessions.delete()
+
+        update_with_grouped_deltas(Stage, stage_deltas)
+
+        # The sessions being already deleted, the days can be removed by a single DELETE ... WHERE
+        days = cls.objects.filter(pk__in=day_ids)
+        create_tombstones(days)
+        days._raw_delete(days.db)
+
+        return len(rows)
 
     def delete(self, *args, **kwargs):
-        # Delete all sessions associated
-        for session in Session.objects.filter(day=self.id):
-            session.delete(delete_day=True)
-
-        # Update stage only when the day (not stage) is being deleted
-        if not kwargs.pop('delete_stage', False):
-            self.stage.total_usable_time -= self.usable_time
-            self.stage.total_work_time -= self.worktime
-            self.stage.total_study_time -= self.study_time
-            self.stage.day_count -= 1
-            self.stage.session_count -= self.session_count
-            self.stage.save()
-
-        super().delete(*args, **kwargs)
-
-
-class Session(models.Model):
+        sessions = Session.objects.filter(day=self.id)
+
+        # Update user first (see apply_user_deltas), then stage
+        deltas = {
+            'total_work_time': -self.worktime,
+            'total_usable_time': -self.usable_time,
+            'total_study_time': -self.study_time,
+            'session_count': -self.session_count,
+            'day_count': -1,
+        }
+        apply_user_deltas(
+            self.user_id, deltas, removed_sessions_histogram_diff(sessions), cached_related(self, 'user')
+        )
+        apply_deltas(Stage, self.stage_id, deltas, cached_related(self, 'stage'))
+
+        # Delete all sessions associated, with a constant number of queries
+        subtract_sessions(Subject, sessions, 'subject', 'total_study_time')
+        create_tombstones(sessions)
+        sessions.delete()
+
+        Tombstone.objects.create(user_id=self.user_id, model='day', object_id=self.id)
+        bump_data_version(self.user_id)
+        return super().delete(*args, **kwargs)
+
+
+class Session(TrackedFieldsMixin, models.Model):
     """
     Default start time is set in the form, otherwise the day model will always appear in migration,
     as its default field value always changes.
@@ -217,7 +955,8 @@ class Session(models.Model):
     """
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    day = models.ForeignKey('Day', on_delete=models.CASCADE)
+    # Indexed by session_day_subject_idx, whose leading column is day_id
+    day = models.ForeignKey('Day', on_delete=models.CASCADE, db_index=False)
     subject = models.ForeignKey('Subject', on_delete=models.CASCADE)
 
     start = models.TimeField()
@@ -225,6 +964,24 @@ class Session(models.Model):
     end_next_day = models.BooleanField(default=False, null=True, blank=True, help_text="May be completed later")
     duration = models.PositiveIntegerField(default=0)
 
+    # Time of the last change (see the changes feed of the API)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    tracked_fields = ('duration', 'day_id', 'subject_id', 'start', 'end', 'end_next_day')
+
+    class Meta:
+        # The session list, also filtered by subject, is sorted by -id with the indexes of the user and subject foreign
+        # keys, which are (user_id, id) and (subject_id, id) in InnoDB
+        indexes = [
+            # Day detail, session list and API filtered by day (and subject)
+            models.Index(fields=['day', 'subject'], name='session_day_subject_idx'),
+            # Changes feed of the API
+            models.Index(fields=['user', 'updated_at'], name='session_user_updated_at_idx'),
+            # Session API filtered or sorted by start time or duration
+            models.Index(fields=['user', 'start'], name='session_user_start_idx'),
+            models.Index(fields=['user', 'duration'], name='session_user_duration_idx'),
+        ]
+
     def __str__(self):
         return f"{self.day}, subject {self.subject}, " \
                f"from {self.start.strftime('%H:%M') if self.start else ''} " \
@@ -232,79 +989,235 @@ class Session(models.Model):
 
     def save(self, *args, **kwargs):
         # Get previous field values
-        session_obj = None
-        try:
-            session_obj = Session.objects.select_related('subject').get(id=self.id)
-            prev_duration = session_obj.duration
-            prev_day = session_obj.day
-            prev_subject = session_obj.subject
-        except ObjectDoesNotExist:
+        session_obj = self.get_snapshot()
+        if session_obj is not None:
+            prev_duration = session_obj['duration']
+            prev_day_id = session_obj['day_id']
+            prev_subject_id = session_obj['subject_id']
+        else:
             prev_duration = 0
-            prev_day = None
-            prev_subject = None
+            prev_day_id = None
+            prev_subject_id = None
 
         # Update session
-        if self.start is not None and self.end is not None and self.end_next_day is not None:
-            self.duration = time_diff_in_seconds(self.start, self.end, self.end_next_day)
-        else:
-            self.duration = 0
-
-        # Update day
-        if self.day == prev_day or prev_day is None:
-            self.day.study_time += self.duration - prev_duration
+        self.compute_fields()
 
+        # Update user, day(s), stage(s) and subject(s)
+        if self.day_id == prev_day_id or prev_day_id is None:
             # Increase session count only if the session is being created
-            if session_obj is None:
-                self.day.session_count += 1
+            day_deltas = {
+                self.day: {'study_time': self.duration - prev_duration, 'session_count': 1 if session_obj is None else 0}
+            }
         else:
-            prev_day.study_time -= prev_duration
-            prev_day.session_count -= 1
-            prev_day.save()
-
-            self.day.study_time += self.duration
-            self.day.session_count += 1
-
-        self.day.save()
-
-        # Update subject
-        # Note: model comparison is just pk comparison under the hood
-        if self.subject == prev_subject or prev_subject is None:
-            self.subject.total_study_time += self.duration - prev_duration
-
-            # Increase session count only if the session is being created
-            if session_obj is None:
-                self.subject.session_count += 1
+            # Only the stage of the previous day is needed
+            prev_day = Day.objects.only('stage').get(id=prev_day_id)
+            day_deltas = {
+                prev_day: {'study_time': -prev_duration, 'session_count': -1},
+                self.day: {'study_time': self.duration, 'session_count': 1},
+            }
+
+        # Replace the previous contribution of the session to the user's study time histogram by the new one
+        histogram_changes = histogram_diff([(self.start, self.end, self.end_next_day, 1)])
+        if session_obj is not None:
+            histogram_changes.update(histogram_diff(
+                [(session_obj['start'], session_obj['end'], session_obj['end_next_day'], -1)]
+            ))
+
+        if self.subject_id == prev_subject_id or prev_subject_id is None:
+            subject_deltas = {self.subject_id: {
+                'total_study_time': self.duration - prev_duration,
+                'session_count': 1 if session_obj is None else 0,
+            }}
 
         # If user points existing session to another subject
         else:
-            prev_subject.total_study_time -= prev_duration
-            prev_subject.session_count -= 1
-            prev_subject.save(save_session=True)
-
-            self.subject.total_study_time += self.duration
-            self.subject.session_count += 1
+            subject_deltas = {
+                prev_subject_id: {'total_study_time': -prev_duration, 'session_count': -1},
+                self.subject_id: {'total_study_time': self.duration, 'session_count': 1},
+            }
 
-        self.subject.save(save_session=True)
+        propagate_day_deltas(
+            day_deltas, self.user_id, cached_related(self, 'user'), histogram_changes,
+            subject_deltas, cached_related(self, 'subject'),
+        )
 
         super().save(*args, **kwargs)
+        self.take_snapshot()
 
-    def delete(self, *args, **kwargs):
-        # Update day only when the session (not day) is being deleted
-        if not kwargs.pop('delete_day', False):
-            self.day.session_count -= 1
-            self.day.study_time -= self.duration
-            self.day.save()
+        # Invalidate the cached fragments of the user
+        bump_data_version(self.user_id)
+
+    def compute_fields(self) -> None:
+        """Computes duration from the other fields. """
 
-        # Update subject only when the session (not subject) is being deleted
-        if not kwargs.pop('delete_subject', False):
-            self.subject.session_count -= 1
-            self.subject.total_study_time -= self.duration
-            self.subject.save()
+        if self.start is not None and self.end is not None and self.end_next_day is not None:
+            self.duration = time_diff_in_seconds(self.start, self.end, self.end_next_day)
+        else:
+            self.duration = 0
 
-        super().delete(*args, **kwargs)
+    @classmethod
+    def create_in_bulk(cls, sessions: List['Session']) -> List['Session']:
+        """
+        Creates new sessions with a constant number of queries whatever their number, instead of saving them one by
+        one: the sessions are inserted at once, and their users, days, stages and subjects are updated by one UPDATE
+        query per model (plus a SELECT ... FOR UPDATE per user for the study time histogram).
+        """
+
+        for session in sessions:
+            session.compute_fields()
+
+        # Stages of the days, which are usually already fetched (e.g. by the validation of the API)
+        day_stages = {day.pk: day.stage_id for day in (cached_related(session, 'day') for session in sessions) if day}
+        missing_day_ids = {session.day_id for session in sessions} - day_stages.keys()
+        if missing_day_ids:
+            day_stages.update(Day.objects.filter(pk__in=missing_day_ids).values_list('pk', 'stage_id'))
+
+        day_deltas = {}
+        stage_deltas = {}
+        subject_deltas = {}
+        user_deltas = {}
+        user_sessions = {}
+        for session in sessions:
+            day_deltas.setdefault(session.day_id, Counter()).update(
+                study_time=session.duration, session_count=1
+            )
+            stage_deltas.setdefault(day_stages[session.day_id], Counter()).update(
+                total_study_time=session.duration, session_count=1
+            )
+            subject_deltas.setdefault(session.subject_id, Counter()).update(
+                total_study_time=session.duration, session_count=1
+            )
+            user_deltas.setdefault(session.user_id, Counter()).update(
+                total_study_time=session.duration, session_count=1
+            )
+            user_sessions.setdefault(session.user_id, []).append(
+                (session.start, session.end, session.end_next_day, 1)
+            )
+
+        # Update users first, see apply_user_deltas
+        for user_id, deltas in user_deltas.items():
+            apply_user_deltas(user_id, deltas, histogram_diff(user_sessions[user_id]))
+            bump_data_version(user_id)
+
+        bulk_insert(cls, sessions)
+        update_with_grouped_deltas(Day, day_deltas)
+        update_with_grouped_deltas(Stage, stage_deltas)
+        update_with_grouped_deltas(Subject, subject_deltas)
+
+        return sessions
+
+    @classmethod
+    def update_in_bulk(cls, sessions: List['Session']) -> List['Session']:
+        """
+        Saves the changes of existing sessions (loaded from the database, see TrackedFieldsMixin) with a constant number
+        of queries whatever their number, instead of saving them one by one: the sessions are written by one UPDATE
+        query, their users by one UPDATE query each (plus a SELECT ... FOR UPDATE for the study time histogram),
+        and their previous and new days, stages and subjects by one UPDATE query per model.
+        """
+
+        snapshots = [session.get_snapshot() for session in sessions]
+        for session in sessions:
+            session.compute_fields()
+
+        day_ids = {session.day_id for session in sessions} | {session_obj['day_id'] for session_obj in snapshots}
+        day_stages = dict(Day.objects.filter(pk__in=day_ids).values_list('pk', 'stage_id'))
+
+        day_deltas = {}
+        stage_deltas = {}
+        subject_deltas = {}
+        user_deltas = {}
+        user_sessions = {}
+        for session, session_obj in zip(sessions, snapshots):
+            # The previous contribution of the session is replaced by the new one, possibly to other parents
+            for weight, day_id, subject_id, duration, start, end, end_next_day in (
+                (-1, session_obj['day_id'], session_obj['subject_id'], session_obj['duration'],
+                 session_obj['start'], session_obj['end'], session_obj['end_next_day']),
+                (1, session.day_id, session.subject_id, session.duration,
+                 session.start, session.end, session.end_next_day),
+            ):
+                day_deltas.setdefault(day_id, Counter()).update(
+                    study_time=weight * duration, session_count=weight
+                )
+                stage_deltas.setdefault(day_stages[day_id], Counter()).update(
+                    total_study_time=weight * duration, session_count=weight
+                )
+                subject_deltas.setdefault(subject_id, Counter()).update(
+                    total_study_time=weight * duration, session_count=weight
+                )
+                user_deltas.setdefault(session.user_id, Counter()).update(total_study_time=weight * duration)
+                user_sessions.setdefault(session.user_id, []).append((start, end, end_next_day, weight))
+
+        # Update users first, see apply_user_deltas
+        for user_id, deltas in user_deltas.items():
+            apply_user_deltas(user_id, deltas, histogram_diff(user_sessions[user_id]))
+            bump_data_version(user_id)
+
+        # bulk_update does not set auto_now fields
+        now = timezone.now()
+        for session in sessions:
+            session.updated_at = now
+        cls.objects.bulk_update(sessions, ['day', 'subject', 'start', 'end', 'end_next_day', 'duration', 'updated_at'])
+        update_with_grouped_deltas(Day, day_deltas)
+        update_with_grouped_deltas(Stage, stage_deltas)
+        update_with_grouped_deltas(Subject, subject_deltas)
 
+        for session in sessions:
+            session.take_snapshot()
+
+        return sessions
+
+    @classmethod
+    def delete_in_bulk(cls, sessions: QuerySet) -> int:
+        """
+        Deletes sessions with a constant number of queries whatever their number, instead of deleting them one by one:
+        their users, then the sessions are locked by one SELECT ... FOR UPDATE each (see apply_user_deltas), then the
+        sessions are subtracted from their users by one UPDATE query each, and from their days, stages and subjects by
+        one UPDATE query per model.
+
+        Returns the number of sessions deleted.
+        """
+
+        lock_users(sessions)
+        session_ids = list(sessions.order_by().select_for_update().values_list('pk', flat=True))
+        if not session_ids:
+            return 0
+
+        sessions = cls.objects.filter(pk__in=session_ids)
+        user_totals = sessions.order_by().values_list('user').annotate(
+            study_time=Coalesce(Sum('duration'), 0), session_count=Count('id')
+        )
+        for user_id, study_time, session_count in user_totals:
+            apply_user_deltas(user_id, {
+                'total_study_time': -study_time,
+                'session_count': -session_count,
+            }, removed_sessions_histogram_diff(sessions.filter(user=user_id)))
+            bump_data_version(user_id)
+
+        subtract_sessions(Day, sessions, 'day', 'study_time')
+        subtract_sessions(Stage, sessions, 'day__stage', 'total_study_time')
+        subtract_sessions(Subject, sessions, 'subject', 'total_study_time')
+        create_tombstones(sessions)
+        sessions.delete()
+
+        return len(session_ids)
 
-class Stage(models.Model):
+    def delete(self, *args, **kwargs):
+        # Update user, day, stage and subject
+        propagate_day_deltas(
+            {self.day: {'study_time': -self.duration, 'session_count': -1}},
+            self.user_id,
+            cached_related(self, 'user'),
+            histogram_diff([(self.start, self.end, self.end_next_day, -1)]),
+            {self.subject_id: {'total_study_time': -self.duration, 'session_count': -1}},
+            cached_related(self, 'subject'),
+        )
+
+        Tombstone.objects.create(user_id=self.user_id, model='session', object_id=self.id)
+        bump_data_version(self.user_id)
+        return super().delete(*args, **kwargs)
+
+
+class Stage(TrackedFieldsMixin, models.Model):
     """
     day_count, session_count, time_usage_ratio & all duration fields of the stage model are automatically calculated.
 
@@ -332,65 +1245,142 @@ class Stage(models.Model):
         validators=[MinValueValidator(0), MaxValueValidator(1)]
     )
 
+    # Time of the last change, including the aggregates (see the changes feed of the API)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # (numerator, denominator) of time_usage_ratio, used when the ratio is recomputed in SQL
+    ratio_fields = ('total_study_time', 'total_usable_time')
+
+    tracked_fields = ('total_usable_time', 'total_study_time', 'total_work_time', 'day_count', 'session_count')
+
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['user', 'name'], name='user_stage_uniqueness'),
         ]
+        # The stage list is sorted by -id with the index of the user foreign key, which is (user_id, id) in InnoDB
+        indexes = [
+            # Changes feed of the API
+            models.Index(fields=['user', 'updated_at'], name='stage_user_updated_at_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name}"
 
     def save(self, *args, **kwargs):
         # Get previous field values
-        try:
-            stage_obj = Stage.objects.get(id=self.id)
-            prev_total_usable_time = stage_obj.total_usable_time
-            prev_total_study_time = stage_obj.total_study_time
-            prev_total_work_time = stage_obj.total_work_time
-            prev_day_count = stage_obj.day_count
-            prev_session_count = stage_obj.session_count
-        except ObjectDoesNotExist:
+        stage_obj = self.get_snapshot()
+        if stage_obj is not None:
+            prev_total_usable_time = stage_obj['total_usable_time']
+            prev_total_study_time = stage_obj['total_study_time']
+            prev_total_work_time = stage_obj['total_work_time']
+            prev_day_count = stage_obj['day_count']
+            prev_session_count = stage_obj['session_count']
+        else:
             prev_total_usable_time = 0
             prev_total_study_time = 0
             prev_total_work_time = 0
             prev_day_count = 0
             prev_session_count = 0
-            self.user.stage_count += 1
+
+        deltas = {
+            'total_usable_time': self.total_usable_time - prev_total_usable_time,
+            'total_study_time': self.total_study_time - prev_total_study_time,
+            'total_work_time': self.total_work_time - prev_total_work_time,
+            'day_count': self.day_count - prev_day_count,
+            'session_count': self.session_count - prev_session_count,
+        }
+
+        # Update user first, see apply_user_deltas
+        apply_deltas(User, self.user_id, {
+            **deltas,
+            # Increase stage count only if the stage is being created
+            'stage_count': 1 if stage_obj is None else 0,
+        }, cached_related(self, 'user'))
 
         # Update stage
-        try:
-            self.time_usage_ratio = self.total_study_time / self.total_usable_time
-        except ZeroDivisionError:
-            self.time_usage_ratio = 0
+        self.compute_fields()
 
-        super().save(*args, **kwargs)
+        if stage_obj is None:
+            super().save(*args, **kwargs)
+        else:
+            # The aggregates, and their ratio, are only written as deltas, so that the increments made since the
+            # stage was loaded (e.g. by a new day) are not overwritten with the values in memory
+            super().save(*args, update_fields=self.get_update_fields(
+                kwargs.pop('update_fields', None), (*self.tracked_fields, 'time_usage_ratio')
+            ), **kwargs)
+            apply_deltas(Stage, self.pk, deltas)
 
-        # Update user
-        self.user.total_usable_time += self.total_usable_time - prev_total_usable_time
-        self.user.total_study_time += self.total_study_time - prev_total_study_time
-        self.user.total_work_time += self.total_work_time - prev_total_work_time
-        self.user.day_count += self.day_count - prev_day_count
-        self.user.session_count += self.session_count - prev_session_count
-        self.user.save()
+        self.take_snapshot()
 
-    def delete(self, *args, **kwargs):
-        # Update user
-        self.user.stage_count -= 1
-        self.user.day_count -= self.day_count
-        self.user.session_count -= self.session_count
-        self.user.total_usable_time -= self.total_usable_time
-        self.user.total_study_time -= self.total_study_time
-        self.user.total_work_time -= self.total_work_time
-        self.user.save()
+        # Invalidate the cached fragments of the user
+        bump_data_version(self.user_id)
 
-        # Delete all days associated
-        for day in Day.objects.filter(stage=self.id):
-            day.delete(delete_stage=True)
+    def compute_fields(self) -> None:
+        """Computes time_usage_ratio from the other fields. """
 
-        super().delete(*args, **kwargs)
+        try:
+            self.time_usage_ratio = self.total_study_time / self.total_usable_time
+        except ZeroDivisionError:
+            self.time_usage_ratio = 0
 
+    @classmethod
+    def create_in_bulk(cls, stages: List['Stage']) -> List['Stage']:
+        """
+        Creates new stages with a constant number of queries whatever their number, instead of saving them one by one:
+        their users are updated by one UPDATE query (first, see apply_user_deltas), then the stages are inserted at once.
+        """
+
+        for stage in stages:
+            stage.compute_fields()
+
+        user_deltas = {}
+        for stage in stages:
+            user_deltas.setdefault(stage.user_id, Counter()).update(
+                total_usable_time=stage.total_usable_time,
+                total_study_time=stage.total_study_time,
+                total_work_time=stage.total_work_time,
+                day_count=stage.day_count,
+                session_count=stage.session_count,
+                stage_count=1,
+            )
+        update_with_grouped_deltas(User, user_deltas)
+        bulk_insert(cls, stages, ('user_id', 'name'))
+
+        for user_id in user_deltas:
+            bump_data_version(user_id)
+
+        return stages
 
-class Subject(models.Model):
+    def delete(self, *args, **kwargs):
+        sessions = Session.objects.filter(day__stage=self.id)
+
+        # Update user first, see apply_user_deltas
+        apply_user_deltas(self.user_id, {
+            'stage_count': -1,
+            'day_count': -self.day_count,
+            'session_count': -self.session_count,
+            'total_usable_time': -self.total_usable_time,
+            'total_study_time': -self.total_study_time,
+            'total_work_time': -self.total_work_time,
+        }, removed_sessions_histogram_diff(sessions), cached_related(self, 'user'))
+
+        # Delete all days and sessions associated, with a constant number of queries
+        subtract_sessions(Subject, sessions, 'subject', 'total_study_time')
+        create_tombstones(sessions)
+        sessions.delete()
+
+        # The sessions being already deleted, the days can be removed by a single DELETE ... WHERE,
+        # instead of letting the deletion collector fetch them and delete them in batches of 100.
+        days = Day.objects.filter(stage=self.id)
+        create_tombstones(days)
+        days._raw_delete(days.db)
+
+        Tombstone.objects.create(user_id=self.user_id, model='stage', object_id=self.id)
+        bump_data_version(self.user_id)
+        return super().delete(*args, **kwargs)
+
+
+class Subject(TrackedFieldsMixin, models.Model):
     """
     total_study_time is in seconds.
 
@@ -405,36 +1395,122 @@ class Subject(models.Model):
     total_study_time = models.PositiveBigIntegerField(default=0)
     session_count = models.PositiveIntegerField(default=0)
 
+    # Time of the last change, including the aggregates (see the changes feed of the API)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    tracked_fields = ('total_study_time', 'session_count')
+
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['user', 'name'], name='user_subject_uniqueness'),
         ]
+        # The subject list is sorted by -id with the index of the user foreign key, which is (user_id, id) in InnoDB
+        indexes = [
+            # Changes feed of the API
+            models.Index(fields=['user', 'updated_at'], name='subject_user_updated_at_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name}"
 
     def save(self, *args, **kwargs):
-        # Update user only if not saving session and is creating subject
-        if not kwargs.pop('save_session', False) and not Subject.objects.filter(id=self.id).exists():
-            self.user.subject_count += 1
-            self.user.save()
+        subject_obj = self.get_snapshot()
+        created = subject_obj is None
 
-        super().save(*args, **kwargs)
+        if created:
+            # Update user first (only if the subject is being created), see apply_user_deltas
+            apply_deltas(User, self.user_id, {'subject_count': 1}, cached_related(self, 'user'))
+            super().save(*args, **kwargs)
+        else:
+            # The aggregates are only written as deltas, so that the increments made since the subject was loaded
+            # (e.g. by a new session) are not overwritten with the values in memory
+            super().save(*args, update_fields=self.get_update_fields(
+                kwargs.pop('update_fields', None), self.tracked_fields
+            ), **kwargs)
+            apply_deltas(Subject, self.pk, {
+                field: getattr(self, field) - subject_obj[field] for field in self.tracked_fields
+            })
+        self.take_snapshot()
+
+        # Invalidate the cached fragments of the user
+        bump_data_version(self.user_id)
+
+    @classmethod
+    def create_in_bulk(cls, subjects: List['Subject']) -> List['Subject']:
+        """
+        Creates new subjects with a constant number of queries whatever their number, instead of saving them one by
+        one: their users are updated by one UPDATE query (first, see apply_user_deltas), then the subjects are inserted
+        at once.
+        """
+
+        user_deltas = {}
+        for subject in subjects:
+            user_deltas.setdefault(subject.user_id, Counter()).update(subject_count=1)
+        update_with_grouped_deltas(User, user_deltas)
+        bulk_insert(cls, subjects, ('user_id', 'name'))
+
+        for user_id in user_deltas:
+            bump_data_version(user_id)
+
+        return subjects
 
     def delete(self, *args, **kwargs):
-        # Update user
-        self.user.subject_count -= 1
-
-        # The deletion of a subject triggers the deletion of all sessions associated
+        # The deletion of a subject triggers the deletion of all sessions associated,
+        # which is done with a constant number of queries.
         sessions = Session.objects.filter(subject=self.id)
+        totals = sessions.aggregate(study_time=Coalesce(Sum('duration'), 0), session_count=Count('id'))
 
-        # The user model will be saved later if the stage model update is triggered (function level cascade).
-        # So if a subject contains no session and its deletion does not trigger an update of stage mode,
-        # then the user has to be saved here.
-        if not sessions:
-            self.user.save()
+        # Update user first, see apply_user_deltas
+        apply_user_deltas(self.user_id, {
+            'subject_count': -1,
+            'total_study_time': -totals['study_time'],
+            'session_count': -totals['session_count'],
+        }, removed_sessions_histogram_diff(sessions), cached_related(self, 'user'))
 
-        for session in sessions:
-            session.delete(delete_subject=True)
+        subtract_sessions(Day, sessions, 'day', 'study_time')
+        subtract_sessions(Stage, sessions, 'day__stage', 'total_study_time')
+        create_tombstones(sessions)
+        sessions.delete()
+
+        Tombstone.objects.create(user_id=self.user_id, model='subject', object_id=self.id)
+        bump_data_version(self.user_id)
+        return super().delete(*args, **kwargs)
+
+
+class Tombstone(models.Model):
+    """
+    Record of the deletion of a stage, day, session or subject, including the ones deleted in cascade,
+    so that the changes feed of the API can tell clients which objects to remove.
+    """
+
+    MODEL_CHOICES = [
+        ('stage', 'Stage'),
+        ('day', 'Day'),
+        ('session', 'Session'),
+        ('subject', 'Subject'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    model = models.CharField(max_length=10, choices=MODEL_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Changes feed of the API
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_at_idx'),
+            # Purge of the tombstones older than the retention
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id}"
+
+    @staticmethod
+    def get_cutoff() -> datetime:
+        """
+        Returns the time before which tombstones may have been purged (see the purge_tombstones command),
+        i.e. settings.API_CHANGES_RETENTION_DAYS days ago.
+        """
 
-        super().delete(*args, **kwargs)
+        return timezone.now() - timedelta(days=settings.API_CHANGES_RETENTION_DAYS)
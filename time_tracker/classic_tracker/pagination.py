@@ -0,0 +1,194 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from typing import Optional
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q, QuerySet
+from django.utils.functional import cached_property
+
+
+class CounterPaginator(Paginator):
+    """
+    Page number paginator whose total is read from a denormalized counter (e.g. User.day_count) when the list
+    matches one, instead of being counted with a SELECT COUNT(*). The total is counted if no counter is given.
+    """
+
+    def __init__(self, object_list, per_page, count: Optional[int] = None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.counter = count
+
+    @cached_property
+    def count(self) -> int:
+        if self.counter is not None:
+            return self.counter
+        return super().count
+
+    async def acount(self) -> int:
+        """Async version of count, counting with the async ORM if there is no counter. """
+        if self.counter is None:
+            self.counter = await self.object_list.acount()
+        return self.counter
+
+    async def apage(self, number):
+        """Async version of page(), which reads the page with the async ORM. """
+        await self.acount()
+        page = self.page(number)
+        page.object_list = [obj async for obj in page.object_list.aiterator()]
+        return page
+
+
+class InvalidCursor(Exception):
+    """Raised when a cursor cannot be decoded, or does not match the values of the sort column. """
+
+
+class KeysetPage:
+    """A page of a KeysetPaginator. Unlike Django's Page, it has no number and no total count. """
+
+    def __init__(self, object_list: list, next_cursor: Optional[str], previous_cursor: Optional[str]):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def has_other_pages(self) -> bool:
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Keyset (a.k.a. cursor) paginator: pages are sorted by (sort column, id), and a page is selected by a
+    WHERE (sort column, id) > (last value, last id) condition instead of an OFFSET, so that any page costs
+    the same as the first one, and no COUNT(*) is made.
+
+    The sort column is the first ordering of the queryset (e.g. '-day' or 'name_subject'), '-id' if unordered.
+    NULLs come first in ascending order and last in descending order, as in MySQL.
+
+    Cursors are opaque (base64 encoded) to clients. They embed the sort column, so that a cursor obtained with
+    another sorting restarts from the first page.
+    """
+
+    def __init__(self, queryset: QuerySet, per_page: int):
+        ordering = queryset.query.order_by[0] if queryset.query.order_by else '-id'
+        if not isinstance(ordering, str):
+            ordering = '-id'
+
+        self.ordering = ordering
+        self.field = ordering.lstrip('-')
+        self.descending = ordering.startswith('-')
+        self.per_page = per_page
+        if self.field in ('id', 'pk'):
+            self.field = 'id'
+        self.queryset = queryset.annotate(keyset_value=F(self.field))
+
+    def get_order_by(self, backwards: bool) -> list:
+        """Ordering of the rows, which is reversed to fetch the previous page. """
+
+        descending = self.descending != backwards
+        if self.field == 'id':
+            return [F('id').desc() if descending else F('id').asc()]
+        if descending:
+            return [F(self.field).desc(nulls_last=True), F('id').desc()]
+        return [F(self.field).asc(nulls_first=True), F('id').asc()]
+
+    def get_filter(self, value, pk: int, backwards: bool) -> Q:
+        """Condition selecting the rows after (value, pk), in the order given by get_order_by. """
+
+        descending = self.descending != backwards
+        after_pk = Q(id__lt=pk) if descending else Q(id__gt=pk)
+        if self.field == 'id':
+            return after_pk
+
+        is_null = Q(**{f'{self.field}__isnull': True})
+        if value is None:
+            return is_null & after_pk if descending else (is_null & after_pk) | ~is_null
+
+        after = Q(**{f'{self.field}__lt' if descending else f'{self.field}__gt': value}) \
+            | (Q(**{self.field: value}) & after_pk)
+        return after | is_null if descending else after
+
+    def encode_cursor(self, obj, backwards: bool) -> str:
+        position = {'f': self.ordering, 'v': obj.keyset_value, 'id': obj.id, 'b': backwards}
+        return urlsafe_b64encode(json.dumps(position, cls=DjangoJSONEncoder).encode()).decode()
+
+    def decode_cursor(self, cursor: str) -> Optional[dict]:
+        """Returns the position encoded in cursor, or None if it was obtained with another sorting. """
+
+        try:
+            position = json.loads(urlsafe_b64decode(cursor.encode()))
+            if not isinstance(position, dict) or not isinstance(position.get('id'), int):
+                raise InvalidCursor(cursor)
+        except (ValueError, BinasciiError):
+            raise InvalidCursor(cursor)
+
+        return position if position.get('f') == self.ordering else None
+
+    def get_page_queryset(self, cursor: Optional[str]) -> tuple:
+        """Returns the (lazy) queryset of the page of cursor, with one more row, the position and the direction. """
+
+        position = self.decode_cursor(cursor) if cursor else None
+        backwards = position is not None and bool(position.get('b'))
+
+        queryset = self.queryset.order_by(*self.get_order_by(backwards))
+        if position is not None:
+            # The value of a forged cursor may not fit the sort column, e.g. 'notadate' for a date
+            try:
+                value = position.get('v')
+                if value is not None:
+                    value = self.queryset.query.annotations['keyset_value'].output_field.to_python(value)
+                queryset = queryset.filter(self.get_filter(value, position['id'], backwards))
+            except (ValidationError, ValueError, TypeError):
+                raise InvalidCursor(cursor)
+
+        # One more row tells whether there is a page after this one
+        return queryset[:self.per_page + 1], position, backwards
+
+    def make_page(self, rows: list, position: Optional[dict], backwards: bool) -> KeysetPage:
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = position is not None, has_more
+
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1], backwards=False) if has_next and rows else None,
+            previous_cursor=self.encode_cursor(rows[0], backwards=True) if has_previous and rows else None,
+        )
+
+    def page(self, cursor: Optional[str] = None) -> KeysetPage:
+        """Returns the page after (or before, for a cursor to a previous page) the position of cursor. """
+
+        queryset, position, backwards = self.get_page_queryset(cursor)
+        try:
+            rows = list(queryset)
+        except (ValidationError, ValueError, TypeError):
+            raise InvalidCursor(cursor)
+
+        return self.make_page(rows, position, backwards)
+
+    async def apage(self, cursor: Optional[str] = None) -> KeysetPage:
+        """Async version of page(), which reads the rows with the async ORM. """
+
+        queryset, position, backwards = self.get_page_queryset(cursor)
+        try:
+            rows = [row async for row in queryset.aiterator()]
+        except (ValidationError, ValueError, TypeError):
+            raise InvalidCursor(cursor)
+
+        return self.make_page(rows, position, backwards)
@@ -1,8 +1,15 @@
+from datetime import date, time, timedelta
+from decimal import Decimal
+from io import StringIO
 from unittest.mock import patch
 
 from django.core.management import call_command
 from django.db import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from ..models import User, Stage, Day, Session, Subject, Tombstone, unpack_histogram
+from ..views import get_freq_list, cumsum_in_place
 
 
 # Decorator for mock test (i.e. mock the check function)
@@ -20,3 +27,131 @@ class TestCustomCommands(SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, n_op_error + 1)
         patched_check.assert_called_with(databases=['default'])
+
+
+class TestRecomputeAggregates(TestCase):
+    """Test the recompute_aggregates manage.py command. """
+
+    def setUp(self):
+        self.user = User.objects.create(username='fx', email='123@gmail.com')
+        self.stage = Stage.objects.create(user=self.user, name='Stage')
+        self.subject = Subject.objects.create(user=self.user, name='Subject')
+        self.day = Day.objects.create(
+            user=self.user,
+            stage=self.stage,
+            day=date(2022, 5, 6),
+            worktime=3600,
+            start=time(8, 0),
+            end=time(20, 0),
+        )
+        for hour in (9, 11):
+            Session.objects.create(
+                user=self.user,
+                day=self.day,
+                subject=self.subject,
+                start=time(hour, 0),
+                end=time(hour + 1, 30),
+            )
+
+        # Another user, whose aggregates are also wrong but who is filtered out below
+        self.other_user = User.objects.create(username='other', email='456@gmail.com')
+
+        # Simulate drift
+        Day.objects.update(study_time=1, session_count=5, time_usage_ratio=Decimal('0.9'))
+        Subject.objects.update(total_study_time=0)
+        Stage.objects.update(day_count=3)
+        User.objects.update(total_study_time=42, subject_count=7, study_time_histogram=b'')
+
+    def test_check(self):
+        """Test that the --check option reports mismatches without fixing them. """
+
+        out = StringIO()
+        call_command('recompute_aggregates', check=True, stdout=out)
+
+        for line in ('Day: 1', 'Subject: 1', 'Stage: 1', 'User: 2', 'Histogram: 1'):
+            self.assertIn(line, out.getvalue())
+        self.assertEqual(Day.objects.get().study_time, 1, 'Aggregates should not be fixed in check mode')
+
+    def test_check_consistent_drift(self):
+        """Test that --check reports the stages and users whose aggregates match wrong days, not the sessions. """
+
+        Stage.objects.update(day_count=1, session_count=5, total_study_time=1, time_usage_ratio=0)
+        User.objects.filter(pk=self.user.pk).update(
+            subject_count=1, session_count=5, total_study_time=1, time_usage_ratio=0
+        )
+
+        out = StringIO()
+        call_command('recompute_aggregates', check=True, users=['fx'], stdout=out)
+        for line in ('Day: 1', 'Stage: 1', 'User: 1'):
+            self.assertIn(line, out.getvalue())
+
+    def test_recompute(self):
+        """Test that all aggregates are recomputed from the sessions and days. """
+
+        call_command('recompute_aggregates', users=['fx'], stdout=StringIO())
+
+        day = Day.objects.get()
+        self.assertEqual(day.study_time, 3 * 3600, 'Wrong study time of day')
+        self.assertEqual(day.session_count, 2, 'Wrong session count of day')
+        self.assertEqual(day.time_usage_ratio, Decimal('0.2727'), 'Wrong time usage ratio of day')
+
+        subject = Subject.objects.get()
+        self.assertEqual(subject.total_study_time, 3 * 3600, 'Wrong total study time of subject')
+        self.assertEqual(subject.session_count, 2, 'Wrong session count of subject')
+
+        stage = Stage.objects.get()
+        self.assertEqual(stage.day_count, 1, 'Wrong day count of stage')
+        self.assertEqual(stage.total_study_time, 3 * 3600, 'Wrong total study time of stage')
+        self.assertEqual(stage.total_usable_time, 11 * 3600, 'Wrong total usable time of stage')
+
+        user = User.objects.get(username='fx')
+        self.assertEqual(user.total_study_time, 3 * 3600, 'Wrong total study time of user')
+        self.assertEqual(user.total_work_time, 3600, 'Wrong total work time of user')
+        self.assertEqual(user.subject_count, 1, 'Wrong subject count of user')
+        self.assertEqual(user.session_count, 2, 'Wrong session count of user')
+        self.assertEqual(user.time_usage_ratio, Decimal('0.2727'), 'Wrong time usage ratio of user')
+
+        histogram = unpack_histogram(user.study_time_histogram)
+        cumsum_in_place(histogram)
+        self.assertEqual(histogram, get_freq_list(Session.objects.values_list('start', 'end', 'end_next_day')),
+                         'Wrong study time histogram of user')
+
+        # Filtered out user
+        self.assertEqual(User.objects.get(username='other').subject_count, 7, 'Users filter not applied')
+
+        # Second run finds nothing to fix
+        out = StringIO()
+        call_command('recompute_aggregates', check=True, users=['fx'], stdout=out)
+        self.assertIn('Day: 0', out.getvalue())
+        self.assertIn('User: 0', out.getvalue())
+        self.assertIn('Histogram: 0', out.getvalue())
+
+    def test_since(self):
+        """Test that the --since option only selects users with days on or after the given date. """
+
+        call_command('recompute_aggregates', since=date(2022, 5, 7), stdout=StringIO())
+        self.assertEqual(Day.objects.get().study_time, 1, 'Since filter not applied')
+
+        call_command('recompute_aggregates', since=date(2022, 5, 6), stdout=StringIO())
+        self.assertEqual(Day.objects.get().study_time, 3 * 3600, 'Aggregates not recomputed')
+
+
+@override_settings(API_CHANGES_RETENTION_DAYS=30)
+class TestPurgeTombstones(TestCase):
+    """Test the purge_tombstones manage.py command. """
+
+    def test_purge(self):
+        """Test that only the tombstones older than the retention are purged, by batches. """
+
+        user = User.objects.create(username='fx', email='123@gmail.com')
+        now = timezone.now()
+        for days in (40, 35, 31, 29, 1):
+            Tombstone.objects.create(user=user, model='day', object_id=days, deleted_at=now - timedelta(days=days))
+
+        out = StringIO()
+        call_command('purge_tombstones', batch_size=2, stdout=out)
+
+        self.assertEqual(
+            sorted(Tombstone.objects.values_list('object_id', flat=True)), [1, 29], 'Wrong remaining tombstones'
+        )
+        self.assertIn('3 tombstone(s) purged', out.getvalue(), 'Wrong number of purged tombstones')
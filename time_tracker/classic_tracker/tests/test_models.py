@@ -1,11 +1,14 @@
 from datetime import time, date, timedelta
 from decimal import Decimal, ROUND_HALF_EVEN
+from unittest.mock import patch
 
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
 from django.test import TestCase, SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 
-from ..models import time_diff_in_seconds, Stage, User, Subject, Day, Session
+from ..models import time_diff_in_seconds, Stage, User, Subject, Day, Session, Tombstone, unpack_histogram
+from ..views import get_freq_list, cumsum_in_place
 
 
 class TestTimeDiffInSeconds(SimpleTestCase):
@@ -1734,3 +1737,775 @@ class TestSession(TestCase):
             0,
             'Wrong session count of the associated subject'
         )
+
+
+class TestDeltaPropagation(TestCase):
+    """Test that aggregates are propagated to the upstream models as atomic deltas, i.e. never from stale objects. """
+
+    def setUp(self):
+        self.user = User.objects.create(username='fx', email='123@gmail.com')
+        self.stage = Stage.objects.create(name='Stage', user=self.user)
+        self.day = Day.objects.create(
+            user=self.user,
+            stage=self.stage,
+            day=date(2022, 5, 6),
+            start=time(8, 0),
+            end=time(20, 0),
+            end_next_day=False,
+        )
+        self.subject = Subject.objects.create(name='Subject', user=self.user)
+
+    def test_stale_upstream_objects(self):
+        """
+        Test that two sessions saved with stale copies of the same day and subject (e.g. by two concurrent requests)
+        are both accounted for in every upstream model.
+        """
+
+        # Two copies of the same rows, loaded before any session is created
+        day_1, day_2 = Day.objects.get(id=self.day.id), Day.objects.get(id=self.day.id)
+        subject_1, subject_2 = Subject.objects.get(id=self.subject.id), Subject.objects.get(id=self.subject.id)
+
+        Session.objects.create(user=self.user, day=day_1, subject=subject_1, start=time(9, 0), end=time(10, 0))
+        Session.objects.create(user=self.user, day=day_2, subject=subject_2, start=time(11, 0), end=time(13, 0))
+
+        day = Day.objects.get(id=self.day.id)
+        self.assertEqual(day.session_count, 2, 'Wrong session count of the associated day')
+        self.assertEqual(day.study_time, 3 * 3600, 'Wrong study time of the associated day')
+        self.assertEqual(day.time_usage_ratio, Decimal('0.2500'), 'Wrong time usage ratio of the associated day')
+
+        subject = Subject.objects.get(id=self.subject.id)
+        self.assertEqual(subject.session_count, 2, 'Wrong session count of the associated subject')
+        self.assertEqual(subject.total_study_time, 3 * 3600, 'Wrong total study time of the associated subject')
+
+        stage = Stage.objects.get(id=self.stage.id)
+        self.assertEqual(stage.session_count, 2, 'Wrong session count of the associated stage')
+        self.assertEqual(stage.total_study_time, 3 * 3600, 'Wrong total study time of the associated stage')
+        self.assertEqual(stage.time_usage_ratio, Decimal('0.2500'), 'Wrong time usage ratio of the associated stage')
+
+        user = User.objects.get(id=self.user.id)
+        self.assertEqual(user.session_count, 2, 'Wrong session count of the associated user')
+        self.assertEqual(user.total_study_time, 3 * 3600, 'Wrong total study time of the associated user')
+        self.assertEqual(user.time_usage_ratio, Decimal('0.2500'), 'Wrong time usage ratio of the associated user')
+
+    def test_session_save_query_count(self):
+        """
+        Test that saving a session takes a fixed number of queries: one per upstream model and one for the session,
+        i.e. the previous field values are not fetched from the database.
+        """
+
+        # Insert + one update per day, stage, user and subject + lock of the user's histogram
+        with self.assertNumQueries(6):
+            session = Session.objects.create(
+                user=self.user,
+                day=self.day,
+                subject=self.subject,
+                start=time(9, 0),
+                end=time(10, 0),
+            )
+
+        session = Session.objects.select_related('day').get(id=session.id)
+        session.end = time(11, 0)
+        with self.assertNumQueries(6):
+            session.save()
+
+        # Same duration, only the user's histogram to update
+        session.start, session.end = time(13, 0), time(15, 0)
+        with self.assertNumQueries(3):
+            session.save()
+
+        # Nothing changed, no upstream model to update
+        with self.assertNumQueries(1):
+            session.save()
+
+        self.assertEqual(Day.objects.get(id=self.day.id).study_time, 2 * 3600, 'Wrong study time of the day')
+        self.assertEqual(User.objects.get(id=self.user.id).total_study_time, 2 * 3600, 'Wrong total study time')
+
+    def test_save_stale_object(self):
+        """
+        Test that saving a day, stage or subject loaded before a session was created (e.g. by a concurrent request)
+        keeps the aggregates of the session.
+        """
+
+        day = Day.objects.get(id=self.day.id)
+        stage = Stage.objects.get(id=self.stage.id)
+        subject = Subject.objects.get(id=self.subject.id)
+        Session.objects.create(user=self.user, day=self.day, subject=self.subject, start=time(9, 0), end=time(12, 0))
+
+        day.comment = 'Comment'
+        day.worktime = 3600
+        day.save()
+        stage.name = 'New name'
+        stage.save()
+        subject.name = 'New name'
+        subject.save()
+
+        day = Day.objects.get(id=self.day.id)
+        self.assertEqual((day.session_count, day.study_time), (1, 3 * 3600), 'Wrong aggregates of the day')
+        self.assertEqual(day.usable_time, 11 * 3600, 'Wrong usable time of the day')
+        self.assertEqual(day.time_usage_ratio, Decimal('0.2727'), 'Wrong time usage ratio of the day')
+
+        stage = Stage.objects.get(id=self.stage.id)
+        self.assertEqual((stage.session_count, stage.total_study_time), (1, 3 * 3600), 'Wrong aggregates of the stage')
+        self.assertEqual(stage.time_usage_ratio, Decimal('0.2727'), 'Wrong time usage ratio of the stage')
+
+        subject = Subject.objects.get(id=self.subject.id)
+        self.assertEqual(
+            (subject.session_count, subject.total_study_time), (1, 3 * 3600), 'Wrong aggregates of the subject'
+        )
+
+    def test_save_stale_user(self):
+        """
+        Test that saving a user loaded before a session was created (e.g. by a concurrent request editing the profile
+        or changing the password) keeps the aggregates and the study time histogram of the session.
+        """
+
+        user = User.objects.get(id=self.user.id)
+        Session.objects.create(user=self.user, day=self.day, subject=self.subject, start=time(9, 0), end=time(12, 0))
+        histogram = User.objects.get(id=self.user.id).study_time_histogram
+
+        user.first_name = 'New name'
+        user.save()
+        user.set_password('New password')
+        user.save(update_fields=['password'])
+
+        user = User.objects.get(id=self.user.id)
+        self.assertEqual(user.first_name, 'New name', 'Wrong first name')
+        self.assertTrue(user.check_password('New password'), 'Wrong password')
+        self.assertEqual((user.session_count, user.total_study_time), (1, 3 * 3600), 'Wrong aggregates of the user')
+        self.assertEqual(user.time_usage_ratio, Decimal('0.2500'), 'Wrong time usage ratio of the user')
+        self.assertEqual(bytes(user.study_time_histogram), bytes(histogram), 'Wrong study time histogram')
+        self.assertTrue(any(unpack_histogram(user.study_time_histogram)), 'Wrong study time histogram')
+
+    def test_day_and_stage_save_query_count(self):
+        """Test that updating a loaded day or stage does not fetch its previous field values. """
+
+        day = Day.objects.get(id=self.day.id)
+        day.worktime = 3600
+        # Update of the day, its stage and its user
+        with self.assertNumQueries(3):
+            day.save()
+
+        stage = Stage.objects.get(id=self.stage.id)
+        stage.name = 'New name'
+        with self.assertNumQueries(1):
+            stage.save()
+
+        subject = Subject.objects.get(id=self.subject.id)
+        subject.name = 'New name'
+        with self.assertNumQueries(1):
+            subject.save()
+
+    def assert_histogram_matches_sessions(self):
+        """Asserts that the study time histogram of the user is equal to the one computed from the sessions. """
+
+        histogram = unpack_histogram(User.objects.get(id=self.user.id).study_time_histogram)
+        cumsum_in_place(histogram)
+        self.assertEqual(
+            histogram,
+            get_freq_list(Session.objects.values_list('start', 'end', 'end_next_day')),
+            'Wrong study time histogram of the user'
+        )
+
+    def test_study_time_histogram(self):
+        """Test that the study time histogram of the user is maintained on session creation, update and deletion. """
+
+        other_day = Day.objects.create(
+            user=self.user,
+            stage=self.stage,
+            day=date(2022, 5, 7),
+            start=time(8, 0),
+            end=time(20, 0),
+            end_next_day=False,
+        )
+        session = Session.objects.create(
+            user=self.user,
+            day=self.day,
+            subject=self.subject,
+            start=time(9, 10),
+            end=time(10, 50),
+        )
+        Session.objects.create(
+            user=self.user,
+            day=self.day,
+            subject=self.subject,
+            start=time(22, 0),
+            end=time(23, 55),
+            end_next_day=False,
+        )
+        self.assert_histogram_matches_sessions()
+
+        # Session ending the day after
+        session.start, session.end, session.end_next_day = time(23, 10), time(0, 50), True
+        session.save()
+        self.assert_histogram_matches_sessions()
+
+        # To-be-completed session
+        session.end = None
+        session.save()
+        self.assert_histogram_matches_sessions()
+
+        # Session moved to another day
+        session = Session.objects.get(id=session.id)
+        session.day, session.start, session.end, session.end_next_day = other_day, time(10, 0), time(12, 0), False
+        session.save()
+        self.assert_histogram_matches_sessions()
+
+        session.delete()
+        self.assert_histogram_matches_sessions()
+
+        Day.objects.get(id=self.day.id).delete()
+        self.assertEqual(
+            unpack_histogram(User.objects.get(id=self.user.id).study_time_histogram),
+            [0] * 96,
+            'Wrong study time histogram of the user'
+        )
+
+    def test_delete_subject_with_sessions(self):
+        """Test that the subject count of the user is decreased when a subject containing sessions is deleted. """
+
+        Session.objects.create(user=self.user, day=self.day, subject=self.subject, start=time(9, 0), end=time(10, 0))
+        Subject.objects.get(id=self.subject.id).delete()
+
+        user = User.objects.get(id=self.user.id)
+        self.assertEqual(user.subject_count, 0, 'Wrong subject count of the associated user')
+        self.assertEqual(user.session_count, 0, 'Wrong session count of the associated user')
+        self.assertEqual(user.total_study_time, 0, 'Wrong total study time of the associated user')
+        self.assertEqual(user.time_usage_ratio, 0, 'Wrong time usage ratio of the associated user')
+
+
+class AggregatesAssertionsMixin:
+    """Assertions comparing the aggregates of all models to the ones computed from the rows of the user. """
+
+    def assert_aggregates_match_sessions(self):
+        """Asserts that the aggregates of all models are equal to the ones computed from the remaining rows. """
+
+        user = User.objects.get(id=self.user.id)
+        self.assertEqual(user.session_count, Session.objects.count(), 'Wrong session count of user')
+        self.assertEqual(user.day_count, Day.objects.count(), 'Wrong day count of user')
+        self.assertEqual(
+            user.total_study_time,
+            sum(Session.objects.values_list('duration', flat=True)),
+            'Wrong total study time of user'
+        )
+        for subject in Subject.objects.all():
+            sessions = Session.objects.filter(subject=subject)
+            self.assertEqual(subject.session_count, sessions.count(), 'Wrong session count of subject')
+            self.assertEqual(
+                subject.total_study_time,
+                sum(sessions.values_list('duration', flat=True)),
+                'Wrong total study time of subject'
+            )
+        for day in Day.objects.all():
+            sessions = Session.objects.filter(day=day)
+            self.assertEqual(day.session_count, sessions.count(), 'Wrong session count of day')
+            self.assertEqual(day.study_time, sum(sessions.values_list('duration', flat=True)), 'Wrong study time')
+        for stage in Stage.objects.all():
+            sessions = Session.objects.filter(day__stage=stage)
+            self.assertEqual(stage.session_count, sessions.count(), 'Wrong session count of stage')
+            self.assertEqual(
+                stage.total_study_time,
+                sum(sessions.values_list('duration', flat=True)),
+                'Wrong total study time of stage'
+            )
+
+        histogram = unpack_histogram(user.study_time_histogram)
+        cumsum_in_place(histogram)
+        self.assertEqual(
+            histogram,
+            get_freq_list(Session.objects.values_list('start', 'end', 'end_next_day')),
+            'Wrong study time histogram of user'
+        )
+
+
+class TestSetBasedDelete(AggregatesAssertionsMixin, TestCase):
+    """
+    Test that deleting a stage, a day or a subject costs a constant number of queries,
+    and leaves the same aggregates as deleting its sessions one by one.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='fx', email='123@gmail.com')
+        self.subjects = [Subject.objects.create(name=f'Subject {i}', user=self.user) for i in range(2)]
+
+    def create_stage(self, name, n_days):
+        """Creates a stage containing n_days days, each containing one session per subject. """
+
+        stage = Stage.objects.create(name=name, user=self.user)
+        first_day = date(2022, 1, 1) if name == 'Small' else date(2023, 1, 1)
+        for i in range(n_days):
+            day = Day.objects.create(
+                user=self.user,
+                stage=stage,
+                day=first_day + timedelta(days=i),
+                worktime=3600,
+                start=time(8, 0),
+                end=time(20, 0),
+                end_next_day=False,
+            )
+            for j, subject in enumerate(self.subjects):
+                Session.objects.create(
+                    user=self.user,
+                    day=day,
+                    subject=subject,
+                    start=time(9 + j, 0),
+                    end=time(10 + j, 0 if j else 30),
+                )
+        return stage
+
+    def count_queries(self, obj):
+        """Deletes obj and returns the number of queries made. """
+
+        with CaptureQueriesContext(connection) as ctx:
+            obj.delete()
+        return len(ctx.captured_queries)
+
+    def test_delete_stage(self):
+        """Test the deletion of stages of different sizes. """
+
+        small_stage, large_stage = self.create_stage('Small', 1), self.create_stage('Large', 20)
+
+        self.assertEqual(
+            self.count_queries(Stage.objects.get(id=small_stage.id)),
+            self.count_queries(Stage.objects.get(id=large_stage.id)),
+            'The number of queries depends on the number of days'
+        )
+        self.assertFalse(Day.objects.exists(), 'Days not deleted')
+        self.assertFalse(Session.objects.exists(), 'Sessions not deleted')
+        self.assert_aggregates_match_sessions()
+
+    def test_delete_day(self):
+        """Test the deletion of days, making sure the aggregates of the remaining rows are still correct. """
+
+        stage = self.create_stage('Small', 3)
+        day_1, day_2 = Day.objects.filter(stage=stage)[:2]
+
+        self.assertEqual(
+            self.count_queries(day_1),
+            self.count_queries(day_2),
+            'The number of queries depends on the number of sessions'
+        )
+        self.assertEqual(Day.objects.count(), 1, 'Wrong number of days remaining')
+        self.assert_aggregates_match_sessions()
+
+    def test_delete_subject(self):
+        """Test the deletion of a subject, making sure the aggregates of the remaining rows are still correct. """
+
+        self.create_stage('Small', 2)
+        self.create_stage('Large', 20)
+        self.subjects[0].refresh_from_db()
+        self.subjects[0].delete()
+
+        self.assertEqual(Session.objects.count(), 22, 'Wrong number of sessions remaining')
+        self.assertEqual(User.objects.get(id=self.user.id).subject_count, 1, 'Wrong subject count of user')
+        self.assert_aggregates_match_sessions()
+
+
+class TestBulkCreate(AggregatesAssertionsMixin, TestCase):
+    """
+    Test that creating objects in bulk costs a constant number of queries,
+    and leaves the same aggregates as saving them one by one.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='fx', email='123@gmail.com')
+
+    def create_in_bulk(self, n_days):
+        """
+        Creates a stage and two subjects, then n_days days containing one session per subject,
+        each model in bulk. Returns the number of queries made.
+        """
+
+        with CaptureQueriesContext(connection) as ctx:
+            stage, = Stage.create_in_bulk([Stage(user=self.user, name=f'Stage {n_days}')])
+            subjects = Subject.create_in_bulk([
+                Subject(user=self.user, name=f'Subject {n_days}-{i}') for i in range(2)
+            ])
+            days = Day.create_in_bulk([
+                Day(
+                    user=self.user,
+                    stage=stage,
+                    day=date(2022, 1, 1) + timedelta(days=n_days + i),
+                    worktime=3600,
+                    start=time(8, 0),
+                    end=time(1, 0) if i % 2 else time(20, 0),
+                    end_next_day=bool(i % 2),
+                )
+                for i in range(n_days)
+            ])
+            Session.create_in_bulk([
+                Session(
+                    user=self.user,
+                    day=day,
+                    subject=subject,
+                    start=time(9 + j, 0),
+                    end=time(10 + j, 0 if j else 30),
+                )
+                for day in days for j, subject in enumerate(subjects)
+            ])
+        return len(ctx.captured_queries)
+
+    def test_create_in_bulk(self):
+        """Test the creation of batches of different sizes. """
+
+        self.assertEqual(
+            self.create_in_bulk(1), self.create_in_bulk(20), 'The number of queries depends on the number of objects'
+        )
+        self.assert_aggregates_match_sessions()
+
+        user = User.objects.get(id=self.user.id)
+        days = Day.objects.all()
+        self.assertEqual(user.stage_count, 2, 'Wrong stage count of user')
+        self.assertEqual(user.subject_count, 4, 'Wrong subject count of user')
+        self.assertEqual(user.total_work_time, 21 * 3600, 'Wrong total work time of user')
+        self.assertEqual(
+            user.total_usable_time, sum(day.usable_time for day in days), 'Wrong total usable time of user'
+        )
+        for stage in Stage.objects.all():
+            stage_days = days.filter(stage=stage)
+            self.assertEqual(stage.day_count, stage_days.count(), 'Wrong day count of stage')
+            self.assertEqual(
+                stage.total_usable_time,
+                sum(day.usable_time for day in stage_days),
+                'Wrong total usable time of stage'
+            )
+            self.assertAlmostEqual(
+                float(stage.time_usage_ratio),
+                stage.total_study_time / stage.total_usable_time,
+                places=4,
+                msg='Wrong time usage ratio of stage'
+            )
+        for day in days:
+            self.assertEqual(day.day_of_week, day.day.isoweekday(), 'Wrong day of week')
+            self.assertAlmostEqual(
+                float(day.time_usage_ratio), day.study_time / day.usable_time, places=4, msg='Wrong time usage ratio'
+            )
+
+    def assert_bulk_insert_ids(self):
+        """Creates objects of every model in bulk, and checks that they are given the ids of their rows. """
+
+        stages = Stage.create_in_bulk([Stage(user=self.user, name=f'Stage {i}') for i in range(3)])
+        subjects = Subject.create_in_bulk([Subject(user=self.user, name=f'Subject {i}') for i in range(3)])
+        days = Day.create_in_bulk([
+            Day(
+                user=self.user,
+                stage=stages[i % 3],
+                day=date(2022, 1, 1) + timedelta(days=i),
+                start=time(8, 0),
+                end=time(20, 0),
+            )
+            for i in range(10)
+        ])
+        sessions = Session.create_in_bulk([
+            Session(user=self.user, day=day, subject=subject, start=time(9 + j, 0), end=time(10 + j, 0))
+            for day in days for j, subject in enumerate(subjects)
+        ])
+
+        for objs, fields in (
+            (stages, ('name',)), (subjects, ('name',)), (days, ('day',)), (sessions, ('day_id', 'start'))
+        ):
+            model = type(objs[0])
+            self.assertEqual(
+                [(obj.id, *(getattr(obj, field) for field in fields)) for obj in objs],
+                list(model.objects.order_by('id').values_list('id', *fields)),
+                f'Wrong ids of the {model._meta.verbose_name_plural}'
+            )
+        self.assert_aggregates_match_sessions()
+
+    def test_bulk_insert_ids(self):
+        """Test that the objects created in bulk are given the ids of their rows. """
+
+        self.assert_bulk_insert_ids()
+
+    def test_bulk_insert_ids_without_returning(self):
+        """
+        Test that the objects created in bulk are given the ids of their rows when the database does not return them
+        (MySQL), nor allocates consecutive ids to the rows of a bulk insert: they are selected by their unique fields,
+        or the objects without unique fields are inserted one by one.
+        """
+
+        connection.innodb_autoinc_lock_mode = 2
+        try:
+            with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+                self.assert_bulk_insert_ids()
+        finally:
+            del connection.innodb_autoinc_lock_mode
+
+
+class TestBulkUpdateAndDelete(AggregatesAssertionsMixin, TestCase):
+    """
+    Test that updating or deleting days and sessions in bulk costs a constant number of queries,
+    and leaves the same aggregates as saving or deleting them one by one.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='fx', email='123@gmail.com')
+        self.stages = [Stage.objects.create(name=f'Stage {i}', user=self.user) for i in range(2)]
+        self.subjects = [Subject.objects.create(name=f'Subject {i}', user=self.user) for i in range(2)]
+        for i in range(20):
+            day = Day.objects.create(
+                user=self.user,
+                stage=self.stages[i % 2],
+                day=date(2022, 1, 1) + timedelta(days=i),
+                worktime=3600,
+                start=time(8, 0),
+                end=time(20, 0),
+            )
+            for j, subject in enumerate(self.subjects):
+                Session.objects.create(
+                    user=self.user, day=day, subject=subject, start=time(9 + j, 0), end=time(10 + j, 0 if j else 30)
+                )
+
+    def assert_aggregates_match_days(self):
+        """Asserts that the day level aggregates of the stages and of the user match the remaining days. """
+
+        user = User.objects.get(id=self.user.id)
+        days = Day.objects.all()
+        self.assertEqual(user.total_work_time, sum(day.worktime for day in days), 'Wrong total work time of user')
+        self.assertEqual(
+            user.total_usable_time, sum(day.usable_time for day in days), 'Wrong total usable time of user'
+        )
+        for stage in Stage.objects.all():
+            stage_days = days.filter(stage=stage)
+            self.assertEqual(stage.day_count, stage_days.count(), 'Wrong day count of stage')
+            self.assertEqual(
+                stage.total_work_time, sum(day.worktime for day in stage_days), 'Wrong total work time of stage'
+            )
+            self.assertEqual(
+                stage.total_usable_time,
+                sum(day.usable_time for day in stage_days),
+                'Wrong total usable time of stage'
+            )
+            self.assertAlmostEqual(
+                float(stage.time_usage_ratio),
+                stage.total_study_time / stage.total_usable_time if stage.total_usable_time else 0,
+                places=4,
+                msg='Wrong time usage ratio of stage'
+            )
+
+    def update_sessions(self, sessions) -> int:
+        """Moves sessions to the other subject and to the next day, and shortens them. Returns the number of queries. """
+
+        day_ids = list(Day.objects.order_by('id').values_list('id', flat=True))
+        for session in sessions:
+            session.subject = self.subjects[1 - self.subjects.index(session.subject)]
+            session.day_id = day_ids[(day_ids.index(session.day_id) + 1) % len(day_ids)]
+            session.end = time(session.end.hour, 15)
+        with CaptureQueriesContext(connection) as ctx:
+            Session.update_in_bulk(sessions)
+        return len(ctx.captured_queries)
+
+    def test_update_sessions(self):
+        """Test the update of batches of different sizes. """
+
+        sessions = list(Session.objects.select_related('subject').order_by('id'))
+        self.assertEqual(
+            self.update_sessions(sessions[:2]),
+            self.update_sessions(sessions[2:20]),
+            'The number of queries depends on the number of objects'
+        )
+        self.assert_aggregates_match_sessions()
+        self.assertEqual(Session.objects.get(id=sessions[0].id).duration, 75 * 60, 'Wrong duration')
+
+        # The snapshots are up to date, s.t. the sessions can be saved again
+        sessions[0].end = time(11, 0)
+        sessions[0].save()
+        self.assert_aggregates_match_sessions()
+
+    def test_delete_sessions(self):
+        """Test the deletion of batches of different sizes. """
+
+        ids = list(Session.objects.order_by('id').values_list('id', flat=True))
+        query_counts = []
+        for batch in (ids[:2], ids[2:20]):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(Session.delete_in_bulk(Session.objects.filter(id__in=batch)), len(batch))
+            query_counts.append(len(ctx.captured_queries))
+
+        self.assertEqual(query_counts[0], query_counts[1], 'The number of queries depends on the number of objects')
+        self.assertEqual(Session.objects.count(), 20, 'Wrong number of remaining sessions')
+        self.assert_aggregates_match_sessions()
+        self.assertEqual(Session.delete_in_bulk(Session.objects.none()), 0)
+
+    def update_days(self, days) -> int:
+        """Moves days to the other stage, and changes their times. Returns the number of queries. """
+
+        for day in days:
+            day.stage = self.stages[1 - self.stages.index(day.stage)]
+            day.worktime = 1800
+            day.end = time(1, 0)
+            day.end_next_day = True
+        with CaptureQueriesContext(connection) as ctx:
+            Day.update_in_bulk(days)
+        return len(ctx.captured_queries)
+
+    def test_update_days(self):
+        """Test the update of batches of different sizes. """
+
+        days = list(Day.objects.select_related('stage').order_by('id'))
+        self.assertEqual(
+            self.update_days(days[:2]),
+            self.update_days(days[2:12]),
+            'The number of queries depends on the number of objects'
+        )
+        self.assert_aggregates_match_sessions()
+        self.assert_aggregates_match_days()
+
+        day = Day.objects.get(id=days[0].id)
+        self.assertEqual(day.usable_time, 17 * 3600 - 1800, 'Wrong usable time')
+        self.assertEqual(day.stage, self.stages[1], 'Wrong stage')
+
+    def test_delete_days(self):
+        """Test the deletion of batches of different sizes. """
+
+        ids = list(Day.objects.order_by('id').values_list('id', flat=True))
+        query_counts = []
+        for batch in (ids[:2], ids[2:12]):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(Day.delete_in_bulk(Day.objects.filter(id__in=batch)), len(batch))
+            query_counts.append(len(ctx.captured_queries))
+
+        self.assertEqual(query_counts[0], query_counts[1], 'The number of queries depends on the number of objects')
+        self.assertEqual(Day.objects.count(), 8, 'Wrong number of remaining days')
+        self.assertEqual(Session.objects.count(), 16, 'Wrong number of remaining sessions')
+        self.assert_aggregates_match_sessions()
+        self.assert_aggregates_match_days()
+
+
+class TestLockOrder(TestCase):
+    """
+    Test that every write of aggregates updates the user row before any other row, s.t. the concurrent writes of a user
+    are serialized by the lock of the user row and cannot deadlock (see apply_user_deltas).
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='fx', email='123@gmail.com')
+        self.stage = Stage.objects.create(name='Stage', user=self.user)
+        self.subject = Subject.objects.create(name='Subject', user=self.user)
+        self.day = Day.objects.create(
+            user=self.user, stage=self.stage, day=date(2022, 1, 1), start=time(8, 0), end=time(20, 0)
+        )
+        self.session = Session.objects.create(
+            user=self.user, day=self.day, subject=self.subject, start=time(9, 0), end=time(10, 0)
+        )
+
+    def assert_user_written_first(self, write, msg):
+        """Asserts that the first write (INSERT, UPDATE or DELETE) made by write() is the update of the user. """
+
+        with CaptureQueriesContext(connection) as ctx:
+            write()
+        writes = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertRegex(writes[0], r'^UPDATE\W+classic_tracker_user\W', msg)
+
+    def test_saves(self):
+        """Test the creation and the update of each model. """
+
+        def update_day():
+            self.day.worktime = 3600
+            self.day.save()
+
+        def update_session():
+            self.session.end = time(11, 0)
+            self.session.save()
+
+        def update_stage():
+            self.stage.total_work_time += 1
+            self.stage.save()
+
+        self.assert_user_written_first(lambda: Stage.objects.create(name='Stage 2', user=self.user), 'Stage created')
+        self.assert_user_written_first(update_stage, 'Stage updated')
+        self.assert_user_written_first(
+            lambda: Subject.objects.create(name='Subject 2', user=self.user), 'Subject created'
+        )
+        self.assert_user_written_first(lambda: Day.objects.create(
+            user=self.user, stage=self.stage, day=date(2022, 1, 2), start=time(8, 0), end=time(20, 0)
+        ), 'Day created')
+        self.assert_user_written_first(update_day, 'Day updated')
+        self.assert_user_written_first(lambda: Session.objects.create(
+            user=self.user, day=self.day, subject=self.subject, start=time(12, 0), end=time(13, 0)
+        ), 'Session created')
+        self.assert_user_written_first(update_session, 'Session updated')
+
+    def test_bulk_writes(self):
+        """Test the creation, the update and the deletion of objects in bulk. """
+
+        self.assert_user_written_first(
+            lambda: Stage.create_in_bulk([Stage(name='Stage 2', user=self.user)]), 'Stages created'
+        )
+        self.assert_user_written_first(
+            lambda: Subject.create_in_bulk([Subject(name='Subject 2', user=self.user)]), 'Subjects created'
+        )
+        self.assert_user_written_first(lambda: Day.create_in_bulk([
+            Day(user=self.user, stage=self.stage, day=date(2022, 1, 2), start=time(8, 0), end=time(20, 0))
+        ]), 'Days created')
+        self.assert_user_written_first(lambda: Session.create_in_bulk([
+            Session(user=self.user, day=self.day, subject=self.subject, start=time(12, 0), end=time(13, 0))
+        ]), 'Sessions created')
+
+        day = Day.objects.get(id=self.day.id)
+        day.worktime = 3600
+        self.assert_user_written_first(lambda: Day.update_in_bulk([day]), 'Days updated')
+        session = Session.objects.get(id=self.session.id)
+        session.end = time(11, 0)
+        self.assert_user_written_first(lambda: Session.update_in_bulk([session]), 'Sessions updated')
+
+        self.assert_user_written_first(
+            lambda: Session.delete_in_bulk(Session.objects.filter(id=self.session.id)), 'Sessions deleted'
+        )
+        self.assert_user_written_first(lambda: Day.delete_in_bulk(Day.objects.all()), 'Days deleted')
+
+    def test_deletes(self):
+        """Test the deletion of each model, including the cascades. """
+
+        self.assert_user_written_first(Session.objects.get(id=self.session.id).delete, 'Session deleted')
+        self.assert_user_written_first(Day.objects.get(id=self.day.id).delete, 'Day deleted')
+        self.assert_user_written_first(Subject.objects.get(id=self.subject.id).delete, 'Subject deleted')
+        self.assert_user_written_first(Stage.objects.get(id=self.stage.id).delete, 'Stage deleted')
+
+
+class TestTombstones(TestCase):
+    """Test that the deletions, including the cascading ones, are recorded for the changes feed. """
+
+    def setUp(self):
+        self.user = User.objects.create(username='fx', email='123@gmail.com')
+        self.stage = Stage.objects.create(name='Stage', user=self.user)
+        self.subjects = [Subject.objects.create(name=f'Subject {i}', user=self.user) for i in range(2)]
+        self.days = [
+            Day.objects.create(user=self.user, stage=self.stage, day=date(2022, 1, 1 + i), start=time(8, 0))
+            for i in range(2)
+        ]
+        self.sessions = [
+            Session.objects.create(user=self.user, day=day, subject=subject, start=time(9, 0), end=time(10, 0))
+            for day in self.days for subject in self.subjects
+        ]
+
+    def get_tombstones(self) -> set:
+        return set(Tombstone.objects.filter(user=self.user).values_list('model', 'object_id'))
+
+    def test_subject_delete(self):
+        """Test that the sessions of a deleted subject are recorded along with it. """
+
+        subject_id = self.subjects[0].id
+        session_ids = [session.id for session in self.sessions if session.subject_id == subject_id]
+        self.subjects[0].delete()
+
+        self.assertEqual(
+            self.get_tombstones(),
+            {('subject', subject_id)} | {('session', session_id) for session_id in session_ids},
+            'Wrong tombstones'
+        )
+
+    def test_bulk_delete(self):
+        """Test that the days and sessions deleted in bulk are recorded at the same time. """
+
+        day_ids = [day.id for day in self.days]
+        Day.delete_in_bulk(Day.objects.filter(id__in=day_ids))
+
+        self.assertEqual(
+            self.get_tombstones(),
+            {('day', day_id) for day_id in day_ids} | {('session', session.id) for session in self.sessions},
+            'Wrong tombstones'
+        )
+        self.assertEqual(
+            Tombstone.objects.filter(model='day').values('deleted_at').distinct().count(), 1,
+            'Wrong time of deletion'
+        )
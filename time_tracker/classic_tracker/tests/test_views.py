@@ -1,17 +1,27 @@
+import json
+import re
+from base64 import urlsafe_b64encode
 from datetime import date, time
 from decimal import Decimal
 from itertools import product
+from unittest.mock import patch
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection
 from django.db.models import Max
 from django.db.models.functions import Coalesce
-from django.test import TestCase, SimpleTestCase, Client
+from django.test import TestCase, SimpleTestCase, Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+import numpy as np
 from numpy import cumsum
 
-from ..models import Session, User, Stage, Subject, Day
+from ..models import Session, User, Stage, Subject, Day, time_to_idx, histogram_diff, get_data_version
 from ..templatetags.filters import ratio_to_percentage
-from ..views import seconds_to_hours_minutes, hours_to_hours_minutes, cumsum_in_place, time_to_idx, get_freq_list
+from ..views import seconds_to_hours_minutes, hours_to_hours_minutes, cumsum_in_place, get_freq_list, \
+    freq_list_from_arrays, dashboard_data_key, DayListView, SessionListView, StageListView, SubjectListView
 
 
 class TestSecondsToHoursMinutes(SimpleTestCase):
@@ -264,11 +274,47 @@ class TestGetFreqList(TestCase):
             'Wrong frequency list'
         )
 
+    def test_steps_per_hour(self):
+        """Test that every number of steps per hour dividing 60 gives the same bars as the row by row computation. """
+
+        sessions = [
+            (time(start_hour, start_minute), time(end_hour, end_minute), end_next_day)
+            for start_hour, start_minute, end_hour, end_minute, end_next_day in product(
+                (0, 11, 23), (0, 7, 15, 45, 59), (0, 12, 23), (1, 30, 52), (False, True)
+            )
+            if end_next_day or (end_hour, end_minute) > (start_hour, start_minute)
+        ]
+        Session.objects.bulk_create(
+            Session(user=self.user, day=self.day, subject=self.subject, start=start, end=end, end_next_day=end_next_day)
+            for start, end, end_next_day in sessions
+        )
+
+        for n_steps_per_hour in (1, 2, 3, 4, 5, 6, 10, 12, 15, 20, 30, 60):
+            freq_list = [0] * (24 * n_steps_per_hour)
+            diff = histogram_diff(((start, end, end_next_day, 1) for start, end, end_next_day in sessions),
+                                  n_steps_per_hour)
+            for idx, delta in diff.items():
+                freq_list[idx] += delta
+            cumsum_in_place(freq_list)
+
+            self.assertEqual(get_freq_list(Session.objects.all(), n_steps_per_hour), freq_list,
+                             f'Wrong frequency list with {n_steps_per_hour} steps per hour')
+
+    def test_empty_arrays(self):
+        """Test the vectorized engine with no session. """
+
+        self.assertEqual(
+            freq_list_from_arrays(np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([]), 2),
+            [0] * 48,
+            'Wrong frequency list'
+        )
+
 
 class TestDashboardView(TestCase):
     """Test the dashboard view. """
 
     def setUp(self):
+        caches['default'].clear()
         self.client = Client()
         self.user = get_user_model().objects.create_user(
             email='test@example.com',
@@ -301,6 +347,7 @@ class TestDashboardView(TestCase):
             end_next_day=False,
         )
         self.url = reverse('classic_tracker:dashboard')
+        self.data_url = reverse('classic_tracker:dashboard_data')
         self.client.force_login(self.user)
 
     def test_login_required(self):
@@ -309,9 +356,11 @@ class TestDashboardView(TestCase):
         self.client.logout()
         res = self.client.get(self.url)
         self.assertRedirects(res, f'/accounts/login/?next={self.url}')
+        res = self.client.get(self.data_url)
+        self.assertRedirects(res, f'/accounts/login/?next={self.data_url}')
 
-    def test_context_data(self):
-        """Test that the correct context data are in the html. """
+    def test_chart_data(self):
+        """Test that the chart data endpoint returns the correct series. """
 
         # Study distribution data
         n_steps_per_hour = 4
@@ -321,7 +370,6 @@ class TestDashboardView(TestCase):
                 time_to_idx(self.session.end, n_steps_per_hour)[1] + 1
         ):
             freq_list[idx] += 1
-        data_study = 'data_study = ' + str(freq_list)
 
         # Global data
         total_usable_time = round(self.user.total_usable_time / 3600, 1)
@@ -329,16 +377,146 @@ class TestDashboardView(TestCase):
         total_study_time = round(self.user.total_study_time / 3600, 1)
         non_study_time = max(0, total_usable_time - total_study_time)
         inactive_time = self.user.day_count * 24 - total_study_time - non_study_time - total_work_time
-        data_global = 'data_global = ' + str([
+        data_global = [
             total_work_time,
             total_study_time,
             non_study_time,
             inactive_time,
-        ])
+        ]
 
-        res = self.client.get(self.url)
-        self.assertContains(res, data_study)
-        self.assertContains(res, data_global)
+        res = self.client.get(self.data_url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['study_time_distribution_data'], freq_list, 'Wrong study time distribution')
+        self.assertEqual(res.json()['study_time_distribution_labels'][:3], ['0h', '0h15', '0h30'], 'Wrong labels')
+        self.assertEqual(res.json()['time_distribution_data'], data_global, 'Wrong time distribution')
+
+    def test_shell_reads_no_day_nor_session(self):
+        """Test that rendering the HTML shell of the dashboard does not query any day nor session. """
+
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200)
+        for query in ctx.captured_queries:
+            self.assertNotIn('classic_tracker_session', query['sql'], 'Sessions read')
+            self.assertNotIn('classic_tracker_day', query['sql'], 'Days read')
+
+    def test_etag(self):
+        """Test that the chart data is revalidated with its ETag until the data of the user changes. """
+
+        res = self.client.get(self.data_url)
+        etag = res['ETag']
+        self.assertIn('private', res['Cache-Control'])
+
+        # Not modified, served without computing (nor reading from the cache) the data
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(self.data_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+        self.assertFalse(
+            any('classic_tracker_day' in query['sql'] for query in ctx.captured_queries),
+            'Data computed for a 304 response'
+        )
+
+        # Other filters, other ETag
+        res = self.client.get(self.data_url, {'subject': self.subject.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+
+        # A write invalidates the data
+        with self.captureOnCommitCallbacks(execute=True):
+            Session.objects.create(
+                user=self.user,
+                day=self.day,
+                subject=self.subject,
+                start=time(15, 0),
+                end=time(16, 0),
+                end_next_day=False,
+            )
+        res = self.client.get(self.data_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res['ETag'], etag, 'ETag not changed')
+        self.assertEqual(res.json()['study_time_distribution_data'][time_to_idx(time(15, 30), 4)[1]], 1,
+                         'Stale study time distribution')
+
+    def test_study_time_filters(self):
+        """Test that the study time distribution is only computed from the sessions matching the filters. """
+
+        other_subject = Subject.objects.create(user=self.user, name='Other subject')
+        Session.objects.create(
+            user=self.user,
+            day=self.day,
+            subject=other_subject,
+            start=time(16, 0),
+            end=time(17, 0),
+            end_next_day=False,
+        )
+
+        n_steps_per_hour = 4
+        freq_list = [0] * 24 * n_steps_per_hour
+        for idx in range(time_to_idx(self.session.start, 4)[1], time_to_idx(self.session.end, 4)[1] + 1):
+            freq_list[idx] += 1
+
+        res = self.client.get(self.url, {'subject': self.subject.id})
+        self.assertTrue(res.context['study_time_filtered'], 'Filters not applied')
+        res = self.client.get(self.data_url, {'subject': self.subject.id})
+        self.assertEqual(res.json()['study_time_distribution_data'], freq_list, 'Wrong study time distribution')
+
+        # Date range excluding all days
+        res = self.client.get(self.data_url, {'start_date': '2022-05-07'})
+        self.assertEqual(res.json()['study_time_distribution_data'], [0] * 24 * n_steps_per_hour,
+                         'Wrong study time distribution')
+
+        # Invalid date range, the filters are ignored
+        res = self.client.get(self.url, {'start_date': '2022-05-07', 'end_date': '2022-05-06'})
+        self.assertFalse(res.context['study_time_filtered'], 'Invalid filters applied')
+        self.assertContains(res, 'The start date must not be after the end date')
+
+        # Stages and subjects of other users cannot be selected
+        other_user = get_user_model().objects.create_user(email='other@example.com', username='other', password='pw')
+        other_stage = Stage.objects.create(user=other_user, name='Stage')
+        res = self.client.get(self.url, {'stage': other_stage.id})
+        self.assertFalse(res.context['study_time_filtered'], 'Stage of another user selected')
+        res = self.client.get(self.data_url, {'stage': other_stage.id})
+        self.assertEqual(res.json()['study_time_distribution_data'][time_to_idx(time(16, 30), 4)[1]], 1,
+                         'Stage of another user selected')
+
+    def test_write_before_version_read(self):
+        """Test that a write between the loading of the user and the reading of the data version is not cached stale. """
+
+        def write_then_key(request):
+            request.user.total_study_time  # Loaded by the login check, before any version is read
+            with self.captureOnCommitCallbacks(execute=True):
+                Session.objects.create(
+                    user=self.user,
+                    day=self.day,
+                    subject=self.subject,
+                    start=time(15, 0),
+                    end=time(16, 0),
+                    end_next_day=False,
+                )
+            return dashboard_data_key(request)
+
+        with patch('classic_tracker.views.dashboard_data_key', write_then_key):
+            res = self.client.get(self.data_url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['time_distribution_data'][1], 3.0, 'Stale total study time')
+        self.assertEqual(res.json()['study_time_distribution_data'][time_to_idx(time(15, 30), 4)[1]], 1,
+                         'Stale study time distribution')
+
+        # The data cached under the new version is up to date
+        res = self.client.get(self.data_url)
+        self.assertEqual(res.json()['time_distribution_data'][1], 3.0, 'Stale data cached')
+
+    async def test_asgi(self):
+        """Test the chart data through the ASGI handler, where a query made by the sync ORM would raise an error. """
+
+        await sync_to_async(self.async_client.force_login)(self.user)
+        res = await self.async_client.get(self.data_url, {'subject': self.subject.id})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sum(res.json()['study_time_distribution_data']), 9, 'Wrong study time distribution')
+
+        res = await self.async_client.get(self.data_url, IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 200, 'ETag shared by other filters')
+        res = await self.async_client.get(self.data_url, IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 304)
 
     def test_global_analytics(self):
         """Test that the global analytics table contains the correct data. """
@@ -351,9 +529,6 @@ class TestDashboardView(TestCase):
             'Total usable time',
             'Total study time',
             'Total work time',
-            'Max usable time',
-            'Max study time',
-            'Max time usage percentage',
             'Average session time',
             'Average day time',
             'Time usage percentage',
@@ -374,9 +549,6 @@ class TestDashboardView(TestCase):
             seconds_to_hours_minutes(self.user.total_usable_time),
             seconds_to_hours_minutes(self.user.total_study_time),
             seconds_to_hours_minutes(self.user.total_work_time),
-            seconds_to_hours_minutes(aggregate_data['max_usable_time']),
-            seconds_to_hours_minutes(aggregate_data['max_study_time']),
-            ratio_to_percentage(aggregate_data['max_time_usage_ratio']),
             seconds_to_hours_minutes(self.user.total_study_time / self.user.session_count),
             seconds_to_hours_minutes(self.user.total_study_time / self.user.day_count),
             ratio_to_percentage(self.user.total_study_time / self.user.total_usable_time),
@@ -391,6 +563,168 @@ class TestDashboardView(TestCase):
         for table_row_regex in table_row_regex_list:
             self.assertRegex(res.content.decode(), table_row_regex)
 
+        # Max values are filled in from the chart data endpoint
+        res = self.client.get(self.data_url)
+        self.assertEqual(res.json()['max_usable_time'], aggregate_data['max_usable_time'], 'Wrong max usable time')
+        self.assertEqual(res.json()['max_study_time'], aggregate_data['max_study_time'], 'Wrong max study time')
+        self.assertEqual(res.json()['max_time_usage_ratio'], float(aggregate_data['max_time_usage_ratio']),
+                         'Wrong max time usage ratio')
+
+
+class TestQueryPlans(TestCase):
+    """Test that the main queries of the list and detail views are served by indexes, not by full table scans. """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = get_user_model().objects.create_user(
+            email='test@example.com',
+            username='user',
+            password='user_password',
+        )
+        self.stage = Stage.objects.create(user=self.user, name='Stage')
+        self.subject = Subject.objects.create(user=self.user, name='Subject')
+        self.day = Day.objects.create(user=self.user, stage=self.stage, day=date(2022, 5, 6), start=time(10, 0))
+
+    def get_queryset(self, view_class, query_string=''):
+        """Returns the queryset of a list view, for a GET request with the given query string. """
+
+        request = self.factory.get('/?' + query_string)
+        request.user = self.user
+        view = view_class()
+        view.setup(request)
+        return view.get_queryset()
+
+    @staticmethod
+    def get_index_name(model, *columns, unique: bool = False) -> str:
+        """
+        Returns the name of the index of model on exactly the given columns, e.g. the index of a foreign key, or of a
+        unique constraint, which SQLite names sqlite_autoindex_* when it is created with its table.
+        """
+
+        table = model._meta.db_table
+        with connection.cursor() as cursor:
+            if unique and connection.vendor == 'sqlite':
+                # The autoindexes are not introspected
+                cursor.execute(f'PRAGMA index_list({table})')
+                indexes = [row[1] for row in cursor.fetchall() if row[3] == 'u']
+                constraints = {}
+                for name in indexes:
+                    cursor.execute(f'PRAGMA index_info({name})')
+                    constraints[name] = {'index': True, 'unique': True, 'columns': [row[2] for row in cursor]}
+            else:
+                constraints = connection.introspection.get_constraints(cursor, table)
+        names = [
+            name for name, constraint in constraints.items()
+            if constraint['index'] and constraint['unique'] == unique and constraint['columns'] == list(columns)
+        ]
+        assert len(names) == 1, f'No single index on {", ".join(columns)}: {names}'
+        return names[0]
+
+    def assertUsesIndex(self, queryset, *index_names):
+        """Asserts that the plan of queryset reads its table through one of the given indexes. """
+
+        plan = queryset.explain()
+        self.assertTrue(
+            any(re.search(rf'\b{re.escape(name)}\b', plan) for name in index_names),
+            f'Query on {queryset.model._meta.db_table} does not use {" or ".join(index_names)}:\n{plan}'
+        )
+
+    def test_day_queries(self):
+        """Test the queries on days. """
+
+        user_index = self.get_index_name(Day, 'user_id')
+        stage_index = self.get_index_name(Day, 'stage_id')
+        user_day_index = self.get_index_name(Day, 'user_id', 'day', unique=True)
+        for query_string in ('', 'sorting=-id'):
+            self.assertUsesIndex(self.get_queryset(DayListView, query_string), user_index)
+        # The day list is sorted by day with the unique constraint
+        for query_string in ('sorting=day', 'sorting=-day'):
+            self.assertUsesIndex(self.get_queryset(DayListView, query_string), user_day_index)
+        self.assertUsesIndex(self.get_queryset(DayListView, f'stage={self.stage.id}'), user_index, stage_index)
+        self.assertUsesIndex(Day.objects.filter(stage=self.stage).order_by('-id'), stage_index)
+        self.assertUsesIndex(Day.objects.filter(user=self.user, day__in=[date(2022, 5, 6)]), user_day_index)
+        self.assertUsesIndex(
+            Day.objects.filter(user=self.user, stage__in=[self.stage.id]).order_by('-id'), user_index, stage_index
+        )
+
+    def test_session_queries(self):
+        """Test the queries on sessions. """
+
+        user_index = self.get_index_name(Session, 'user_id')
+        subject_index = self.get_index_name(Session, 'subject_id')
+        self.assertUsesIndex(self.get_queryset(SessionListView), user_index)
+        self.assertUsesIndex(
+            self.get_queryset(SessionListView, f'day={self.day.id}'), user_index, 'session_day_subject_idx'
+        )
+        self.assertUsesIndex(self.get_queryset(SessionListView, f'subject={self.subject.id}'), subject_index)
+        self.assertUsesIndex(Session.objects.filter(day=self.day), 'session_day_subject_idx')
+        self.assertUsesIndex(Session.objects.filter(subject=self.subject).order_by('-id'), subject_index)
+        self.assertUsesIndex(
+            Session.objects.filter(user=self.user, day__in=[self.day.id], subject__in=[self.subject.id]),
+            'session_day_subject_idx'
+        )
+
+    def test_stage_and_subject_queries(self):
+        """Test the queries on stages and subjects. """
+
+        self.assertUsesIndex(self.get_queryset(StageListView), self.get_index_name(Stage, 'user_id'))
+        self.assertUsesIndex(self.get_queryset(SubjectListView), self.get_index_name(Subject, 'user_id'))
+
+
+class TestCachedLists(TestCase):
+    """Test that the cached stage and subject tables are invalidated by any write of the user. """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = get_user_model().objects.create_user(
+            email='test@example.com',
+            username='user',
+            password='user_password',
+        )
+        self.stage = Stage.objects.create(user=self.user, name='Stage')
+        self.subject = Subject.objects.create(user=self.user, name='Subject')
+        self.client.force_login(self.user)
+
+    def test_stage_list(self):
+        """Test that a new stage and the new totals of a stage are shown right after the write. """
+
+        url = reverse('classic_tracker:list_stage')
+        self.assertContains(self.client.get(url), 'Stage')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Stage.objects.create(user=self.user, name='New stage')
+        self.assertContains(self.client.get(url), 'New stage')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Day.objects.create(
+                user=self.user,
+                stage=self.stage,
+                day=date(2022, 5, 6),
+                start=time(8, 0),
+                end=time(20, 0),
+                end_next_day=False,
+            )
+        self.assertContains(self.client.get(url), seconds_to_hours_minutes(12 * 3600))
+
+    def test_subject_list(self):
+        """Test that the deletion of a subject is shown right after the write. """
+
+        url = reverse('classic_tracker:list_subject')
+        self.assertContains(self.client.get(url), '<td>Subject</td>')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Subject.objects.get(id=self.subject.id).delete()
+        self.assertNotContains(self.client.get(url), '<td>Subject</td>')
+
+    def test_version_bumped_on_commit_only(self):
+        """Test that the data version is bumped once the transaction is committed. """
+
+        version = get_data_version(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Stage.objects.create(user=self.user, name='New stage')
+            self.assertEqual(get_data_version(self.user.id), version, 'Version bumped before commit')
+        self.assertGreater(get_data_version(self.user.id), version, 'Version not bumped')
+
 
 class TestDayCreateView(TestCase):
 
@@ -526,6 +860,57 @@ class TestDayListView(TestCase):
         self.assertContains(res, self.day1.day.strftime('%b %-d, %Y'))
         self.assertNotContains(res, self.day2.day.strftime('%b %-d, %Y'))
 
+    def test_keyset_pagination(self):
+        """Test browsing the pages back and forth with cursors, with ties on the sort column. """
+
+        for i in range(23):
+            Day.objects.create(
+                user=self.user,
+                stage=(self.stage1, self.stage2)[i % 2],
+                day=date(2022, 6, 1 + i),
+                worktime=3600,
+                start=time(10, 0),
+                end=time(20, 0),
+            )
+        sorting = '-name_stage'
+        expected = list(
+            Day.objects.filter(user=self.user).order_by('-stage__name', '-id').values_list('id', flat=True)
+        )
+
+        # Forward
+        pages, query = [], f'sorting={sorting}'
+        while query is not None:
+            res = self.client.get(f'{self.url}?{query}')
+            self.assertEqual(res.status_code, 200, 'Wrong status code')
+            pages.append([day.id for day in res.context['day_list']])
+            query = res.context.get('next_page_query')
+        self.assertEqual([len(page) for page in pages], [10, 10, 5], 'Wrong page sizes')
+        self.assertEqual(sum(pages, []), expected, 'Wrong pages')
+
+        # Backward, from the last page
+        query = res.context['previous_page_query']
+        for page in reversed(pages[:-1]):
+            res = self.client.get(f'{self.url}?{query}')
+            self.assertEqual([day.id for day in res.context['day_list']], page, 'Wrong previous page')
+            query = res.context.get('previous_page_query')
+        self.assertIsNone(query, 'Wrong previous page of the first page')
+
+        # Any page costs the same number of queries (user, page), without counting the days
+        res = self.client.get(f'{self.url}?sorting={sorting}')
+        with self.assertNumQueries(2):
+            self.client.get(f'{self.url}?{res.context["next_page_query"]}')
+
+        # A cursor of another sorting restarts from the first page, an invalid one is not found
+        res = self.client.get(f'{self.url}?sorting=day&{res.context["next_page_query"].split("&")[1]}')
+        self.assertEqual(res.context['day_list'][0].day, date(2022, 5, 6), 'Wrong page of a foreign cursor')
+        res = self.client.get(f'{self.url}?cursor=invalid')
+        self.assertTemplateUsed(res, '404.html', 'Wrong template of an invalid cursor')
+
+        # A forged cursor whose value is not a date is not found either
+        cursor = urlsafe_b64encode(json.dumps({'f': '-day', 'v': 'notadate', 'id': 3, 'b': False}).encode())
+        res = self.client.get(f'{self.url}?sorting=-day&cursor={cursor.decode()}')
+        self.assertTemplateUsed(res, '404.html', 'Wrong template of a forged cursor')
+
 
 class TestDayUpdateView(TestCase):
 
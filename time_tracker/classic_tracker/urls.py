@@ -1,7 +1,7 @@
 from django.urls import path
 
 from .views import (
-    DashboardView,
+    DashboardView, DashboardDataView,
     DayListView, DayUpdateView, DayDeleteView, DayCreateView, DayDetailView,
     SessionCreateView, SessionListView, SessionUpdateView, SessionDeleteView, SessionDetailView,
     StageCreateView, StageListView, StageUpdateView, StageDeleteView, StageDetailView,
@@ -11,8 +11,9 @@ from .views import (
 app_name = 'classic_tracker'
 
 urlpatterns = [
-    # TODO: cache dashboard page and provide a refresh button
     path('dashboard/', DashboardView.as_view(), name='dashboard'),
+    # Cached per user and data version, revalidated with an ETag
+    path('dashboard_data/', DashboardDataView.as_view(), name='dashboard_data'),
 
     path('create_day/', DayCreateView.as_view(), name='create_day'),
     # Day list is paginated in the backend and should not be cached
@@ -1,21 +1,28 @@
-from datetime import time
 from decimal import Decimal
+from functools import lru_cache
+from hashlib import md5
 from math import ceil
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
+import numpy as np
+from asgiref.sync import sync_to_async
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.cache import caches
-from django.core.cache.utils import make_template_fragment_key
 from django.db import transaction
 from django.db.models import Max, QuerySet, OuterRef, Subquery, F
-from django.db.models.functions import Coalesce
-from django.shortcuts import redirect
-from django.urls import reverse_lazy, reverse
+from django.db.models.functions import Coalesce, ExtractHour, ExtractMinute
+from django.http import JsonResponse, Http404
+from django.urls import reverse_lazy
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
+from django.views import View
 from django.views.generic import TemplateView, CreateView, UpdateView, DeleteView, ListView, DetailView
 
-from .forms import DayCreateUpdateForm, SessionCreateUpdateForm, StageCreateUpdateForm, SubjectCreateUpdateForm
-from .models import Day, Session, Stage, Subject
+from .forms import DayCreateUpdateForm, SessionCreateUpdateForm, StageCreateUpdateForm, SubjectCreateUpdateForm, \
+    DashboardFilterForm
+from .models import Day, Session, Stage, Subject, User, HISTOGRAM_STEPS_PER_HOUR, unpack_histogram, get_data_version
+from .pagination import KeysetPaginator, InvalidCursor
 
 
 def seconds_to_hours_minutes(s: Optional[int]) -> str:
@@ -62,27 +69,58 @@ def cumsum_in_place(lst: List[int]) -> None:
     return
 
 
-def time_to_idx(t: time, n_steps_per_hour: int) -> (bool, int):
+def minutes_to_idx(minutes: np.ndarray, n_steps_per_hour: int) -> Tuple[np.ndarray, np.ndarray]:
     """
-    The first output indicates if the input time is too close to midnight s.t. the index overflows and becomes 0.
-    The second output is the index (in the frequency list, which is used in the dashboard plot) corresponds to a time.
+    Vectorized version of time_to_idx, where times are given as numbers of minutes since midnight.
+    Returns the index overflow flags and the indices.
+    """
+
+    hours, minutes = np.divmod(minutes, 60)
+
+    # Attention: np.rint rounds to the nearest even integer, like Python's round function
+    idx = hours * n_steps_per_hour + np.rint(minutes * n_steps_per_hour / 60).astype(np.int64)
+    return np.divmod(idx, n_steps_per_hour * 24)
+
 
-    Example: if the frequency list is quantized s.t. it has 4 steps per hour,
-    then 2:15 AM corresponds to index 2 * 4 + 15 * 4 / 60 = 9 in the frequency list.
+def freq_list_from_arrays(start: np.ndarray, end: np.ndarray, end_next_day: np.ndarray,
+                          n_steps_per_hour: int = 4) -> list:
     """
+    This function returns the frequency list of well-defined sessions (see get_freq_list),
+    given as arrays of start times, end times (in minutes since midnight) and end_next_day flags.
+
+    Time = O(n_sessions + n_steps_per_day), with no loop over the sessions in Python.
+    """
+
+    n_steps_per_day = n_steps_per_hour * 24
+    _, start_idx = minutes_to_idx(start, n_steps_per_hour)
+    idx_overflow, end_idx = minutes_to_idx(end, n_steps_per_hour)
 
-    # Attention: Python's round function rounds to the nearest even integer
-    return divmod(t.hour * n_steps_per_hour + round(t.minute * n_steps_per_hour / 60), n_steps_per_hour * 24)
+    # Difference array: +1 where a session starts, -1 right after it ends.
+    # The extra bin n_steps_per_day collects the sessions ending in the last step, and is dropped.
+    times = np.bincount(start_idx, minlength=n_steps_per_day) \
+        - np.bincount(end_idx + 1, minlength=n_steps_per_day + 1)[:n_steps_per_day]
+
+    # Sessions spanning across midnight, or ending so close to midnight that their end index overflows
+    times[0] += np.count_nonzero(end_next_day) + np.count_nonzero(idx_overflow)
+
+    return np.cumsum(times).tolist()
+
+
+def minutes_since_midnight(field: str):
+    """Expression computing the number of minutes since midnight of a time field in the database. """
+
+    return ExtractHour(field) * 60 + ExtractMinute(field)
 
 
 def get_freq_list(user_sessions: QuerySet, n_steps_per_hour: int = 4) -> list:
     """
     This function returns a frequency list, which is required by Chart.js for plotting.
-    If user has no sessions, returns an empty list.
+    If user has no sessions, returns a list of zeros.
 
-    Time = O(n_sessions + n_steps_per_day), space = O(n_steps_per_day)
+    Times are converted to minutes in the database and loaded as NumPy arrays, see freq_list_from_arrays.
 
-    :param user_sessions: user_sessions.values_list('start', 'end', 'end_next_day')
+    :param user_sessions: queryset of the sessions to count, possibly filtered (e.g. by subject, stage or date),
+    or user_sessions.values_list('start', 'end', 'end_next_day')
     :param n_steps_per_hour: number of steps per hour in the dashboard plot.
     :return: a list of frequencies, i.e. a list containing the bars' heights
     """
@@ -90,87 +128,191 @@ def get_freq_list(user_sessions: QuerySet, n_steps_per_hour: int = 4) -> list:
     assert 60 % int(n_steps_per_hour) == 0, \
         "60 should be divisible by n_steps_per_hour, i.e. step size in minutes should be an integer"
 
-    n_steps_per_day = n_steps_per_hour * 24
-    times = [0] * n_steps_per_day
+    return freq_list_from_rows(list(session_minutes(user_sessions)), n_steps_per_hour)
+
+
+def session_minutes(user_sessions: QuerySet) -> QuerySet:
+    """Start and end (in minutes since midnight) and end_next_day of the well-defined sessions of user_sessions. """
+
+    # Only well-defined sessions (relative to to-be-completed) are counted
+    return user_sessions.filter(end__isnull=False, end_next_day__isnull=False).order_by().values_list(
+        minutes_since_midnight('start'),
+        minutes_since_midnight('end'),
+        'end_next_day',
+    )
+
+
+def freq_list_from_rows(rows: list, n_steps_per_hour: int) -> list:
+    """Frequency list of the rows of session_minutes, see get_freq_list. """
+
+    sessions = np.array(rows, dtype=np.int64).reshape(-1, 3)
+    return freq_list_from_arrays(sessions[:, 0], sessions[:, 1], sessions[:, 2], n_steps_per_hour)
+
+
+@lru_cache
+def get_bar_plot_labels(n_steps_per_hour: int) -> Tuple[str, ...]:
+    """Labels of the study time distribution bar plot, e.g. ('0h', '0h15', '0h30', ...). Computed once. """
+
+    min_per_step = 60 // n_steps_per_hour
+    bar_plot_labels = [''] * (n_steps_per_hour * 24)
+    for step in range(24 * n_steps_per_hour):
+        hour, n_step = divmod(step, n_steps_per_hour)
+        if n_step > 0:
+            bar_plot_labels[step] = f'{hour}h{n_step * min_per_step}'
+        else:
+            bar_plot_labels[step] = f'{hour}h'
+
+    return tuple(bar_plot_labels)
+
+
+def dashboard_data_key(request) -> str:
+    """
+    Identifies the dashboard data of a request: user, data version (see models.get_data_version) and filters.
+    Used both as cache key and as ETag, s.t. both change as soon as any data of the user is written.
+    """
+
+    filters = md5(request.GET.urlencode().encode()).hexdigest()
+    return f'dashboard_data:{request.user.id}:{get_data_version(request.user.id)}:{filters}'
 
-    # Populate the 2 frequency lists
-    for session in user_sessions:
-        start, end, end_next_day = session
 
-        # If session is well-defined (relative to to-be-completed), update the frequency lists
-        if start is not None and end is not None and end_next_day is not None:
+class KeysetPaginationMixin:
+    """
+    ListView mixin paginating with a KeysetPaginator instead of OFFSET pagination, s.t. deep pages are as fast as
+    the first one. The page is selected by the cursor GET parameter.
+    The template gets the query strings of the previous and next pages (other parameters, e.g. sorting, are kept).
+    """
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
 
-            if end_next_day:
-                times[0] += 1
+        return paginator, page, page.object_list, page.has_other_pages()
 
-            times[time_to_idx(start, n_steps_per_hour)[1]] += 1
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
 
-            # Avoid end_idx out of range
-            idx_overflow, end_idx = time_to_idx(end, n_steps_per_hour)
-            if end_idx + 1 < n_steps_per_day:
-                times[end_idx + 1] -= 1
+        page = context['page_obj']
+        for name, cursor in (('previous_page_query', page.previous_cursor), ('next_page_query', page.next_cursor)):
+            if cursor is not None:
+                query = self.request.GET.copy()
+                query['cursor'] = cursor
+                context[name] = query.urlencode()
+
+        return context
 
-            if idx_overflow:
-                times[0] += 1
 
-    # Turn the frequency list into cumsum list
-    cumsum_in_place(times)
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    """LoginRequiredMixin for async views, which loads the user of the session in a thread. """
 
-    return times
+    async def dispatch(self, request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return self.handle_no_permission()
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
 
 
 class DashboardView(LoginRequiredMixin, TemplateView):
+    """
+    HTML shell of the dashboard. The chart series and the max values are fetched asynchronously from
+    DashboardDataView, so that rendering the page does not read any day nor session.
+    """
+
     template_name = 'classic_tracker/dashboard.html'
 
     # Extra context variables to display
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        user_sessions = Session.objects.filter(user=self.request.user.id).values_list('start', 'end', 'end_next_day')
+        filter_form = DashboardFilterForm(self.request.GET or None, user=self.request.user)
+        context['filter_form'] = filter_form
+        context['study_time_filtered'] = filter_form.is_bound and filter_form.is_valid() and filter_form.has_filters()
+
+        return context
+
+
+class DashboardDataView(AsyncLoginRequiredMixin, View):
+    """
+    Chart series and max values of the dashboard, as JSON.
+
+    Responses are cached per user, data version and filters. Clients revalidate them with their ETag,
+    and get a 304 without any query as long as the data of the user did not change.
+
+    The view is async: under ASGI, the worker serves other requests while the data is read (with the async ORM)
+    or computed.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        key = await sync_to_async(dashboard_data_key)(request)
+        etag = quote_etag(md5(key.encode()).hexdigest())
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache = caches['default']
+            data = await cache.aget(key)
+            if data is None:
+                data = await self.get_data()
+                await cache.aset(key, data, timeout=86400)
+            response = JsonResponse(data)
+
+        response.headers.setdefault('ETag', etag)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    async def get_data(self) -> dict:
+        # request.user was loaded before the data version was read in get(): the totals and the histogram are read
+        # again, so that data changed by a concurrent write is at worst cached under the new version, never stale.
+        user = await User.objects.only(
+            'total_usable_time', 'total_work_time', 'total_study_time', 'day_count', 'study_time_histogram'
+        ).aget(pk=self.request.user.id)
 
         # Compute max then normalize
-        context.update(
-            Day.objects.filter(user=self.request.user.id).aggregate(
-                max_usable_time=Coalesce(Max('usable_time'), 0),
-                max_study_time=Coalesce(Max('study_time'), 0),
-                max_time_usage_ratio=Coalesce(Max('time_usage_ratio'), Decimal(0))
-            )
+        data = await Day.objects.filter(user=user.id).aaggregate(
+            max_usable_time=Coalesce(Max('usable_time'), 0),
+            max_study_time=Coalesce(Max('study_time'), 0),
+            max_time_usage_ratio=Coalesce(Max('time_usage_ratio'), Decimal(0))
         )
+        data['max_time_usage_ratio'] = float(data['max_time_usage_ratio'])
 
         # Data for time distribution pie chart
-        context['time_distribution_labels'] = [
+        data['time_distribution_labels'] = [
             'Work time (h)',
             'Study time (h)',
             'Non study time (h)',
             'Inactive time (h)'
         ]
 
-        total_usable_time = round(self.request.user.total_usable_time / 3600, 1)  # In hours, same below
-        total_work_time = round(self.request.user.total_work_time / 3600, 1)
-        total_study_time = round(self.request.user.total_study_time / 3600, 1)
+        total_usable_time = round(user.total_usable_time / 3600, 1)  # In hours, same below
+        total_work_time = round(user.total_work_time / 3600, 1)
+        total_study_time = round(user.total_study_time / 3600, 1)
         non_study_time = max(0, total_usable_time - total_study_time)
-        inactive_time = self.request.user.day_count * 24 - total_study_time - non_study_time - total_work_time
-        context['time_distribution_data'] = [
+        inactive_time = user.day_count * 24 - total_study_time - non_study_time - total_work_time
+        data['time_distribution_data'] = [
             total_work_time,
             total_study_time,
             non_study_time,
             inactive_time
         ]
 
-        # Data for study time distribution bar plot
-        n_steps_per_hour = 4
-        min_per_step = 60 // n_steps_per_hour
-        context['study_time_distribution_data'] = get_freq_list(user_sessions, n_steps_per_hour)
-        bar_plot_labels = [''] * (n_steps_per_hour * 24)
-        for step in range(24 * n_steps_per_hour):
-            hour, n_step = divmod(step, n_steps_per_hour)
-            if n_step > 0:
-                bar_plot_labels[step] = f'{hour}h{n_step * min_per_step}'
-            else:
-                bar_plot_labels[step] = f'{hour}h'
-        context['study_time_distribution_labels'] = bar_plot_labels
+        # Data for study time distribution bar plot.
+        # Without filter, the histogram maintained incrementally on session save & delete is used,
+        # so that no session has to be read here.
+        n_steps_per_hour = HISTOGRAM_STEPS_PER_HOUR
+        filter_form = DashboardFilterForm(self.request.GET or None, user=self.request.user)
+        # The stage and subject of the filters are validated by the sync ORM
+        if await sync_to_async(lambda: filter_form.is_bound and filter_form.is_valid() and filter_form.has_filters())():
+            user_sessions = filter_form.filter_sessions(Session.objects.filter(user=user.id))
+            # Read in a thread: in Django 4, aiterator() of values_list() querysets runs the query in the event loop
+            rows = await sync_to_async(list)(session_minutes(user_sessions))
+            study_time_distribution = freq_list_from_rows(rows, n_steps_per_hour)
+        else:
+            study_time_distribution = unpack_histogram(user.study_time_histogram, n_steps_per_hour)
+            cumsum_in_place(study_time_distribution)
+        data['study_time_distribution_data'] = study_time_distribution
+        data['study_time_distribution_labels'] = get_bar_plot_labels(n_steps_per_hour)
 
-        return context
+        return data
 
 
 @method_decorator(transaction.atomic, name='dispatch')
@@ -196,7 +338,7 @@ class DayCreateView(LoginRequiredMixin, CreateView):
         return kwargs
 
 
-class DayListView(LoginRequiredMixin, ListView):
+class DayListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Day
     # Customize the name of the object_list sent to template
     context_object_name = 'day_list'
@@ -278,7 +420,7 @@ class SessionCreateView(LoginRequiredMixin, CreateView):
         return kwargs
 
 
-class SessionListView(LoginRequiredMixin, ListView):
+class SessionListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Session
     # Customize the name of the object_list sent to template
     context_object_name = 'session_list'
@@ -399,21 +541,13 @@ class StageListView(LoginRequiredMixin, ListView):
             )\
             .order_by('-id')
 
-    def post(self, request, *args, **kwargs):
-        """
-        Enables post requests on the server.
-
-        Note: post request is not cached, so it can be used to refresh cache.
-        """
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
 
-        if self.request.body.decode() == 'refresh':
-            # Clear cache
-            cache_key = make_template_fragment_key('stage_list', [self.request.user.username])
-            # cache_key = get_cache_key(self.request, 'list_stage', 'GET')
-            caches['default'].delete(cache_key)
+        # Part of the key of the cached table, which is invalidated as soon as any data of the user changes
+        context['data_version'] = get_data_version(self.request.user.id)
 
-        # Refresh by redirecting to current page
-        return redirect(reverse('classic_tracker:list_stage'))
+        return context
 
 
 @method_decorator(transaction.atomic, name='dispatch')
@@ -448,7 +582,8 @@ class StageDetailView(LoginRequiredMixin, DetailView):
         page = int(self.request.GET.get('page', default=1))
         offset = items_per_page * (page - 1)
         days = Day.objects.filter(stage=stage)
-        context['total_nb_pages'] = max(1, ceil(days.count() / items_per_page))
+        # The denormalized day count of the stage spares a SELECT COUNT(*)
+        context['total_nb_pages'] = max(1, ceil(stage.day_count / items_per_page))
         days = days.order_by('-id')[offset:offset+items_per_page]
         context['days'] = days
 
@@ -526,21 +661,13 @@ class SubjectListView(LoginRequiredMixin, ListView):
         # Default ordering is by time of creation (last created <-> on the top)
         return Subject.objects.filter(user=self.request.user.id).order_by('-id')
 
-    def post(self, request, *args, **kwargs):
-        """
-        Enables post requests on the server.
-
-        Note: post request is not cached, so it can be used to refresh cache.
-        """
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
 
-        if self.request.body.decode() == 'refresh':
-            # Clear cache
-            cache_key = make_template_fragment_key('subject_list', [self.request.user.username])
-            # cache_key = get_cache_key(self.request, 'list_subject', 'GET')
-            caches['default'].delete(cache_key)
+        # Part of the key of the cached table, which is invalidated as soon as any data of the user changes
+        context['data_version'] = get_data_version(self.request.user.id)
 
-        # Refresh by redirecting to current page
-        return redirect(reverse('classic_tracker:list_subject'))
+        return context
 
 
 @method_decorator(transaction.atomic, name='dispatch')
@@ -4,6 +4,11 @@ import os
 bind = ":8000"
 workers = multiprocessing.cpu_count() * 2 + 1
 
+# The ASGI application (time_tracker.asgi) is served by uvicorn workers, each of which serves many requests at once:
+# a worker is not pinned by a slow read of an async view (e.g. the API lists and the dashboard data), while the
+# sync views (e.g. the writes) run in threads. time_tracker.wsgi can still be served with -k sync.
+worker_class = 'uvicorn.workers.UvicornWorker'
+
 # Production
 if os.environ.get('DEBUG') == 'False':
     accesslog = None
@@ -6,6 +6,9 @@ function sort_by(key) {
     let urlSearchParams = new URLSearchParams(window.location.search);
     let sorting = Object.fromEntries(urlSearchParams.entries())['sorting'];
 
+    // A cursor only points into the pages of its own sorting
+    urlSearchParams.delete("cursor");
+
     if (sorting === key) {
         urlSearchParams.set("sorting", "-" + key);
     } else {
@@ -48,7 +48,6 @@ SECRET_KEY = os.environ.get('SECRET_KEY')
 
 # Application definition
 INSTALLED_APPS = [
-    'debug_toolbar',  # Django debug toolbar
     'classic_tracker.apps.ClassicTrackerConfig',  # The classic tracker app (for HTML web pages)
     'api.apps.ApiConfig',  # The api app (for APIs)
     'django.contrib.admin',
@@ -63,8 +62,6 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    # Django debug toolbar
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -188,6 +185,10 @@ CSRF_TRUSTED_ORIGINS = ['https://*.timetracker.club']  # Trusted origins for uns
 CSRF_COOKIE_SECURE = True
 
 # Django debug toolbar settings
+# Only installed in DEBUG mode: its middleware is sync only, so under ASGI it would run every request in a thread
+if DEBUG:
+    INSTALLED_APPS.insert(0, 'debug_toolbar')
+    MIDDLEWARE.insert(0, 'debug_toolbar.middleware.DebugToolbarMiddleware')
 DEBUG_TOOLBAR_CONFIG = {
     'SHOW_TOOLBAR_CALLBACK': lambda request: DEBUG,
 }
@@ -197,7 +198,38 @@ INTERNAL_IPS = [
 
 # Django REST framework
 REST_FRAMEWORK = {
-    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
+    'DEFAULT_SCHEMA_CLASS': 'api.schema.AutoSchema',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.PageNumberOrCursorPagination',
+    'PAGE_SIZE': 10,
+    # JSON (default) or MessagePack, negotiated with the Accept and Content-Type headers
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'api.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.ORJSONParser',
+        'api.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # Token buckets per user, see api.throttling.TokenBucketThrottle
+    'DEFAULT_THROTTLE_CLASSES': ['api.throttling.TokenBucketThrottle'],
+    'DEFAULT_THROTTLE_RATES': {
+        'read': os.environ.get('API_THROTTLE_READ_RATE', '1200/min'),
+        'write': os.environ.get('API_THROTTLE_WRITE_RATE', '120/min'),
+        # At least API_MAX_BATCH_SIZE objects
+        'bulk_write': os.environ.get('API_THROTTLE_BULK_WRITE_RATE', '10000/hour'),
+    },
 }
+
+# Maximum number of objects created by a single request to the API (when an array of objects is posted)
+API_MAX_BATCH_SIZE = int(os.environ.get('API_MAX_BATCH_SIZE', 1000))
+
+# Delay (in seconds) after which changes are given by the changes feed of the API (see api.views.ChangesView),
+# which must exceed the duration of the transactions
+API_CHANGES_SETTLE_TIME = float(os.environ.get('API_CHANGES_SETTLE_TIME', 5))
+
+# Number of days for which deletions are kept for the changes feed: older tombstones are purged by the
+# purge_tombstones command, and clients whose cursor is older must resynchronize from scratch
+API_CHANGES_RETENTION_DAYS = int(os.environ.get('API_CHANGES_RETENTION_DAYS', 30))
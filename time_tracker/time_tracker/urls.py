@@ -14,6 +14,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth import views
 from django.urls import path, include
@@ -67,9 +68,10 @@ urlpatterns = [
 
     # The api app
     path('api/', include('api.urls'), name='api'),
+]
 
+if 'debug_toolbar' in settings.INSTALLED_APPS:
     # Django debug toolbar
-    path('__debug__/', include('debug_toolbar.urls')),
-]
+    urlpatterns.append(path('__debug__/', include('debug_toolbar.urls')))
 
 handler404 = NotFoundView.as_view()